@@ -0,0 +1,262 @@
+"""
+benchmark_suite.py
+
+Benchmark suite of the analysis on seeded synthetic spectra (see `xrf.synthetic`):
+times `calib.read_data`, `calib.fit_peak`, `calib.calib_curve` and the whole
+pipeline (read each spectrum, fit its peaks, calibrate) at 10, 1k and 100k
+spectra, and writes the timings as JSON, by default to
+`outputs/benchmarks/<commit>.json`. Pass `--compare old.json` to compare them with
+an earlier run, e.g. of the previous commit.
+
+At most `max_files` distinct spectra are generated and written; larger runs cycle
+through them, so their files may be read from the page cache.
+
+Author: Shiqi Xu
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+import warnings
+
+import numpy as np
+import scipy
+
+from benchmarks import best_time
+from xrf import batch, calib, fitcache, fitting, lines, synthetic
+
+
+sizes = [10, 1000, 100000]
+max_files = 1000  # distinct synthetic files written; larger sizes cycle through them
+seed = 0
+
+# Au L lines on the Default channel scale: [height, centre, std] and energy (keV)
+peaks = [[120, 797.0, 5.5], [34, 940.4, 7.4], [5, 1101.3, 9.0]]
+energies = [lines.energy("Au", line) for line in ("La1", "Lb1", "Lg1")]
+windows = [(int(c - 4 * s), int(c + 4 * s) + 1) for _, c, s in peaks]
+
+benchmark = ["read_data", "fit_peak", "calib_curve", "pipeline", "pipeline_batch"]
+
+
+class Workload:
+    """`n_spectra` synthetic spectra, cycling through at most `max_files` distinct
+    ones, as files, counts, and the peak centres fitted to them.
+    """
+
+    def __init__(self, directory: Path, n_spectra: int, n_distinct: int, seed: int):
+        continuum = synthetic.exponential_continuum()
+        distinct = synthetic.spectra(
+            min(n_spectra, n_distinct), peaks, 2048, continuum, seed
+        )
+        self.n_spectra = n_spectra
+        self.counts = distinct
+        self.files = synthetic.write_spectra(directory, distinct)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fits = [fit_peaks(counts) for counts in distinct]
+        self.centres = np.array([[fit.params[1] for fit in f] for f in fits])
+        self.centre_errs = np.array([[fit.errs[1] for fit in f] for f in fits])
+
+    def rows(self) -> range:
+        return range(self.n_spectra)
+
+    def row(self, i: int) -> int:
+        return i % len(self.counts)
+
+
+def fit_peaks(counts: np.ndarray) -> List[fitting.PeakFit]:
+    channels = np.arange(len(counts))
+    return [
+        fitting.fit_gaussian(channels, counts, first, last, guess)
+        for (first, last), guess in zip(windows, peaks)
+    ]
+
+
+def run_read_data(work: Workload):
+    for i in work.rows():
+        calib.read_data(work.files[work.row(i)], use_cache=False)
+
+
+def run_fit_peak(work: Workload):
+    channels = np.arange(work.counts.shape[1])
+    for i in work.rows():
+        counts = work.counts[work.row(i)]
+        for (first, last), guess in zip(windows, peaks):
+            calib.fit_peak(channels, counts, first, last, guess, "synthetic")
+
+
+def run_calib_curve(work: Workload):
+    for i in work.rows():
+        j = work.row(i)
+        calib.calib_curve(
+            work.centres[j], work.centre_errs[j], energies, [0, 0], "synthetic"
+        )
+
+
+def run_pipeline(work: Workload):
+    """Reads, fits and calibrates one spectrum at a time, as the scripts do."""
+    for i in work.rows():
+        counts = calib.read_data(work.files[work.row(i)], use_cache=False)
+        channels = np.arange(len(counts))
+        fits = [
+            calib.fit_peak(channels, counts, first, last, guess, "synthetic")
+            for (first, last), guess in zip(windows, peaks)
+        ]
+        calib.calib_curve(
+            np.array([params[1] for params, _ in fits]),
+            np.array([errs[1] for _, errs in fits]),
+            energies,
+            [0, 0],
+            "synthetic",
+        )
+
+
+def run_pipeline_batch(work: Workload, chunk: int = 1000):
+    """The pipeline with the vectorized fits, `chunk` spectra at a time."""
+    rows = list(work.rows())
+    for start in range(0, len(rows), chunk):
+        spectra = [
+            calib.read_data(work.files[work.row(i)], use_cache=False)
+            for i in rows[start : start + chunk]
+        ]
+        params, errs = batch.fit_peaks(
+            [
+                (counts, first, last, guess)
+                for counts in spectra
+                for (first, last), guess in zip(windows, peaks)
+            ]
+        )
+        n_peaks = len(peaks)
+        centres = params[:, 1].reshape(-1, n_peaks)
+        centre_errs = errs[:, 1].reshape(-1, n_peaks)
+        fitting.fit_calibrations(centres, centre_errs, [energies] * len(centres))
+
+
+runners: Dict[str, Callable[[Workload], None]] = {
+    "read_data": run_read_data,
+    "fit_peak": run_fit_peak,
+    "calib_curve": run_calib_curve,
+    "pipeline": run_pipeline,
+    "pipeline_batch": run_pipeline_batch,
+}
+
+
+def commit() -> Optional[str]:
+    """Short hash of the checked-out commit, marked "-dirty" if files changed."""
+    repo = Path(__file__).resolve().parent
+    try:
+        head = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=repo,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=repo,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head + ("-dirty" if status.strip() else "")
+
+
+def run_suite(
+    names: Sequence[str], sizes: Sequence[int], n_distinct: int, seed: int
+) -> dict:
+    """Times each benchmark at each size.
+
+    Returns:
+        dict: Environment and results, as written to JSON.
+    """
+    results = []
+    for n_spectra in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            work = Workload(Path(tmp_dir), n_spectra, n_distinct, seed)
+            repeat = 3 if n_spectra <= 1000 else 1
+            for name in names:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    seconds = best_time(lambda: runners[name](work), repeat)
+                results.append(
+                    {
+                        "benchmark": name,
+                        "n_spectra": n_spectra,
+                        "seconds": seconds,
+                        "per_spectrum_ms": 1e3 * seconds / n_spectra,
+                    }
+                )
+                print(
+                    f"{name:15s} {n_spectra:7d} spectra: {seconds:10.3f} s "
+                    f"({1e3 * seconds / n_spectra:.3f} ms per spectrum)"
+                )
+    return {
+        "commit": commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "machine": platform.platform(),
+        "seed": seed,
+        "distinct_files": n_distinct,
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict, tolerance: float = 0.1):
+    """Prints the time of each benchmark of `new` against `old`, marking those
+    more than `tolerance` slower.
+    """
+    before = {(r["benchmark"], r["n_spectra"]): r["seconds"] for r in old["results"]}
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    for result in new["results"]:
+        key = (result["benchmark"], result["n_spectra"])
+        if key not in before:
+            continue
+        ratio = result["seconds"] / before[key]
+        flag = "  slower" if ratio > 1 + tolerance else ""
+        print(
+            f"  {key[0]:15s} {key[1]:7d} spectra: {before[key]:10.3f} s -> "
+            f"{result['seconds']:10.3f} s ({ratio:.2f}x){flag}"
+        )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark suite of the analysis on synthetic spectra."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=sizes, metavar="N")
+    parser.add_argument("--only", nargs="+", default=benchmark, choices=benchmark)
+    parser.add_argument("--max-files", type=int, default=max_files, metavar="N")
+    parser.add_argument("--seed", type=int, default=seed)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="JSON file of the results (default: outputs/benchmarks/<commit>.json)",
+    )
+    parser.add_argument(
+        "--compare", type=Path, metavar="JSON", help="earlier results to compare to"
+    )
+    args = parser.parse_args()
+    fitcache.configure(enable=False)  # time the fits, not cache lookups
+
+    report = run_suite(args.only, args.sizes, args.max_files, args.seed)
+    output = args.output or (
+        Path.cwd() / "outputs" / "benchmarks" / f"{report['commit'] or 'results'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"results saved to {output}")
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            compare(json.load(file), report)
@@ -0,0 +1,597 @@
+"""
+benchmarks.py
+
+Timing comparisons for the xrf package, run on the spectra in `data/`.
+
+Author: Shiqi Xu
+"""
+
+import os
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Callable, List, Tuple
+import warnings
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+from xrf import (
+    archive,
+    background,
+    batch,
+    cache,
+    calib,
+    combine,
+    engine,
+    fitcache,
+    fitting,
+    lines,
+    poisson,
+    propagate,
+    render,
+    resample,
+)
+
+
+benchmark = [
+    "read_data",
+    "read_data_cache",
+    "fit_batch",
+    "fit_jac",
+    "render",
+    "snip",
+    "multiplet",
+    "poisson",
+    "calibration",
+    "combine",
+    "lines",
+    "propagate",
+]
+
+
+def read_data_two_pass(filename: Path) -> np.ndarray:
+    """The original `calib.read_data`: one pass to find `<<DATA>>`/`<<END>>`,
+    then a second one through `np.genfromtxt`. Kept for comparison only.
+    """
+    with open(filename, "r", encoding="latin-1") as file:
+        line_no = 0
+        for line in file:
+            line_no += 1
+            if line == "<<DATA>>\n":
+                header_rows = line_no
+            if line == "<<END>>\n":
+                footer_rows = -line_no + 1
+        footer_rows += line_no
+    return np.genfromtxt(
+        filename,
+        dtype=int,
+        skip_header=header_rows,
+        skip_footer=footer_rows,
+        encoding="latin-1",
+    )
+
+
+def best_time(func: Callable, repeat: int = 5, number: int = 1) -> float:
+    """Best wall time of `func` in seconds, out of `repeat` runs of `number` calls."""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def bench_read_data(files: List[Path], repeat: int = 5):
+    """Compares the two-pass and single-pass readers over every file."""
+    for filename in files:
+        assert np.array_equal(
+            read_data_two_pass(filename), calib.read_data(filename, use_cache=False)
+        )
+
+    t_old = best_time(lambda: [read_data_two_pass(f) for f in files], repeat)
+    t_new = best_time(
+        lambda: [calib.read_data(f, use_cache=False) for f in files], repeat
+    )
+    print(f"read_data over {len(files)} files")
+    print(f"  two-pass (genfromtxt): {1e3 * t_old / len(files):8.3f} ms/file")
+    print(f"  single-pass:           {1e3 * t_new / len(files):8.3f} ms/file")
+    print(f"  speedup:               {t_old / t_new:8.1f}x")
+
+
+def bench_read_data_cache(files: List[Path], repeat: int = 5):
+    """Compares parsing every file against loading it from a warm spectrum cache,
+    kept in a temporary directory rather than the user's.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cache.configure(directory=Path(directory), enable=True)
+        try:
+            t_cold = best_time(lambda: [calib.read_data(f) for f in files], repeat=1)
+            t_warm = best_time(lambda: [calib.read_data(f) for f in files], repeat)
+        finally:
+            cache.configure(directory=Path.cwd() / ".xrf_cache", enable=False)
+    t_parse = best_time(
+        lambda: [calib.read_data(f, use_cache=False) for f in files], repeat
+    )
+    print(f"read_data through the spectrum cache, {len(files)} files")
+    print(f"  no cache:   {1e3 * t_parse / len(files):8.3f} ms/file")
+    print(f"  cold cache: {1e3 * t_cold / len(files):8.3f} ms/file")
+    print(f"  warm cache: {1e3 * t_warm / len(files):8.3f} ms/file")
+
+
+def load_windows(data_path: Path) -> List[batch.Window]:
+    """Fit windows of the samples of the "metals" analysis in the catalog
+    (`data_path / "catalog.json"`), with the counts of their spectra.
+    """
+    catalog = engine.Engine(data_path / "catalog.json")
+    windows = []
+    for name in catalog.analyses["metals"]["samples"]:
+        sample = catalog.sample(name)
+        counts = calib.read_data(sample.file)
+        windows += [
+            (counts, peak.first_channel, peak.last_channel, peak.guess)
+            for peak in sample.peaks
+        ]
+    return windows
+
+
+def fit_each(windows: List[batch.Window]) -> Tuple[np.ndarray, np.ndarray]:
+    """`curve_fit` once per window, as `calib.fit_peak` does."""
+    fits, errs = [], []
+    for counts, first, last, guess in windows:
+        channels = np.arange(first, last)
+        fit, cov = curve_fit(calib.gaussian, channels, counts[first:last], p0=guess)
+        fits.append(fit)
+        errs.append(np.sqrt(np.diag(cov)))
+    return np.array(fits), np.array(errs)
+
+
+def bench_fit_batch(data_path: Path, repeat: int = 5, copies: int = 50):
+    """Compares per-window `curve_fit` against batched solves of all windows, for
+    the metals windows and for `copies` copies of them.
+    """
+    windows = load_windows(data_path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # inf covariance of ill-conditioned windows
+        serial_fit, serial_err = fit_each(windows)
+        batch_fit, batch_err = batch.fit_peaks(windows)
+
+        centre_diff = np.abs(batch_fit[:, 1] - serial_fit[:, 1])
+        err_ratio = batch_err[:, 1] / serial_err[:, 1]
+        print(f"Gaussian fits of the {len(windows)} metals windows")
+        print(f"  max |centre difference|:    {np.max(centre_diff):.2e} channels")
+        print(
+            "  centre uncertainty ratio:   "
+            f"{err_ratio.min():.4f} to {err_ratio.max():.4f}"
+        )
+        for n_copies in [1, copies]:
+            t_serial = best_time(lambda: fit_each(windows * n_copies), repeat)
+            t_batch = best_time(lambda: batch.fit_peaks(windows * n_copies), repeat)
+            print(f"  {len(windows) * n_copies} windows")
+            print(f"    curve_fit per window: {1e3 * t_serial:8.3f} ms")
+            print(f"    batched LM:           {1e3 * t_batch:8.3f} ms")
+            print(f"    speedup:              {t_serial / t_batch:8.1f}x")
+
+
+def fit_each_counted(
+    windows: List[batch.Window], analytic_jac: bool, estimate_guess: bool
+) -> Tuple[np.ndarray, int]:
+    """Like `fit_each`, also counting model and Jacobian evaluations."""
+    fits, n_evals = [], 0
+    for counts, first, last, guess in windows:
+        channels = np.arange(first, last)
+        if estimate_guess:
+            guess = calib.estimate_gaussian(channels, counts[first:last])
+        fit, _, info, _, _ = curve_fit(
+            calib.gaussian,
+            channels,
+            counts[first:last],
+            p0=guess,
+            jac=calib.gaussian_jac if analytic_jac else None,
+            full_output=True,
+        )
+        fits.append(fit)
+        n_evals += info["nfev"] + info.get("njev", 0)
+    return np.array(fits), n_evals
+
+
+def bench_fit_jac(data_path: Path, repeat: int = 5):
+    """Compares finite-difference and analytic Jacobians, with hand-typed and
+    estimated starting guesses, over the metals windows.
+    """
+    windows = load_windows(data_path)
+    modes = {
+        "finite differences, hand guesses": (False, False),
+        "analytic Jacobian, hand guesses": (True, False),
+        "analytic Jacobian, estimated guesses": (True, True),
+    }
+    print(f"curve_fit of the {len(windows)} metals windows")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        reference, _ = fit_each_counted(windows, False, False)
+        for label, (analytic_jac, estimate_guess) in modes.items():
+            fits, n_evals = fit_each_counted(windows, analytic_jac, estimate_guess)
+            t_fit = best_time(
+                lambda: fit_each_counted(windows, analytic_jac, estimate_guess), repeat
+            )
+            centre_diff = np.abs(fits[:, 1] - reference[:, 1])
+            print(f"  {label}")
+            print(f"    evaluations (nfev + njev): {n_evals:6d}")
+            print(f"    wall time:                 {1e3 * t_fit:8.3f} ms")
+            print(
+                f"    windows with centre moved > 0.01 channel: "
+                f"{np.count_nonzero(centre_diff > 0.01)}"
+            )
+
+
+def bench_render(data_path: Path, repeat: int = 3, copies: int = 4):
+    """Compares rendering the peak-fit figures of `copies` copies of the metals
+    windows in this process against a pool of one worker per CPU.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fits = [
+            fitting.fit_gaussian(np.arange(len(counts)), counts, first, last, guess)
+            for counts, first, last, guess in load_windows(data_path)
+        ]
+    workers = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        figures = [
+            render.Figure("plot_peak_fit", Path(tmp_dir) / f"fit_{i}.png", (fit, ""))
+            for i, fit in enumerate(fits * copies)
+        ]
+        t_serial = best_time(lambda: render.render(figures, workers=1), repeat)
+        t_pool = best_time(lambda: render.render(figures, workers=workers), repeat)
+    print(f"rendering {len(figures)} peak-fit figures")
+    print(f"  1 process:     {1e3 * t_serial:8.1f} ms")
+    print(f"  {workers:2d} workers:    {1e3 * t_pool:8.1f} ms")
+    print(f"  speedup:       {t_serial / t_pool:8.1f}x")
+
+
+def bench_snip(data_files: List[Path], repeat: int = 5, sizes=(1, 16, 256, 1024)):
+    """Times SNIP backgrounds of N x 2048 stacks (copies of the spectra in `data/`)
+    in one call against one call per spectrum, then compares fits of the broad
+    metals windows with and without the background subtracted.
+    """
+    spectra = np.array([calib.read_data(filename) for filename in data_files])
+    print("SNIP background of N x 2048 stacks")
+    for size in sizes:
+        stack = np.resize(spectra, (size, spectra.shape[1]))
+        t_stack = best_time(lambda: background.snip(stack), repeat)
+        t_each = best_time(lambda: [background.snip(row) for row in stack], repeat)
+        print(f"  N = {size}")
+        print(f"    whole stack:  {1e3 * t_stack:8.3f} ms")
+        print(f"    per spectrum: {1e6 * t_stack / size:8.1f} us in the stack")
+        print(f"    one by one:   {1e3 * t_each:8.3f} ms")
+        print(f"    speedup:      {t_each / t_stack:8.1f}x")
+
+    print("broad metals windows (centre, std), fitted as is / net of SNIP")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for counts, first, last, guess in load_windows(data_files[0].parent):
+            if last - first < 150:
+                continue
+            channels = np.arange(len(counts))
+            continuum = background.snip(counts)
+            fits = [
+                fitting.fit_gaussian(channels, counts, first, last, guess, True, bg)
+                for bg in (None, continuum)
+            ]
+            print(
+                f"  [{first}, {last}): "
+                + " / ".join(f"{f.params[1]:.1f}, {f.params[2]:.1f}" for f in fits)
+                + f"  (background {np.sum(continuum[first:last]):.0f} of "
+                f"{np.sum(counts[first:last])} counts)"
+            )
+
+
+# overlapping lines fitted as adjacent windows: (file, [(first, last, guess), ...])
+multiplet_windows = [
+    (
+        "20220330_pb210_run1.csv",
+        [(999, 1026, [12, 1013, 2]), (1021, 1077, [23, 1045, 3])],
+    ),
+    (
+        "20220401_1800s_canadian_coin.csv",
+        [(664, 703, [100, 691, 60]), (703, 754, [100, 712, 50])],
+    ),
+    (
+        "20220401_1600s_chinese_coin.csv",
+        [(658, 704, [312, 690, 50]), (705, 750, [60, 713, 50])],
+    ),
+    (
+        "20220401_1964_canadian_quarter.csv",
+        [(288, 356, [60, 323, 10]), (331, 390, [13, 357, 10])],
+    ),
+    (
+        "20220331_ti_high_rate.csv",
+        [(175 - 3, 189 + 3, [110, 181, 2.2]), (193 - 4, 205 + 4, [17, 198, 1.7])],
+    ),
+]
+
+
+def condition(cov: np.ndarray) -> float:
+    """Condition number of the correlation matrix of a fit."""
+    errs = np.sqrt(np.diag(cov))
+    if not np.all(np.isfinite(errs)) or np.any(errs == 0):
+        return np.inf
+    return float(np.linalg.cond(cov / np.outer(errs, errs)))
+
+
+def bench_multiplet(data_path: Path, repeat: int = 5):
+    """Compares separate fits of adjacent windows over overlapping lines against
+    one multiplet fit of their union, with a linear background.
+    """
+    print("overlapping lines: separate windows vs one multiplet fit")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for name, peaks in multiplet_windows:
+            counts = calib.read_data(data_path / name)
+            channels = np.arange(len(counts))
+            first = min(window[0] for window in peaks)
+            last = max(window[1] for window in peaks)
+            guesses = [window[2] for window in peaks]
+
+            def separate():
+                return [
+                    fitting.fit_gaussian(channels, counts, *window, analytic_jac=True)
+                    for window in peaks
+                ]
+
+            def joint():
+                return fitting.fit_multiplet(channels, counts, first, last, guesses)
+
+            fits, multiplet = separate(), joint()
+            t_separate = best_time(separate, repeat)
+            t_joint = best_time(joint, repeat)
+            print(f"  {name}, channels [{first}, {last})")
+            for label, peak_fits, t_fit, cond in [
+                (
+                    "separate",
+                    fits,
+                    t_separate,
+                    max(condition(fit.cov) for fit in fits),
+                ),
+                ("multiplet", multiplet.peak_fits(), t_joint, condition(multiplet.cov)),
+            ]:
+                centres = ", ".join(
+                    f"{fit.params[1]:.2f} +- {fit.errs[1]:.2f}" for fit in peak_fits
+                )
+                print(
+                    f"    {label:9s} {1e3 * t_fit:7.2f} ms, cond {cond:9.1f}: {centres}"
+                )
+
+
+def bench_poisson(data_path: Path, repeat: int = 5, replicas: int = 400):
+    """Compares least-squares and Poisson maximum-likelihood Gaussian fits: their
+    iterations to convergence over the metals windows, and their bias on
+    simulated low-count peaks like Au peak 3 and Ti peak 3.
+    """
+    windows = load_windows(data_path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        iterations, evaluations = [], []
+        for counts, first, last, guess in windows:
+            channels = np.arange(first, last)
+            _, _, info, _, _ = curve_fit(
+                calib.gaussian,
+                channels,
+                counts[first:last],
+                p0=guess,
+                jac=calib.gaussian_jac,
+                full_output=True,
+            )
+            iterations.append(info["njev"])
+            evaluations.append(info["nfev"] + info["njev"])
+        fits = poisson.fit_peaks(windows)
+        t_lsq = best_time(lambda: fit_each(windows), repeat)
+        t_poisson = best_time(lambda: poisson.fit_peaks(windows), repeat)
+    print(f"Gaussian fits of the {len(windows)} metals windows")
+    print("  iterations (Jacobian evaluations) to convergence")
+    print(
+        f"    curve_fit least squares: mean {np.mean(iterations):5.1f}, "
+        f"max {np.max(iterations):3d}"
+    )
+    print(
+        f"    Poisson IRLS:            mean {np.mean(fits.n_iter):5.1f}, "
+        f"max {np.max(fits.n_iter):3d} ({np.count_nonzero(fits.converged)} converged)"
+    )
+    print("  model and Jacobian evaluations")
+    print(
+        f"    curve_fit least squares: mean {np.mean(evaluations):5.1f}, "
+        f"max {np.max(evaluations):3d}"
+    )
+    print(
+        f"    Poisson IRLS:            mean {np.mean(fits.nfev):5.1f}, "
+        f"max {np.max(fits.nfev):3d}"
+    )
+    print(f"  curve_fit per window: {1e3 * t_lsq:8.3f} ms")
+    print(f"  Poisson, batched:     {1e3 * t_poisson:8.3f} ms")
+
+    rng = np.random.default_rng(0)
+    channels = np.arange(2048)
+    print(f"simulated peaks, {replicas} replicas: mean fitted / true area")
+    for label, first, last, truth in [
+        ("Au peak 3", 1011, 1116, [5, 1066, 19]),
+        ("Ti peak 3", 397, 602, [2, 536, 45]),
+    ]:
+        spectra = rng.poisson(calib.gaussian(channels, *truth), (replicas, 2048))
+        simulated = [(counts, first, last, truth) for counts in spectra]
+        area = truth[0] * truth[2] * np.sqrt(2 * np.pi)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            lsq, _ = batch.fit_peaks(simulated)
+            mle = poisson.fit_peaks(simulated).params
+        for method, params in [("least squares", lsq), ("Poisson", mle)]:
+            ratio = np.abs(params[:, 0] * params[:, 2]) * np.sqrt(2 * np.pi) / area
+            print(
+                f"  {label}, {method:13s}: {np.mean(ratio):.3f} +- "
+                f"{np.std(ratio) / np.sqrt(replicas):.3f}"
+            )
+
+
+def bench_calibration(repeat: int = 5, n_sets: int = 500):
+    """Times calibration-line fits of many point sets: `curve_fit` per set, as
+    `fitting.fit_calibration` used to, against `fitting.fit_calibrations` at once.
+    """
+    rng = np.random.default_rng(0)
+    sets = []
+    for size in rng.integers(2, 6, n_sets):
+        centres = np.sort(rng.uniform(100, 2000, size))
+        errs = rng.uniform(0.05, 2, size)
+        sets.append((centres, errs, 0.012 * centres + rng.normal(0.07, 0.05, size)))
+
+    def fit_each_curve_fit():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return [
+                curve_fit(fitting.line, x, y, p0=[0, 0], sigma=sigma)
+                for x, sigma, y in sets
+            ]
+
+    fits = fitting.fit_calibrations(*zip(*sets))
+    deviation = max(
+        np.max(np.abs(fit.params - params) / np.abs(params))
+        for fit, (params, _) in zip(fits, fit_each_curve_fit())
+    )
+    t_each = best_time(fit_each_curve_fit, repeat)
+    t_batch = best_time(lambda: fitting.fit_calibrations(*zip(*sets)), repeat)
+    print(f"calibration lines through {n_sets} sets of 2-5 points")
+    print(f"  curve_fit per set:        {1e3 * t_each:8.3f} ms")
+    print(f"  closed form, vectorized:  {1e3 * t_batch:8.3f} ms")
+    print(f"  max relative difference of the parameters: {deviation:.1e}")
+
+
+def bench_combine(data_files: List[Path], repeat: int = 3, copies: int = 100):
+    """Times combining every spectrum of a memory-mapped archive of `copies` copies
+    of `data/` onto one energy grid: rebinning each spectrum and adding them,
+    against `combine.combine_archive`.
+    """
+    modes_lines = {"default": (0.01205, 0.1096), "high_rate": (0.02440, -0.1415)}
+    edges = resample.energy_grid(0, 40, 0.02)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        spectra = archive.SpectrumArchive(Path(tmp_dir))
+        spectra.extend(calib.read_spectrum(f) for f in data_files * copies)
+        modes = spectra.column("mode")
+        calibrations = {
+            mode: modes_lines.get(mode, modes_lines["default"]) for mode in modes
+        }
+
+        def each():
+            total = np.zeros(len(edges) - 1)
+            for row, mode in enumerate(modes):
+                source = resample.channel_edges(spectra.channels, *calibrations[mode])
+                total += resample.rebin(spectra[row], source, edges)
+            return total
+
+        combined = combine.combine_archive(spectra, None, calibrations, edges)
+        deviation = np.max(np.abs(combined.counts - each()))
+        t_each = best_time(each, repeat)
+        t_combine = best_time(
+            lambda: combine.combine_archive(spectra, None, calibrations, edges), repeat
+        )
+    print(f"combining {len(modes)} archived spectra onto {len(edges) - 1} energy bins")
+    print(f"  rebin each, then add: {1e3 * t_each:8.1f} ms")
+    print(f"  combine_archive:      {1e3 * t_combine:8.1f} ms")
+    print(f"  speedup:              {t_each / t_combine:8.1f}x")
+    print(f"  max difference: {deviation:.1e} counts")
+
+
+def bench_lines(repeat: int = 5, n_peaks: int = 10000, tolerance: float = 0.05):
+    """Times finding every emission line within +/- `tolerance` keV of `n_peaks`
+    peak energies: scanning the whole table per peak, against `LineTable.within`.
+    """
+    table = lines.table()
+    energies = np.random.default_rng(0).uniform(1, 40, n_peaks)
+
+    def scan_each():
+        return [np.flatnonzero(np.abs(table.energy - e) <= tolerance) for e in energies]
+
+    matches = table.within(energies, tolerance)
+    found = np.split(
+        matches.line, np.cumsum(np.bincount(matches.query, minlength=n_peaks))[:-1]
+    )
+    assert all(np.array_equal(a, b) for a, b in zip(found, scan_each()))
+    t_scan = best_time(scan_each, repeat)
+    t_search = best_time(lambda: table.within(energies, tolerance), repeat)
+    print(f"lines within {tolerance} keV of {n_peaks} peaks, {len(table)} lines")
+    print(f"  scan per peak:   {1e3 * t_scan:8.3f} ms")
+    print(f"  binary search:   {1e3 * t_search:8.3f} ms")
+
+
+def bench_propagate(
+    repeat: int = 5, n_calibrations: int = 200, n_peaks: int = 10, n_draws: int = 2000
+):
+    """Times Monte Carlo propagation of `n_peaks` peak energies on each of
+    `n_calibrations` calibration lines, one call per line against one batched call,
+    and checks the batched uncertainties against the analytic ones.
+    """
+    rng = np.random.default_rng(0)
+    centres = rng.uniform(100, 1500, n_peaks)
+    centre_errs = rng.uniform(0.05, 0.5, n_peaks)
+    params = np.c_[
+        rng.uniform(0.028, 0.032, n_calibrations),
+        rng.uniform(-0.1, 0.1, n_calibrations),
+    ]
+    slope_errs = rng.uniform(1e-5, 1e-4, n_calibrations)
+    intercept_errs = rng.uniform(0.01, 0.05, n_calibrations)
+    rho = rng.uniform(-0.95, -0.5, n_calibrations)
+    cov = np.stack(
+        [
+            np.c_[slope_errs**2, rho * slope_errs * intercept_errs],
+            np.c_[rho * slope_errs * intercept_errs, intercept_errs**2],
+        ],
+        axis=1,
+    )
+
+    def each():
+        return [
+            propagate.monte_carlo(centres, centre_errs, p, c, n_draws)
+            for p, c in zip(params, cov)
+        ]
+
+    def batched():
+        return propagate.monte_carlo(centres, centre_errs, params, cov, n_draws)
+
+    exact = propagate.analytic(centres, centre_errs, params, cov)
+    error = np.max(np.abs(batched().errs / exact.errs - 1))
+    t_each = best_time(each, repeat)
+    t_batched = best_time(batched, repeat)
+    t_analytic = best_time(
+        lambda: propagate.analytic(centres, centre_errs, params, cov), repeat
+    )
+    print(
+        f"propagate {n_peaks} peaks on {n_calibrations} calibrations, "
+        f"{n_draws} draws"
+    )
+    print(f"  per calibration: {1e3 * t_each:8.3f} ms")
+    print(f"  batched:         {1e3 * t_batched:8.3f} ms")
+    print(f"  analytic:        {1e3 * t_analytic:8.3f} ms")
+    print(f"  max relative error of Monte Carlo uncertainties: {error:.3f}")
+
+
+if __name__ == "__main__":
+
+    data_path = Path.cwd() / "data"
+    data_files = sorted(data_path.glob("*.csv"))
+    fitcache.configure(enable=False)  # time the fits, not cache lookups
+
+    if "read_data" in benchmark:
+        bench_read_data(data_files)
+    if "read_data_cache" in benchmark:
+        bench_read_data_cache(data_files)
+    if "fit_batch" in benchmark:
+        bench_fit_batch(data_path)
+    if "fit_jac" in benchmark:
+        bench_fit_jac(data_path)
+    if "render" in benchmark:
+        bench_render(data_path)
+    if "snip" in benchmark:
+        bench_snip(data_files)
+    if "multiplet" in benchmark:
+        bench_multiplet(data_path)
+    if "poisson" in benchmark:
+        bench_poisson(data_path)
+    if "calibration" in benchmark:
+        bench_calibration()
+    if "combine" in benchmark:
+        bench_combine(data_files)
+    if "lines" in benchmark:
+        bench_lines()
+    if "propagate" in benchmark:
+        bench_propagate()
@@ -3,15 +3,25 @@ calibration.py
 
 Calibration of _Default_ and _High Rate_ detector settings.
 
+The Pb-210 and Cs-137 peaks are declared in `data/catalog.json` (samples "pb210"
+and "cs137_high_rate", analysis "radioactive"). Each calibration is loaded on
+first use from its artifact in `outputs/calibrations/` (see `xrf.artifacts`),
+recomputed only if the spectrum or its catalog entry changed, so importing this
+module neither reads data nor writes figures. The results are also available
+under their original module-level names (`calibration.pb210_calib_fit`,
+`calibration.energies_default`, ...), evaluated on first access. Run this file
+as a script to recompute both calibrations and save their figures.
+
 Author: Shiqi Xu
 """
 
-from pathlib import Path
+from functools import lru_cache
+from operator import attrgetter
+from typing import NamedTuple
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-from xrf import calib
+from xrf import cache, calib, engine, fitting, profiling
 
 
 ## mode: "default" and/or "high_rate"
@@ -19,154 +29,93 @@ from xrf import calib
 # mode = ["high_rate"]
 mode = ["default", "high_rate"]
 
-
-data_path = Path.cwd() / "data"
-fig_path = Path.cwd() / "outputs" / "calib_radioactive"
+jobs = None  # processes fitting and rendering; None for one per CPU, 1 serial
 
 SDD_channels = np.arange(0, 2048)
 
-
-if "default" in mode:
-    # region: calibration of FastSDD Default PX5 setting
-    pb210_data = calib.read_data(data_path / "20220330_pb210_run1.csv")
-    pb210_peak_centres = []
-    pb210_peak_centre_errs = []
-
-    pb210_peak1_fit, pb210_peak1_err = calib.fit_peak(
-        SDD_channels,
-        pb210_data,
-        846,
-        886 + 5,
-        [48, 866, 5],
-        "Pb-210",
-        save_fig=True,
-        path_save=fig_path / "20220330_pb210_peak1_fit.png",
-    )
-    pb210_peak_centres.append(pb210_peak1_fit[1])
-    pb210_peak_centre_errs.append(pb210_peak1_err[1])
-
-    pb210_peak2_fit, pb210_peak2_err = calib.fit_peak(
-        SDD_channels,
-        pb210_data,
-        1003 - 4,
-        1025 + 1,
-        [12, 1013, 2],
-        "Pb-210",
-        save_fig=True,
-        path_save=fig_path / "20220330_pb210_peak2_fit.png",
-    )
-    pb210_peak_centres.append(pb210_peak2_fit[1])
-    pb210_peak_centre_errs.append(pb210_peak2_err[1])
-
-    pb210_peak3_fit, pb210_peak3_err = calib.fit_peak(
-        SDD_channels,
-        pb210_data,
-        1027 - 6,
-        1074 + 3,
-        [23, 1045, 3],
-        "Pb-210",
-        save_fig=True,
-        path_save=fig_path / "20220330_pb210_peak3_fit.png",
-    )
-    pb210_peak_centres.append(pb210_peak3_fit[1])
-    pb210_peak_centre_errs.append(pb210_peak3_err[1])
-
-    pb210_peak4_fit, pb210_peak4_err = calib.fit_peak(
-        SDD_channels,
-        pb210_data,
-        1229 - 7,
-        1263 + 15,
-        [4, 1246, 3],
-        "Pb-210",
-        save_fig=True,
-        path_save=fig_path / "20220330_pb210_peak4_fit.png",
-    )
-    pb210_peak_centres.append(pb210_peak4_fit[1])
-    pb210_peak_centre_errs.append(pb210_peak4_err[1])
-
-    pb210_peak_centres = np.array(pb210_peak_centres)
-    pb210_peak_centre_errs = np.array(pb210_peak_centre_errs)
-
-    pb210_calib_fit, pb210_calib_err = calib.calib_curve(
-        pb210_peak_centres,
-        pb210_peak_centre_errs,
-        [
-            10.555,
-            12.305,
-            12.618,
-            15.222,
-        ],
-        [0, 0],
-        "Pb-210",
-        save_fig=True,
-        path_save=fig_path / "calib_fastSDD_default.png",
-    )
-
-    energies_default = calib.line(SDD_channels, pb210_calib_fit[0], pb210_calib_fit[1])
-
-    plt.figure()
-    plt.plot(energies_default, pb210_data, ".", markersize=4)
-    plt.title("Pb-210 Natural Decay, Default FastSDD Setting")
-    plt.xlabel("Energy (keV)")
-    plt.ylabel("Count")
-    plt.savefig(fig_path / "pb210_spectrum.png")
-    plt.close()
-    # endregion: calibration of FastSDD Default PX5 setting
-
-if "high_rate" in mode:
-    # region: calibration of FastSDD High Rate PX5 setting
-    cs137_data = calib.read_data(data_path / "20220331_cs137_high_rate.csv")
-    cs137_peak_centres = []
-    cs137_peak_centre_errs = []
-
-    cs137_peak1_fit, cs137_peak1_err = calib.fit_peak(
-        SDD_channels,
-        cs137_data,
-        1251 - 2,
-        1300 + 4,
-        [43, 1274, 5],
-        "Cs-137",
-        save_fig=True,
-        path_save=fig_path / "20220331_cs137_high_rate_peak1_fit.png",
-    )
-    cs137_peak_centres.append(cs137_peak1_fit[1])
-    cs137_peak_centre_errs.append(cs137_peak1_err[1])
-
-    cs137_peak2_fit, cs137_peak2_err = calib.fit_peak(
-        SDD_channels,
-        cs137_data,
-        1429 - 1,
-        1454 + 1,
-        [9, 1440, 5],
-        "Cs-137",
-        save_fig=True,
-        path_save=fig_path / "20220331_cs137_high_rate_peak2_fit.png",
-    )
-    cs137_peak_centres.append(cs137_peak2_fit[1])
-    cs137_peak_centre_errs.append(cs137_peak2_err[1])
-
-    cs137_peak_centres = np.array(cs137_peak_centres)
-    cs137_peak_centre_errs = np.array(cs137_peak_centre_errs)
-
-    cs137_calib_fit, cs137_calib_err = calib.calib_curve(
-        cs137_peak_centres,
-        cs137_peak_centre_errs,
-        [30.973, 34.985],
-        [0, 0],
-        "Cs-137",
-        save_fig=True,
-        path_save=fig_path / "calib_fastSDD_high_rate.png",
-    )
-
-    energies_high_rate = calib.line(
-        SDD_channels, cs137_calib_fit[0], cs137_calib_fit[1]
-    )
-
-    plt.figure()
-    plt.plot(energies_high_rate, cs137_data, ".", markersize=4)
-    plt.title("Cs-137 Natural Decay, High Rate FastSDD Setting")
-    plt.xlabel("Energy (keV)")
-    plt.ylabel("Count")
-    plt.savefig(fig_path / "cs137_spectrum.png")
-    plt.close()
-    # endregion: calibration of FastSDD High Rate PX5 setting
+# catalog sample and calibration of each detector setting
+sources = {"default": "pb210", "high_rate": "cs137_high_rate"}
+calibrations = {"default": "pb210_default", "high_rate": "cs137_high_rate"}
+
+
+class Calibration(NamedTuple):
+    """Channel-to-energy calibration of one detector setting.
+
+    Attributes:
+        counts (np.ndarray[int]): Spectrum of the calibration source.
+        fit (fitting.CalibFit): Calibration line and the peak centres it was
+            fitted to.
+        energies (np.ndarray[float]): Energy of each channel (keV).
+    """
+
+    counts: np.ndarray
+    fit: fitting.CalibFit
+    energies: np.ndarray
+
+
+def load(setting: str) -> Calibration:
+    """Calibration of a detector setting, "default" or "high_rate"."""
+    eng = engine.shared()
+    fit = eng.calibration(calibrations[setting])
+    counts = calib.read_data(eng.sample(sources[setting]).file)
+    return Calibration(counts, fit, calib.line(SDD_channels, *fit.params))
+
+
+@lru_cache(maxsize=None)
+def default() -> Calibration:
+    """Pb-210 calibration of the Default setting, loaded once per process.
+
+    The arrays are shared between callers: copy them before modifying them.
+    """
+    return load("default")
+
+
+@lru_cache(maxsize=None)
+def high_rate() -> Calibration:
+    """Cs-137 calibration of the High Rate setting, loaded once per process.
+
+    The arrays are shared between callers: copy them before modifying them.
+    """
+    return load("high_rate")
+
+
+# original module-level names: name -> (calibration, field)
+_attributes = {
+    "pb210_data": (default, "counts"),
+    "pb210_peak_centres": (default, "fit.peak_centres"),
+    "pb210_peak_centre_errs": (default, "fit.peak_centre_errs"),
+    "pb210_calib_fit": (default, "fit.params"),
+    "pb210_calib_err": (default, "fit.errs"),
+    "pb210_calib_cov": (default, "fit.cov"),
+    "energies_default": (default, "energies"),
+    "cs137_data": (high_rate, "counts"),
+    "cs137_peak_centres": (high_rate, "fit.peak_centres"),
+    "cs137_peak_centre_errs": (high_rate, "fit.peak_centre_errs"),
+    "cs137_calib_fit": (high_rate, "fit.params"),
+    "cs137_calib_err": (high_rate, "fit.errs"),
+    "cs137_calib_cov": (high_rate, "fit.cov"),
+    "energies_high_rate": (high_rate, "energies"),
+}
+
+
+def __getattr__(name: str) -> np.ndarray:
+    # a copy, so that callers scaling e.g. `cs137_calib_fit` in place cannot
+    # change the memoized calibration seen by everyone else
+    if name in _attributes:
+        calibration, field = _attributes[name]
+        return np.copy(attrgetter(field)(calibration()))
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+
+    args = engine.argument_parser(
+        "Calibration of Default and High Rate detector settings.", jobs
+    ).parse_args()
+    cache.configure(enable=args.cache)
+    with profiling.session(args.profile, args.profile_memory):
+        results = engine.shared(propagation=args.propagation).run(
+            {"radioactive": [sources[setting] for setting in mode]},
+            calibrations=[calibrations[setting] for setting in mode],
+            workers=args.jobs,
+        )
@@ -0,0 +1,60 @@
+"""
+live.py
+
+Live XRF analysis: follows the spectrum of a sample while PMCA saves it, printing
+its peak centres and their uncertainties as they converge during the run.
+
+The peak windows and guesses are those of the sample in `data/catalog.json`;
+point `--path` at the file (or directory) PMCA is saving to. See `xrf.live`.
+
+Author: Shiqi Xu
+"""
+
+import argparse
+from pathlib import Path
+
+from xrf import engine, live
+
+
+sample = "au"
+
+interval = 2.0  # seconds between polls of the spectrum
+duty = 0.25  # largest fraction of the time spent reading and fitting
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Live XRF analysis of a spectrum being acquired."
+    )
+    parser.add_argument(
+        "sample", nargs="?", default=sample, help="catalog sample whose peaks to fit"
+    )
+    parser.add_argument(
+        "--path",
+        type=Path,
+        help="spectrum file, or directory of spectra, to follow "
+        "(default: the sample's file)",
+    )
+    parser.add_argument("--interval", type=float, default=interval, metavar="S")
+    parser.add_argument("--duty", type=float, default=duty, metavar="F")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="S",
+        help="stop once the spectrum has not changed for S seconds",
+    )
+    args = parser.parse_args()
+
+    entry = engine.shared().sample(args.sample)
+    peaks = [(p.first_channel, p.last_channel, p.guess) for p in entry.peaks]
+    try:
+        live.follow(
+            args.path or entry.file,
+            peaks,
+            args.interval,
+            args.duty,
+            timeout=args.timeout,
+        )
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,220 @@
+"""
+archive.py
+
+Memory-mapped archive of many spectra: one contiguous N x channels int32 matrix on
+disk (`counts.i32`), plus a JSON index of file name, date, sample and detector mode
+taken from each PMCA header. Counts must fit in int32.
+
+Author: Shiqi Xu
+"""
+
+import itertools
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+from xrf import pmca
+
+
+ARCHIVE_VERSION = 1
+COUNTS_FILE = "counts.i32"
+INDEX_FILE = "index.json"
+
+
+def index_entry(
+    spectrum: pmca.Spectrum, source: str = ""
+) -> Dict[str, Union[str, float]]:
+    """Index record of a spectrum: file name, acquisition date, sample name and
+    detector mode, plus the live and real times needed for normalization, and the
+    `source` version it was read from (see `import_directory`).
+
+    The sample is the header DESCRIPTION when one was entered, otherwise the file
+    name without its leading date (e.g. "au_run1" for "20220330_au_run1.csv").
+    """
+    name = Path(spectrum.filename).name if spectrum.filename else ""
+    stem = Path(name).stem
+    prefix, _, rest = stem.partition("_")
+    sample = spectrum.header.get("DESCRIPTION") or (rest if prefix.isdigit() else stem)
+    return {
+        "file": name,
+        "date": spectrum.start_time.date().isoformat() if spectrum.start_time else "",
+        "sample": sample,
+        "mode": spectrum.detector_mode,
+        "live_time": spectrum.live_time,
+        "real_time": spectrum.real_time,
+        "source": source,
+    }
+
+
+class SpectrumArchive:
+    """A directory holding spectra as rows of one memory-mapped int32 matrix.
+
+    `archive[i]` and slices of `archive.counts` are views into the mapping, so
+    nothing is read from disk until the data is used.
+
+    Args:
+        path (Path): Archive directory. Created if it does not exist.
+        channels (int, optional): Channels per spectrum, for a new archive.
+            Defaults to 2048.
+    """
+
+    def __init__(self, path: Path, channels: int = 2048):
+        self.path = Path(path)
+        index_path = self.path / INDEX_FILE
+        if index_path.exists():
+            with open(index_path, "r") as file:
+                index = json.load(file)
+            if index["version"] != ARCHIVE_VERSION:
+                raise ValueError(f"unsupported archive version {index['version']}")
+            self.channels = index["channels"]
+            self.entries = index["entries"]
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.channels = channels
+            self.entries = []
+            (self.path / COUNTS_FILE).touch()
+            self._write_index()
+        self._counts = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, row: int) -> np.ndarray:
+        return self.counts[row]
+
+    @property
+    def counts(self) -> np.ndarray:
+        """Read-only (N, channels) memory map of every spectrum in the archive."""
+        if self._counts is None or len(self._counts) != len(self):
+            if len(self) == 0:
+                return np.empty((0, self.channels), dtype=np.int32)
+            self._counts = np.memmap(
+                self.path / COUNTS_FILE,
+                dtype=np.int32,
+                mode="r",
+                shape=(len(self), self.channels),
+            )
+        return self._counts
+
+    def column(self, key: str) -> np.ndarray:
+        """One index field for every row, e.g. `column("live_time")`."""
+        return np.array([entry[key] for entry in self.entries])
+
+    def select(self, **criteria: str) -> np.ndarray:
+        """Rows whose index fields equal the given values, e.g.
+        `select(mode="high_rate")` or `select(sample="au_run1")`.
+        """
+        rows = [
+            i
+            for i, entry in enumerate(self.entries)
+            if all(entry[key] == value for key, value in criteria.items())
+        ]
+        return np.array(rows, dtype=int)
+
+    def row(self, file: str) -> np.ndarray:
+        """Counts of the spectrum read from `file` (a name, not a full path)."""
+        rows = self.select(file=Path(file).name)
+        if len(rows) == 0:
+            raise KeyError(file)
+        return self[rows[-1]]
+
+    def extend(
+        self,
+        spectra: Iterable[pmca.Spectrum],
+        batch_size: int = 1024,
+        sources: Optional[Iterable[str]] = None,
+    ):
+        """Appends spectra to the end of the archive, `batch_size` rows per write,
+        then writes the index once.
+
+        Args:
+            spectra (Iterable[pmca.Spectrum]): Spectra to append.
+            batch_size (int, optional): Rows per write. Defaults to 1024.
+            sources (Iterable[str], optional): Version of each spectrum's file, to
+                record in its index entry. Defaults to none.
+
+        Raises:
+            ValueError: A spectrum has the wrong number of channels, or counts that
+                do not fit in int32. Nothing is appended then.
+        """
+        counts_path = self.path / COUNTS_FILE
+        n_bytes = len(self) * self.channels * np.dtype(np.int32).itemsize
+        batch, new_entries = [], []
+        sources = itertools.repeat("") if sources is None else iter(sources)
+        try:
+            with open(counts_path, "r+b") as file:
+                file.truncate(n_bytes)  # drop rows left over by an interrupted import
+                file.seek(n_bytes)
+                for spectrum in spectra:
+                    if len(spectrum.counts) != self.channels:
+                        raise ValueError(
+                            f"{spectrum.filename} has {len(spectrum.counts)} "
+                            f"channels, archive has {self.channels}"
+                        )
+                    counts = np.asarray(spectrum.counts)
+                    if counts.size and (
+                        counts.min() < np.iinfo(np.int32).min
+                        or counts.max() > np.iinfo(np.int32).max
+                    ):
+                        raise ValueError(
+                            f"{spectrum.filename} has counts outside the int32 range"
+                        )
+                    batch.append(counts)
+                    new_entries.append(index_entry(spectrum, next(sources)))
+                    if len(batch) == batch_size:
+                        file.write(np.asarray(batch, dtype=np.int32).tobytes())
+                        batch = []
+                if batch:
+                    file.write(np.asarray(batch, dtype=np.int32).tobytes())
+        except BaseException:
+            os.truncate(counts_path, n_bytes)
+            raise
+        self.entries.extend(new_entries)
+        self._write_index()
+
+    def _write_index(self):
+        index_path = self.path / INDEX_FILE
+        tmp_path = index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(
+                {
+                    "version": ARCHIVE_VERSION,
+                    "channels": self.channels,
+                    "entries": self.entries,
+                },
+                file,
+                indent=1,
+            )
+        os.replace(tmp_path, index_path)
+
+
+def import_directory(
+    archive: SpectrumArchive, directory: Path, pattern: str = "*.csv"
+) -> List[int]:
+    """Bulk-imports every PMCA file in `directory` not already in the archive, or
+    changed since it was imported (e.g. re-saved by PMCA during a run), keyed on its
+    name, size and modification time. A changed file is appended as a new row, which
+    `SpectrumArchive.row` then returns. The index is written once, after the counts.
+
+    Args:
+        archive (SpectrumArchive): Archive to fill.
+        directory (Path): Directory of PMCA files, e.g. `data/`.
+        pattern (str, optional): Glob for the files to import. Defaults to "*.csv".
+
+    Returns:
+        List[int]: Archive rows of the newly imported spectra.
+    """
+    latest = {entry["file"]: entry["source"] for entry in archive.entries}
+    files, sources = [], []
+    for f in sorted(Path(directory).glob(pattern)):
+        stat = f.stat()
+        source = f"{stat.st_size}:{stat.st_mtime_ns}"
+        if latest.get(f.name) != source:
+            files.append(f)
+            sources.append(source)
+    first_row = len(archive)
+    archive.extend((pmca.read_spectrum(f) for f in files), sources=sources)
+    return list(range(first_row, len(archive)))
@@ -0,0 +1,208 @@
+"""
+artifacts.py
+
+Persisted calibration artifacts: a calibration line (slope, intercept, full
+covariance and the points it was fitted to) saved as versioned JSON, together with
+the provenance needed to tell when it is stale. That is each input spectrum
+(path, size, modification time and SHA-1) and a SHA-1 of each definition of the
+peaks that were fitted: a catalog entry, or the source of a function.
+
+Loading a current artifact only stats its inputs; a file is hashed again only if
+its size or modification time changed.
+
+Author: Shiqi Xu
+"""
+
+import hashlib
+import inspect
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from xrf.fitting import CalibFit
+
+
+ARTIFACT_VERSION = 1
+
+# a function, or a (name, JSON-serializable value) pair such as a catalog entry
+Definition = Union[Callable, Tuple[str, Any]]
+
+artifact_dir = Path.cwd() / "outputs" / "calibrations"
+
+
+def file_record(filename: Path) -> Dict[str, Any]:
+    """Provenance of an input file: path, size, modification time and SHA-1."""
+    stat = os.stat(filename)
+    with open(filename, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    return {
+        "file": str(filename),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": digest,
+    }
+
+
+def definition_record(definition: Definition) -> Dict[str, str]:
+    """Provenance of a peak definition: its name and a SHA-1 of its canonical JSON,
+    or of its source for a function.
+    """
+    if callable(definition):
+        name = f"{definition.__module__}.{definition.__qualname__}"
+        source = inspect.getsource(definition)
+    else:
+        name, value = definition
+        source = json.dumps(value, sort_keys=True)
+    return {"name": name, "sha1": hashlib.sha1(source.encode()).hexdigest()}
+
+
+def unchanged(record: Dict[str, Any]) -> Optional[bool]:
+    """Whether an input file still matches its record.
+
+    Returns:
+        Optional[bool]: True if its size and modification time are unchanged, None
+            if they changed but its contents did not (the record is then refreshed
+            in place), and False if the file changed or is gone.
+    """
+    try:
+        stat = os.stat(record["file"])
+    except OSError:
+        return False
+    if stat.st_size == record["size"] and stat.st_mtime_ns == record["mtime_ns"]:
+        return True
+    if stat.st_size != record["size"]:
+        return False
+    refreshed = file_record(record["file"])
+    if refreshed["sha1"] != record["sha1"]:
+        return False
+    record.update(refreshed)
+    return None
+
+
+def path(name: str) -> Path:
+    return artifact_dir / (name + ".json")
+
+
+def save(
+    name: str,
+    fit: CalibFit,
+    inputs: Sequence[Path],
+    definitions: Sequence[Definition] = (),
+) -> Dict[str, Any]:
+    """Writes a calibration artifact atomically.
+
+    Args:
+        name (str): Artifact name, e.g. "pb210_default".
+        fit (CalibFit): Calibration line.
+        inputs (Sequence[Path]): Spectra the calibration was computed from.
+        definitions (Sequence[Definition], optional): Definitions of the peaks
+            fitted, e.g. ("sample/pb210", <catalog entry>).
+
+    Returns:
+        Dict[str, Any]: The artifact as written.
+    """
+    artifact = {
+        "version": ARTIFACT_VERSION,
+        "name": name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "slope": float(fit.params[0]),
+        "intercept": float(fit.params[1]),
+        "cov": np.asarray(fit.cov, dtype=float).tolist(),
+        "errs": np.asarray(fit.errs, dtype=float).tolist(),
+        "chisq": float(fit.chisq),
+        "points": {
+            "peak_centres": np.asarray(fit.peak_centres, dtype=float).tolist(),
+            "peak_centre_errs": np.asarray(fit.peak_centre_errs, dtype=float).tolist(),
+            "energies": np.asarray(fit.energies, dtype=float).tolist(),
+        },
+        "inputs": [file_record(filename) for filename in inputs],
+        "definitions": [definition_record(definition) for definition in definitions],
+    }
+    write(artifact)
+    return artifact
+
+
+def write(artifact: Dict[str, Any]):
+    artifact_dir.mkdir(parents=True, exist_ok=True)
+    artifact_path = path(artifact["name"])
+    tmp_path = artifact_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(artifact, file, indent=1)
+    os.replace(tmp_path, artifact_path)
+
+
+def read(name: str) -> Optional[Dict[str, Any]]:
+    """The artifact saved under `name`, or None if there is none readable."""
+    try:
+        with open(path(name), "r") as file:
+            artifact = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if artifact.get("version") != ARTIFACT_VERSION:
+        return None
+    return artifact
+
+
+def is_current(
+    artifact: Dict[str, Any],
+    inputs: Sequence[Path],
+    definitions: Sequence[Definition] = (),
+) -> bool:
+    """Whether an artifact was computed from exactly these inputs, unchanged, and
+    these peak definitions. Refreshes (and rewrites) the modification times of
+    inputs that were touched but not changed.
+    """
+    if [record["file"] for record in artifact["inputs"]] != [str(f) for f in inputs]:
+        return False
+    if artifact["definitions"] != [definition_record(d) for d in definitions]:
+        return False
+    states = [unchanged(record) for record in artifact["inputs"]]
+    if False in states:
+        return False
+    if None in states:
+        write(artifact)
+    return True
+
+
+def to_fit(artifact: Dict[str, Any]) -> CalibFit:
+    """The calibration line stored in an artifact."""
+    points = artifact["points"]
+    return CalibFit(
+        np.array(points["peak_centres"]),
+        np.array(points["peak_centre_errs"]),
+        np.array(points["energies"]),
+        np.array([artifact["slope"], artifact["intercept"]]),
+        np.array(artifact["errs"]),
+        np.array(artifact["cov"]),
+        artifact["chisq"],
+    )
+
+
+def calibration(
+    name: str,
+    inputs: Sequence[Path],
+    definitions: Sequence[Definition],
+    compute: Callable[[], CalibFit],
+) -> CalibFit:
+    """Loads a calibration artifact, first recomputing and saving it if it is
+    missing, of another version, or stale.
+
+    Args:
+        name (str): Artifact name, e.g. "pb210_default".
+        inputs (Sequence[Path]): Spectra the calibration is computed from.
+        definitions (Sequence[Definition]): Definitions of the peaks fitted.
+        compute (Callable[[], CalibFit]): Computes the calibration from scratch.
+
+    Returns:
+        CalibFit: Calibration line.
+    """
+    artifact = read(name)
+    if artifact is not None and is_current(artifact, inputs, definitions):
+        return to_fit(artifact)
+    fit = compute()
+    save(name, fit, inputs, definitions)
+    return fit
@@ -0,0 +1,198 @@
+"""
+batch.py
+
+Fits many Gaussian peaks at once: windows are padded to a common length and
+stacked, and a single Levenberg-Marquardt loop updates every fit in NumPy.
+
+A fit that stops without meeting `ftol` or `xtol`, or ends with non-finite
+parameters, a zero width or its centre outside its window, has not converged: its
+uncertainties and covariance are infinite, and callers should refit it, e.g. with
+`fitting.fit_gaussian`.
+
+Author: Shiqi Xu
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from xrf import profiling
+from xrf.fitting import estimate_gaussian, gaussian, gaussian_jac
+
+
+Window = Tuple[np.ndarray, int, int, Optional[Sequence[float]]]
+
+
+def stack_windows(
+    windows: Sequence[Window], channels: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Pads (counts, first_channel, last_channel, guess) windows to a common length.
+
+    Args:
+        windows (Sequence[Window]): Spectrum counts, fit bounds and Gaussian guesses
+            [height, centre, std], as passed to `calib.fit_peak`. A guess of None
+            is estimated from the window with `calib.estimate_gaussian`.
+        channels (np.ndarray, optional): Channel (or energy) of each bin, shared by
+            all spectra. Defaults to the bin index.
+
+    Returns:
+        Tuple[np.ndarray, ...]: x, y and mask arrays of shape (N, L), where L is the
+            widest window, and the (N, 3) initial parameters.
+    """
+    n_points = max(last - first for _, first, last, _ in windows)
+    x = np.zeros((len(windows), n_points))
+    y = np.zeros((len(windows), n_points))
+    mask = np.zeros((len(windows), n_points), dtype=bool)
+    guesses = np.empty((len(windows), 3))
+    for i, (counts, first, last, guess) in enumerate(windows):
+        x_window = np.arange(first, last) if channels is None else channels[first:last]
+        y_window = counts[first:last]
+        x[i, : len(x_window)] = x_window
+        y[i, : len(y_window)] = y_window
+        mask[i, : len(y_window)] = True
+        guesses[i] = estimate_gaussian(x_window, y_window) if guess is None else guess
+    return x, y, mask, guesses
+
+
+def fit_peaks(
+    windows: Sequence[Window],
+    channels: Optional[np.ndarray] = None,
+    max_iter: int = 200,
+    ftol: float = 1.49012e-08,
+    xtol: float = 1.49012e-08,
+    full_output: bool = False,
+) -> Tuple[np.ndarray, ...]:
+    """Fits a Gaussian to every window with vectorized Levenberg-Marquardt solves.
+
+    Equivalent to calling `calib.fit_peak` on each window (without the plots):
+    unweighted least squares, uncertainties scaled by the reduced chi-squared as
+    `curve_fit` does by default. Windows are grouped by width (to within a factor
+    of two) so that narrow peaks are not padded out to the widest one; each group
+    is one stacked solve.
+
+    Args:
+        windows (Sequence[Window]): (counts, first_channel, last_channel, guess)
+            for each peak.
+        channels (np.ndarray, optional): Channel (or energy) of each bin, shared by
+            all spectra. Defaults to the bin index.
+        max_iter (int, optional): Iteration limit. Defaults to 200.
+        ftol (float, optional): Relative reduction in the sum of squares at which a
+            fit has converged. Defaults to MINPACK's default.
+        xtol (float, optional): Relative parameter step at which a fit has
+            converged. Defaults to MINPACK's default.
+        full_output (bool, optional): Whether to also return the (N, 3, 3)
+            covariance matrices and which fits converged. Defaults to False.
+
+    Returns:
+        Tuple[np.ndarray, ...]: (N, 3) fit parameters and their uncertainties
+            (infinite where a fit did not converge), and if `full_output` the
+            covariances and (N,) bool whether each fit converged.
+    """
+    widths = np.array([last - first for _, first, last, _ in windows])
+    groups = np.ceil(np.log2(np.maximum(widths, 1)))
+    params = np.empty((len(windows), 3))
+    errs = np.empty((len(windows), 3))
+    covs = np.empty((len(windows), 3, 3))
+    converged = np.empty(len(windows), dtype=bool)
+    with profiling.stage("fit_batch"):
+        for group in np.unique(groups):
+            rows = np.flatnonzero(groups == group)
+            x, y, mask, guesses = stack_windows([windows[i] for i in rows], channels)
+            params[rows], errs[rows], covs[rows], converged[rows] = solve_stack(
+                x, y, mask, guesses, max_iter, ftol, xtol
+            )
+    if full_output:
+        return params, errs, covs, converged
+    return params, errs
+
+
+def solve_stack(
+    x: np.ndarray,
+    y: np.ndarray,
+    mask: np.ndarray,
+    params: np.ndarray,
+    max_iter: int = 200,
+    ftol: float = 1.49012e-08,
+    xtol: float = 1.49012e-08,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Levenberg-Marquardt fit of a Gaussian to each row of padded, stacked windows.
+
+    Args:
+        x (np.ndarray): (N, L) channels.
+        y (np.ndarray): (N, L) counts.
+        mask (np.ndarray[bool]): (N, L), False where a row is padding.
+        params (np.ndarray): (N, 3) initial [height, centre, std]. Updated in place.
+        max_iter, ftol, xtol: As for `fit_peaks`.
+
+    Returns:
+        Tuple[np.ndarray, ...]: (N, 3) fit parameters, their uncertainties, the
+            (N, 3, 3) covariance matrices, and (N,) bool whether each fit converged;
+            the uncertainties and covariances of those that did not are infinite.
+    """
+    n_points = mask.sum(axis=1)
+
+    # only the first `width` columns matter for the windows still being fitted
+    def residuals(rows: np.ndarray, p: np.ndarray, width: int) -> np.ndarray:
+        model = gaussian(x[rows, :width], p[:, 0, None], p[:, 1, None], p[:, 2, None])
+        return np.where(mask[rows, :width], y[rows, :width] - model, 0)
+
+    def jtj_grad(rows: np.ndarray, p: np.ndarray, resid: np.ndarray, width: int):
+        jac = gaussian_jac(x[rows, :width], p[:, 0, None], p[:, 1, None], p[:, 2, None])
+        jac *= mask[rows, :width, None]
+        jac_t = jac.transpose(0, 2, 1)
+        return jac_t @ jac, (jac_t @ resid[:, :width, None])[..., 0]
+
+    all_rows = np.arange(len(params))
+    resid = residuals(all_rows, params, x.shape[1])
+    cost = np.sum(resid**2, axis=1)
+    damping = np.full(len(params), 1e-3)
+    active = all_rows
+    converged = np.zeros(len(params), dtype=bool)
+
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        p = params[active]
+        width = n_points[active].max()
+        jtj, grad = jtj_grad(active, p, resid[active], width)
+        lhs = jtj + damping[active, None, None] * jtj * np.eye(3)
+        try:
+            step = np.linalg.solve(lhs, grad[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = (np.linalg.pinv(lhs) @ grad[..., None])[..., 0]
+
+        trial = p + step
+        trial_resid = residuals(active, trial, width)
+        trial_cost = np.sum(trial_resid**2, axis=1)
+        improved = trial_cost < cost[active]
+
+        small_step = np.linalg.norm(step, axis=1) <= xtol * np.linalg.norm(p, axis=1)
+        small_gain = improved & (cost[active] - trial_cost <= ftol * cost[active])
+        rows = active[improved]
+        params[rows] = trial[improved]
+        resid[rows, :width] = trial_resid[improved]
+        cost[rows] = trial_cost[improved]
+        damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+        done = small_step | small_gain
+        converged[active[done]] = True
+        active = active[~(done | (damping[active] > 1e16))]
+
+    jtj, _ = jtj_grad(all_rows, params, resid, x.shape[1])
+    jtj[~np.all(np.isfinite(jtj), axis=(1, 2))] = 0  # diverged; flagged below
+    dof = n_points - 3
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = np.linalg.pinv(jtj) * (cost / dof)[:, None, None]
+    errs = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+    # a peak that ran off its window (or to infinity) was not fitted
+    low = np.where(mask, x, np.inf).min(axis=1)
+    high = np.where(mask, x, -np.inf).max(axis=1)
+    with np.errstate(invalid="ignore"):
+        converged &= (
+            np.all(np.isfinite(params), axis=1)
+            & (params[:, 2] != 0)
+            & (params[:, 1] >= low)
+            & (params[:, 1] <= high)
+        )
+    errs[(dof <= 0) | ~converged] = np.inf
+    cov[(dof <= 0) | ~converged] = np.inf
+    return params, errs, cov, converged
@@ -0,0 +1,201 @@
+"""
+cache.py
+
+On-disk cache of parsed PMCA spectra. Each spectrum is stored as a `.npy` sidecar
+(loaded back with memory mapping) plus its metadata as `.json`, keyed on the source
+file's path, modification time and size, or optionally on a hash of its contents.
+
+The cache is off unless enabled (`configure(enable=True)`, or `--cache` on the
+analysis scripts): the single-pass parser reads the small spectra in `data/`
+faster than a warm cache loads them, so it only pays off for large spectra or slow
+file systems.
+
+Author: Shiqi Xu
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from xrf import pmca
+
+
+enabled = False
+cache_dir: Optional[Path] = None  # None: .xrf_cache in the working directory
+max_bytes = 256 * 2**20
+max_entries = 10000
+hash_content = False
+mmap_mode = "c"  # copy-on-write: callers may modify the counts they get back
+
+_usage = None  # [n_entries, n_bytes] of the directory, counted on first write
+
+
+def configure(
+    directory: Optional[Path] = None,
+    size_limit: Optional[int] = None,
+    entry_limit: Optional[int] = None,
+    use_content_hash: Optional[bool] = None,
+    memory_map: Optional[bool] = None,
+    enable: Optional[bool] = None,
+):
+    """Changes cache settings. Arguments left as None are unchanged.
+
+    Args:
+        directory (Path, optional): Where sidecar files are kept. Defaults to
+            `.xrf_cache` in the working directory.
+        size_limit (int, optional): Maximum total size of the cache, in bytes.
+        entry_limit (int, optional): Maximum number of cached spectra.
+        use_content_hash (bool, optional): Key entries on a SHA-1 of the file
+            contents rather than on its path, mtime and size.
+        memory_map (bool, optional): Whether cached counts are memory-mapped rather
+            than read into memory. Mapping only pays off for large spectra.
+        enable (bool, optional): Whether `read_data` uses the cache at all.
+    """
+    global enabled, cache_dir, max_bytes, max_entries, hash_content, mmap_mode
+    global _usage
+    if directory is not None:
+        cache_dir = Path(directory)
+        _usage = None
+    if size_limit is not None:
+        max_bytes = size_limit
+    if entry_limit is not None:
+        max_entries = entry_limit
+    if use_content_hash is not None:
+        hash_content = use_content_hash
+    if memory_map is not None:
+        mmap_mode = "c" if memory_map else None
+    if enable is not None:
+        enabled = enable
+
+
+def entry_key(filename: Path) -> str:
+    """Cache key of a spectrum file, which changes whenever the file does."""
+    if hash_content:
+        with open(filename, "rb") as file:
+            return hashlib.sha1(file.read()).hexdigest()
+    stat = os.stat(filename)
+    ident = f"{Path(filename).resolve()}\0{stat.st_mtime_ns}\0{stat.st_size}"
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+
+def directory() -> Path:
+    """Directory of the cache, as configured or else under the working directory."""
+    return Path.cwd() / ".xrf_cache" if cache_dir is None else cache_dir
+
+
+def _paths(key: str) -> Tuple[Path, Path]:
+    return directory() / (key + ".npy"), directory() / (key + ".json")
+
+
+def load(filename: Path) -> pmca.Spectrum:
+    """Reads a PMCA file through the cache.
+
+    A valid entry is memory-mapped by default (copy-on-write, so callers may modify
+    it freely); a missing or stale one is rebuilt from the file and stored.
+
+    Args:
+        filename (Path): Path to data file (CSV format).
+
+    Returns:
+        pmca.Spectrum: Counts and parsed metadata.
+    """
+    key = entry_key(filename)
+    npy_path, json_path = _paths(key)
+    try:
+        counts = np.load(npy_path, mmap_mode=mmap_mode)
+        with open(json_path, "r") as file:
+            metadata = json.load(file)
+        os.utime(npy_path)  # mark as recently used
+        return pmca.Spectrum(counts, filename=Path(filename), **metadata)
+    except (OSError, ValueError, TypeError):
+        pass
+
+    spectrum = pmca.read_spectrum(filename)
+    store(key, spectrum)
+    return spectrum
+
+
+def load_counts(filename: Path) -> np.ndarray:
+    """As `load`, but only the counts; the metadata sidecar is not read on a hit."""
+    npy_path, _ = _paths(entry_key(filename))
+    try:
+        counts = np.load(npy_path, mmap_mode=mmap_mode)
+        os.utime(npy_path)
+        return counts
+    except (OSError, ValueError):
+        return load(filename).counts
+
+
+def store(key: str, spectrum: pmca.Spectrum):
+    """Writes a cache entry atomically, then evicts old entries if over a limit."""
+    global _usage
+    directory().mkdir(parents=True, exist_ok=True)
+    npy_path, json_path = _paths(key)
+    tmp_suffix = f".{os.getpid()}.tmp"
+
+    with open(str(json_path) + tmp_suffix, "w") as file:
+        json.dump(
+            {
+                "header": spectrum.header,
+                "dp5_config": spectrum.dp5_config,
+                "dpp_status": spectrum.dpp_status,
+            },
+            file,
+        )
+    os.replace(str(json_path) + tmp_suffix, json_path)
+    with open(str(npy_path) + tmp_suffix, "wb") as file:
+        np.save(file, spectrum.counts)
+    os.replace(str(npy_path) + tmp_suffix, npy_path)
+
+    if _usage is None:
+        _usage = [0, 0]
+        for entry in os.scandir(directory()):
+            if entry.name.endswith((".npy", ".json")):
+                _usage[0] += entry.name.endswith(".npy")
+                _usage[1] += entry.stat().st_size
+    else:
+        _usage[0] += 1
+        _usage[1] += npy_path.stat().st_size + json_path.stat().st_size
+    if _usage[0] > max_entries or _usage[1] > max_bytes:
+        evict()
+
+
+def evict():
+    """Removes least recently used entries until the cache is within its limits."""
+    global _usage
+    entries = []
+    for entry in os.scandir(directory()):
+        if entry.name.endswith(".npy"):
+            json_path = directory() / (entry.name[:-4] + ".json")
+            size = entry.stat().st_size
+            if json_path.exists():
+                size += json_path.stat().st_size
+            entries.append((entry.stat().st_mtime, size, entry.name[:-4]))
+    entries.sort()
+
+    n_entries, n_bytes = len(entries), sum(size for _, size, _ in entries)
+    for _, size, key in entries:
+        if n_entries <= max_entries and n_bytes <= max_bytes:
+            break
+        for path in _paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+        n_entries -= 1
+        n_bytes -= size
+    _usage = [n_entries, n_bytes]
+
+
+def clear():
+    """Deletes every cache entry."""
+    global _usage
+    if directory().is_dir():
+        for entry in os.scandir(directory()):
+            if entry.name.endswith((".npy", ".json")):
+                os.remove(entry.path)
+    _usage = [0, 0]
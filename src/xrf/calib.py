@@ -8,47 +8,49 @@ Author: Shiqi Xu
 """
 
 from pathlib import Path
-from typing import Tuple, List, Callable
+from typing import Tuple, List, Optional
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-from scipy.optimize import curve_fit
-from scipy.stats import chisquare
 
+from xrf import cache, fitting, pmca, profiling, render
+from xrf.fitting import estimate_gaussian, gaussian, gaussian_jac, line
 
-def gaussian(x: np.ndarray, height: float, centre: float, std: float):
-    return height * np.exp(-((x - centre) ** 2) / (2 * std**2))
 
-
-def line(x: np.ndarray, slope: float, intercept: float):
-    return slope * x + intercept
-
-
-def read_data(filename: Path) -> np.ndarray:
+def read_data(filename: Path, use_cache: bool = True) -> np.ndarray:
     """Reads FastSDD data in csv format, and returns a numpy array.
 
     Args:
         filename (Path): Path to data file (CSV format).
+        use_cache (bool, optional): Whether to go through the on-disk spectrum cache
+            (see `xrf.cache`), if it is enabled. Defaults to True.
 
     Returns:
         np.ndarray[int]: 1D array containing counts in each channel
             (index corresponds to channel number).
     """
-    with open(filename, "r") as file:
-        line_no = 0
-        for line in file:
-            line_no += 1
-            if line == "<<DATA>>\n":
-                header_rows = line_no
-            if line == "<<END>>\n":
-                footer_rows = -line_no + 1
-        footer_rows += line_no
-        # print("header_rows:", header_rows)
-        # print("footer_rows:", footer_rows)
-    return np.genfromtxt(
-        filename, dtype=int, skip_header=header_rows, skip_footer=footer_rows
-    )
+    with profiling.stage("read", Path(filename).name):
+        if use_cache and cache.enabled:
+            return cache.load_counts(filename)
+        return pmca.read_counts(filename)
+
+
+def read_spectrum(filename: Path, use_cache: bool = True) -> pmca.Spectrum:
+    """Reads FastSDD data in csv format, along with the PMCA header, DP5 configuration
+    and DPP status saved with it.
+
+    Args:
+        filename (Path): Path to data file (CSV format).
+        use_cache (bool, optional): Whether to go through the on-disk spectrum cache
+            (see `xrf.cache`), if it is enabled. Defaults to True.
+
+    Returns:
+        pmca.Spectrum: Counts in each channel, live/real time, gain, start time and
+            detector settings.
+    """
+    with profiling.stage("read", Path(filename).name):
+        if use_cache and cache.enabled:
+            return cache.load(filename)
+        return pmca.read_spectrum(filename)
 
 
 def fit_peak(
@@ -56,14 +58,16 @@ def fit_peak(
     counts: np.ndarray,
     first_channel: float,
     last_channel: float,
-    guess: List[float],
+    guess: Optional[List[float]],
     sample: str,
     save_fig: bool = False,
     path_save: Path = None,
     show_fig: bool = False,
+    analytic_jac: bool = False,
+    figures: Optional[List[render.Figure]] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Fits a Gaussian to an energy peak, and calculates the peak centre.
-    Produces a plot.
+    Produces a plot if asked to; `fitting.fit_gaussian` is the fit alone.
 
     Args:
         channels (np.ndarray[float]): Detector channel corresponding to an energy bin.
@@ -72,59 +76,36 @@ def fit_peak(
         first_channel (float): Lower bound on channels (energy levels) included in fit.
         last_channel (float): Upper bound on channels (energy levels) included in fit.
         guess (List[float]): Guesses for Gaussian parameters, [height, centre, std].
+            If None, they are estimated from the window (see `estimate_gaussian`).
         sample (str): Name of sample. Used in plot title.
         save_fig (bool, optional): Whether to save output plot. Defaults to False.
         path_save (Path, optional): Path to save output plot. Defaults to None.
         show_fig (bool, optional): Whether to show output plot. Defaults to False.
+        analytic_jac (bool, optional): Whether to give `curve_fit` the analytic
+            Jacobian of `gaussian` instead of letting it take finite differences.
+            Defaults to False.
+        figures (List[render.Figure], optional): If given, the plot to save is
+            queued here for `render.render` instead of being drawn now.
+            Defaults to None.
 
     Returns:
         Tuple[np.ndarray, np.ndarray]: Fit parameters and their uncertainties.
     """
-    peak_fit, fit_err_cov = curve_fit(
-        gaussian,
-        channels[first_channel:last_channel],
-        counts[first_channel:last_channel],
-        p0=guess,
-    )
-    fit_err = np.sqrt(np.diag(fit_err_cov))
-
-    scale = last_channel - first_channel
-    peak_fit_x = np.arange(first_channel - scale / 10, last_channel - scale / 10)
-    peak_fit_y = gaussian(peak_fit_x, peak_fit[0], peak_fit[1], peak_fit[2])
-
-    peak_centre = round(peak_fit[1], 2)
-    peak_centre_err = round(fit_err[1], 2)
-
-    plt.figure()
-    plt.plot(
-        channels[first_channel:last_channel],
-        counts[first_channel:last_channel],
-        "x",
-        label="data",
-    )
-    plt.plot(peak_fit_x, peak_fit_y, label="fit")
-    plt.gca().yaxis.set_major_locator(MaxNLocator(integer=True))
-    plt.title(sample + " peak centred around channel " + str(peak_centre))
-    plt.xlabel("Channel")
-    plt.ylabel("Count")
-    plt.text(
-        110,
-        395,
-        "centre:   $" + str(peak_centre) + " \pm " + str(peak_centre_err) + "$",
-        ha="left",
-        va="top",
-        transform=None,
-    )
-    plt.legend()
-    if save_fig:
-        plt.savefig(path_save)
-        plt.close()
-    if show_fig:
-        plt.show()
-    else:
-        plt.close()
-
-    return peak_fit, fit_err
+    with profiling.stage("fit", sample):
+        fit = fitting.fit_gaussian(
+            channels, counts, first_channel, last_channel, guess, analytic_jac
+        )
+    if save_fig and figures is not None:
+        figures.append(render.Figure("plot_peak_fit", path_save, (fit, sample)))
+        save_fig = False
+    if save_fig or show_fig:
+        from xrf import plotting  # pyplot is only imported when drawing
+
+        with profiling.stage("plot", sample):
+            plotting.plot_peak_fit(
+                fit, sample, path_save if save_fig else None, show_fig
+            )
+    return fit.params, fit.errs
 
 
 def calib_curve(
@@ -136,71 +117,38 @@ def calib_curve(
     save_fig: bool = False,
     path_save: Path = None,
     show_fig: bool = False,
+    figures: Optional[List[render.Figure]] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """Produce a calibration curve given peak locations and test known energies
-    from literature.
+    from literature. Plotted if asked to; `fitting.fit_calibration` is the fit alone,
+    and returns the full record, with the covariance.
 
     Args:
         peak_centres (np.ndarray[float]): Locations of peaks (centre channel).
         energies (np.ndarray[float]): Energies of each peak, from literature.
-        guess (List[float]): Guesses for [slope, intercept] of calibration line.
+        guess (List[float]): Deprecated and ignored: the line is fitted in closed
+            form, without a guess.
         sample (str): Name of sample used for calibration. Used in plot title.
         save_fig (bool, optional): Whether to save output plot. Defaults to False.
         path_save (Path, optional): Path to save output plot. Defaults to None.
         show_fig (bool, optional): Whether to show output plot. Defaults to False.
+        figures (List[render.Figure], optional): If given, the plot to save is
+            queued here for `render.render` instead of being drawn now.
+            Defaults to None.
 
     Returns:
         Tuple[np.ndarray, np.ndarray]: Linear fit parameters and their uncertainties.
     """
-    calib_fit, calib_err_cov = curve_fit(
-        line,
-        peak_centres,
-        energies,
-        p0=guess,
-        sigma=peak_centre_errs,
-    )
-    channel_range = int(max(peak_centres) - min(peak_centres))
-    fit_x = np.arange(
-        int(min(peak_centres) - channel_range / 2),
-        int(max(peak_centres) + channel_range / 2),
-    )
-    fit_y = line(fit_x, calib_fit[0], calib_fit[1])
-
-    expected_y = line(peak_centres, calib_fit[0], calib_fit[1])
-    chisq_fit, p_fit = chisquare(energies, expected_y, ddof=len(calib_fit))
-    calib_err = np.diag(calib_err_cov) * max(1, np.sqrt(chisq_fit))
-
-    plt.figure()
-    plt.plot(fit_x, fit_y)
-    plt.errorbar(
-        peak_centres, energies, peak_centre_errs, fmt="none", ecolor="firebrick"
-    )
-    plt.plot(peak_centres, energies, ".")
-    plt.title(sample + " Calibration Curve")
-    plt.xlabel("Channel $N$")
-    plt.ylabel("Energy $E$ (keV)")
-    plt.text(
-        105,
-        400,
-        "$E = ("
-        + str(round(calib_fit[0], 8))
-        + " \pm "
-        + str(round(calib_err[0], 8))
-        + ") N + ("
-        + str(round(calib_fit[1], 4))
-        + " \pm "
-        + str(round(calib_err[1], 4))
-        + ")$",
-        ha="left",
-        va="top",
-        transform=None,
-    )
-    if save_fig:
-        plt.savefig(path_save)
-        plt.close()
-    if show_fig:
-        plt.show()
-    else:
-        plt.close()
-
-    return calib_fit, calib_err
+    with profiling.stage("calibration", sample):
+        fit = fitting.fit_calibration(peak_centres, peak_centre_errs, energies)
+    if save_fig and figures is not None:
+        figures.append(render.Figure("plot_calib_curve", path_save, (fit, sample)))
+        save_fig = False
+    if save_fig or show_fig:
+        from xrf import plotting
+
+        with profiling.stage("plot", sample):
+            plotting.plot_calib_curve(
+                fit, sample, path_save if save_fig else None, show_fig
+            )
+    return fit.params, fit.errs
@@ -0,0 +1,194 @@
+"""
+combine.py
+
+Sums and averages of repeated runs: any number of spectra (e.g. `ag_run1` and
+`ag_high_rate`) combined into one, with Poisson uncertainties, as total counts,
+mean counts per run, or a count rate per second of live or real time.
+
+Spectra of different detector settings have different channel scales. Given the
+calibration of each, they are moved onto common energy bins (see
+`resample.rebin`) before being added. Rebinning is linear, so the spectra sharing
+a calibration are summed first and each sum is rebinned once. Sums are taken over
+blocks of rows, so combining rows of a memory-mapped `archive.SpectrumArchive`
+reads each row once and never holds more than a block of them in memory.
+
+Author: Shiqi Xu
+"""
+
+from typing import Dict, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from xrf import pmca, resample
+from xrf.archive import SpectrumArchive
+
+
+NORMALIZATIONS = (None, "mean", "live_time", "real_time")
+
+
+class Combined(NamedTuple):
+    """A combined spectrum.
+
+    Attributes:
+        counts (np.ndarray[float]): Total counts in each bin; or, as normalized,
+            mean counts per spectrum or counts per second of live or real time.
+        errs (np.ndarray[float]): Poisson uncertainties of `counts`.
+        edges (np.ndarray[float]): Energy bin edges (keV) if the spectra were put
+            on an energy grid, otherwise None (bins are channels).
+        live_time (float): Total live time of the spectra (s).
+        real_time (float): Total real time of the spectra (s).
+        n_spectra (int): Number of spectra combined.
+    """
+
+    counts: np.ndarray
+    errs: np.ndarray
+    edges: Optional[np.ndarray]
+    live_time: float
+    real_time: float
+    n_spectra: int
+
+
+def sum_rows(counts: np.ndarray, rows: np.ndarray, block_rows: int = 256) -> np.ndarray:
+    """Sum of some rows of a (possibly memory-mapped) matrix, `block_rows` at a
+    time, in file order.
+
+    Returns:
+        np.ndarray[int]: The int64 sum of the rows.
+    """
+    rows = np.sort(rows)
+    total = np.zeros(counts.shape[1], dtype=np.int64)
+    for start in range(0, len(rows), block_rows):
+        block = counts[rows[start : start + block_rows]]
+        total += np.sum(block, axis=0, dtype=np.int64)
+    return total
+
+
+def combine(
+    counts: np.ndarray,
+    live_times: np.ndarray,
+    real_times: np.ndarray,
+    calibrations: Optional[np.ndarray] = None,
+    edges: Optional[np.ndarray] = None,
+    normalize: Optional[str] = None,
+    rows: Optional[Sequence[int]] = None,
+    block_rows: int = 256,
+) -> Combined:
+    """Combines spectra into one.
+
+    Args:
+        counts (np.ndarray[int]): (N, channels) spectra, e.g. `archive.counts`.
+        live_times (np.ndarray[float]): (N,) live time of each spectrum (s).
+        real_times (np.ndarray[float]): (N,) real time of each spectrum (s).
+        calibrations (np.ndarray[float], optional): (N, 2) [slope, intercept] of
+            each spectrum. If given, the spectra are added on the energy bins
+            `edges`. Defaults to None, adding them channel by channel.
+        edges (np.ndarray[float], optional): Common energy bin edges (keV), e.g.
+            from `resample.energy_grid`. Defaults to the channels of the first
+            spectrum combined.
+        normalize (str, optional): None for total counts, "mean" for the mean counts
+            per spectrum, or "live_time" or "real_time" for counts per second of
+            total live or real time. Defaults to None.
+        rows (Sequence[int], optional): Spectra to combine. Defaults to all.
+        block_rows (int, optional): Spectra read and summed at a time.
+            Defaults to 256.
+
+    Returns:
+        Combined: The combined spectrum and its uncertainties.
+    """
+    if normalize not in NORMALIZATIONS:
+        raise ValueError(f"normalize must be one of {NORMALIZATIONS}")
+    rows = np.arange(len(counts)) if rows is None else np.asarray(rows, dtype=int)
+    if len(rows) == 0:
+        raise ValueError("no spectra to combine")
+    n_channels = counts.shape[1]
+
+    if calibrations is None:
+        total = sum_rows(counts, rows, block_rows).astype(float)
+    else:
+        calibrations = np.asarray(calibrations, dtype=float)[rows]
+        if edges is None:
+            edges = resample.channel_edges(n_channels, *calibrations[0])
+        lines, group = np.unique(calibrations, axis=0, return_inverse=True)
+        group = group.ravel()
+        total = np.zeros(len(edges) - 1)
+        for i, (slope, intercept) in enumerate(lines):
+            summed = sum_rows(counts, rows[group == i], block_rows)
+            source = resample.channel_edges(n_channels, slope, intercept)
+            total += resample.rebin(summed, source, edges)
+
+    live_time = float(np.sum(np.asarray(live_times, dtype=float)[rows]))
+    real_time = float(np.sum(np.asarray(real_times, dtype=float)[rows]))
+    scale = {
+        None: 1.0,
+        "mean": float(len(rows)),
+        "live_time": live_time,
+        "real_time": real_time,
+    }[normalize]
+    return Combined(
+        total / scale, np.sqrt(total) / scale, edges, live_time, real_time, len(rows)
+    )
+
+
+def combine_archive(
+    archive: SpectrumArchive,
+    rows: Optional[Sequence[int]] = None,
+    calibrations: Optional[Dict[str, Sequence[float]]] = None,
+    edges: Optional[np.ndarray] = None,
+    normalize: Optional[str] = None,
+    block_rows: int = 256,
+) -> Combined:
+    """`combine` of spectra in an archive, read through its memory map.
+
+    Args:
+        archive (SpectrumArchive): Archive holding the spectra.
+        rows (Sequence[int], optional): Rows to combine, e.g. from
+            `archive.select(sample="ag_run1")`. Defaults to all.
+        calibrations (Dict[str, Sequence[float]], optional): [slope, intercept] of
+            each detector mode found in the rows, e.g. {"default": ...,
+            "high_rate": ...}. Defaults to None, adding channel by channel.
+        edges, normalize, block_rows: As for `combine`.
+
+    Returns:
+        Combined: The combined spectrum and its uncertainties.
+    """
+    per_row = None
+    if calibrations is not None:
+        # only the selected rows need a calibration; `combine` skips the others
+        selected = np.arange(len(archive)) if rows is None else np.asarray(rows)
+        modes = archive.column("mode")[selected]
+        per_row = np.full((len(archive), 2), np.nan)
+        for mode in np.unique(modes):
+            per_row[selected[modes == mode]] = calibrations[mode]
+    return combine(
+        archive.counts,
+        archive.column("live_time"),
+        archive.column("real_time"),
+        per_row,
+        edges,
+        normalize,
+        rows,
+        block_rows,
+    )
+
+
+def combine_spectra(
+    spectra: Sequence[pmca.Spectrum],
+    calibrations: Optional[Dict[str, Sequence[float]]] = None,
+    edges: Optional[np.ndarray] = None,
+    normalize: Optional[str] = None,
+) -> Combined:
+    """`combine` of parsed spectra, e.g. from `calib.read_spectrum`, each put on the
+    energy scale of its detector mode's calibration if `calibrations` are given
+    (as for `combine_archive`).
+    """
+    per_spectrum = None
+    if calibrations is not None:
+        per_spectrum = [calibrations[s.detector_mode] for s in spectra]
+    return combine(
+        np.stack([s.counts for s in spectra]),
+        [s.live_time for s in spectra],
+        [s.real_time for s in spectra],
+        per_spectrum,
+        edges,
+        normalize,
+    )
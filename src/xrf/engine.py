@@ -0,0 +1,930 @@
+"""
+engine.py
+
+Runs the analyses declared in the sample catalog (`data/catalog.json`): reads each
+spectrum, fits its peaks, calibrates channels to energies and queues the figures,
+for any number of samples in one pass.
+
+The catalog has three sections:
+
+- "samples": spectrum file, detector mode, label (and optional description), and
+  its peaks, each a fit window [first_channel, last_channel) with a Gaussian guess
+  [height, centre, std] and, if the peak is a calibration line, its reference
+  energy in keV. Peaks "auto" are proposed by `xrf.peaksearch` from the spectrum.
+  An optional "background", e.g. {"method": "snip", "iterations": 40}, is
+  estimated by `xrf.background` and subtracted before the peaks are fitted.
+  Peaks sharing a "multiplet" name are fitted jointly, as overlapping Gaussians on
+  a linear background over the union of their windows.
+- "calibrations": named channel-to-energy lines, either fitted to the reference
+  energies of one sample ({"sample": ...}) or averaged over samples and other
+  calibrations ({"average": {...}}). An average puts lines of other gains on the
+  gain of one detector mode ("gain": mode) using the gains in the PMCA headers,
+  or scales their slopes by given factors ("slope_scale": {mode: factor}). These
+  are persisted as artifacts (see `xrf.artifacts`) and recomputed only when a
+  spectrum or entry behind them changes.
+- "analyses": the samples to run, how each is calibrated ("self", a calibration
+  name, or a calibration name per detector mode), optionally another calibration
+  whose uncertainties the "formula" propagation uses per mode ("uncertainty"), and
+  the figures to save where.
+
+Work is scheduled globally: every peak of every sample needed, including those of
+stale calibrations, is fitted in one pass before any calibration is applied, and
+all figures are rendered in one pool at the end. The samples of that pass are
+independent, so they can be fitted in a pool of worker processes too; results are
+merged in request order and equal those fitted serially.
+
+Author: Shiqi Xu
+"""
+
+import argparse
+import json
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from xrf import (
+    artifacts,
+    background,
+    batch,
+    calib,
+    fitting,
+    peaksearch,
+    poisson,
+    profiling,
+    propagate,
+    render,
+)
+
+
+CATALOG_VERSION = 1
+SETTING_NAMES = {"default": "Default", "high_rate": "High Rate"}
+
+catalog_path = Path.cwd() / "data" / "catalog.json"
+
+
+class Peak(NamedTuple):
+    """A peak to fit: window [first_channel, last_channel), Gaussian guess
+    [height, centre, std], its reference energy (keV) if it is a calibration line,
+    and the multiplet it is fitted jointly with, if any.
+    """
+
+    first_channel: int
+    last_channel: int
+    guess: List[float]
+    energy: Optional[float] = None
+    multiplet: Optional[str] = None
+
+
+class Sample(NamedTuple):
+    """A spectrum in the catalog and the peaks to fit in it."""
+
+    name: str
+    file: Path
+    mode: str
+    label: str
+    description: str
+    peaks: List[Peak]
+    background: Optional[Dict[str, Any]] = None
+
+
+class SampleResult(NamedTuple):
+    """Fits of one sample and the energies they calibrate to.
+
+    Attributes:
+        sample (Sample): Catalog entry.
+        counts (np.ndarray[int]): Counts in each channel.
+        fits (List[fitting.PeakFit]): One fit per peak, in catalog order.
+        calibration (fitting.CalibFit): Calibration line applied.
+        energies (np.ndarray[float]): Energy of each channel (keV).
+        peak_energies (np.ndarray[float]): Energy of each peak centre (keV).
+        peak_energy_errs (np.ndarray[float]): Uncertainties of `peak_energies`.
+        peak_energy_cov (np.ndarray[float], optional): Their covariance, with the
+            correlations through the shared calibration line, if propagated by
+            `xrf.propagate`.
+    """
+
+    sample: Sample
+    counts: np.ndarray
+    fits: List[fitting.PeakFit]
+    calibration: fitting.CalibFit
+    energies: np.ndarray
+    peak_energies: np.ndarray
+    peak_energy_errs: np.ndarray
+    peak_energy_cov: Optional[np.ndarray] = None
+
+    @property
+    def peak_centres(self) -> np.ndarray:
+        return np.array([fit.params[1] for fit in self.fits])
+
+    @property
+    def peak_centre_errs(self) -> np.ndarray:
+        return np.array([fit.errs[1] for fit in self.fits])
+
+
+def peak_energies(
+    calibration: fitting.CalibFit,
+    peak_centres: np.ndarray,
+    peak_centre_errs: np.ndarray,
+    uncertainty: Optional[fitting.CalibFit] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Energies of peak centres on a calibration line, with uncertainties.
+
+    Args:
+        calibration (fitting.CalibFit): Calibration line.
+        peak_centres (np.ndarray[float]): Peak centres (channels).
+        peak_centre_errs (np.ndarray[float]): Uncertainties of `peak_centres`.
+        uncertainty (fitting.CalibFit, optional): Calibration whose relative slope
+            and absolute intercept uncertainties to use instead, e.g. for a
+            two-point line, which has none of its own. Defaults to `calibration`.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Peak energies (keV) and their uncertainties.
+    """
+    if uncertainty is None:
+        uncertainty = calibration
+    slope, intercept = calibration.params
+    slope_err, intercept_err = uncertainty.errs
+    energies = calib.line(np.array(peak_centres), slope, intercept)
+    energy_errs = np.sqrt(
+        energies**2
+        * (
+            (slope_err / uncertainty.params[0]) ** 2
+            + (peak_centre_errs / peak_centres) ** 2
+        )
+        + intercept_err**2
+    )
+    return energies, energy_errs
+
+
+def average_calibration(
+    calibrations: Sequence[fitting.CalibFit], slope_scales: Sequence[float]
+) -> fitting.CalibFit:
+    """Unweighted average of calibration lines, each slope first scaled, e.g. by
+    the ratio of gains to put High Rate lines on the Default gain.
+
+    The uncertainties are those of the original average in `metals_self_calib.py`;
+    the covariance is that of the mean of independent fits. Undetermined
+    uncertainties (of two-point lines) count as 0 in both.
+    """
+    scales = np.array(slope_scales, dtype=float)
+    params = (
+        np.array([c.params for c in calibrations]) * np.c_[scales, np.ones(len(scales))]
+    )
+    errs = np.array([c.errs for c in calibrations])
+    errs[np.isinf(errs)] = 0
+    covs = np.array([c.cov for c in calibrations]) * np.array(
+        [np.outer([k, 1], [k, 1]) for k in scales]
+    )
+    covs = np.nan_to_num(covs, nan=0, posinf=0, neginf=0)
+    return fitting.CalibFit(
+        np.array([]),
+        np.array([]),
+        np.array([]),
+        np.array([np.average(params[:, 0]), np.average(params[:, 1])]),
+        np.array([np.sum(errs[:, 0] ** 2) ** 0.5, np.sum(errs[:, 1]) ** 0.5]),
+        np.sum(covs, axis=0) / len(covs) ** 2,
+        np.nan,
+    )
+
+
+def fit_multiplets(
+    sample: Sample,
+    channels: np.ndarray,
+    counts: np.ndarray,
+    continuum: Optional[np.ndarray] = None,
+    fit: Callable[..., fitting.MultipletFit] = fitting.fit_multiplet,
+) -> Dict[int, fitting.PeakFit]:
+    """Fits each multiplet of a sample in one solve over the union of its peaks'
+    windows, with a linear background, by `fit` (`fitting.fit_multiplet` or
+    `poisson.fit_multiplet`).
+
+    Returns:
+        Dict[int, fitting.PeakFit]: Fit of each peak in a multiplet, by its index
+            in `sample.peaks`.
+    """
+    groups = {}
+    for i, peak in enumerate(sample.peaks):
+        if peak.multiplet is not None:
+            groups.setdefault(peak.multiplet, []).append(i)
+    fits = {}
+    for indices in groups.values():
+        peaks = [sample.peaks[i] for i in indices]
+        multiplet = fit(
+            channels,
+            counts,
+            min(peak.first_channel for peak in peaks),
+            max(peak.last_channel for peak in peaks),
+            [peak.guess for peak in peaks],
+            background=continuum,
+        )
+        fits.update(zip(indices, multiplet.peak_fits()))
+    return fits
+
+
+def centre_cov(sample: Sample, fits: Sequence[fitting.PeakFit]) -> np.ndarray:
+    """Covariance of a sample's peak centres: their variances, and the covariances
+    of the centres of each multiplet fitted in one solve (see `fit_multiplets`).
+
+    Returns:
+        np.ndarray[float]: (P, P) covariance, in the order of `sample.peaks`.
+    """
+    cov = np.diag([fit.errs[1] ** 2 for fit in fits])
+    groups = {}
+    for i, peak in enumerate(sample.peaks):
+        if peak.multiplet is not None:
+            groups.setdefault(peak.multiplet, []).append(i)
+    for indices in groups.values():
+        # fitted in catalog order; peaks refitted on their own have no cross terms
+        if all(
+            fits[i].centre_covs is not None and len(fits[i].centre_covs) == len(indices)
+            for i in indices
+        ):
+            cov[np.ix_(indices, indices)] = [fits[i].centre_covs for i in indices]
+    return cov
+
+
+def fit_usable(fit: fitting.PeakFit) -> bool:
+    """Whether a peak fit has finite parameters and uncertainties and its centre in
+    its window, as one that did not converge (see `batch.solve_stack` and
+    `poisson.solve`) has not.
+    """
+    return bool(
+        np.all(np.isfinite(fit.params))
+        and np.all(np.isfinite(fit.errs))
+        and np.min(fit.channels) <= fit.params[1] <= np.max(fit.channels)
+    )
+
+
+def fit_sample(
+    sample: Sample, channels: np.ndarray
+) -> Tuple[np.ndarray, List[fitting.PeakFit]]:
+    """Reads a sample's spectrum and fits each of its peaks with `curve_fit`,
+    net of its background if the sample has one.
+
+    Returns:
+        Tuple[np.ndarray, List[fitting.PeakFit]]: Counts and peak fits.
+    """
+    with profiling.stage("fit", sample.name):
+        counts = calib.read_data(sample.file)
+        continuum = None
+        if sample.background is not None:
+            continuum = background.estimate(counts, **sample.background)
+        fits = fit_multiplets(sample, channels, counts, continuum)
+        for i, peak in enumerate(sample.peaks):
+            if i not in fits:
+                fits[i] = fitting.fit_gaussian(
+                    channels,
+                    counts,
+                    peak.first_channel,
+                    peak.last_channel,
+                    peak.guess,
+                    background=continuum,
+                )
+    return counts, [fits[i] for i in range(len(sample.peaks))]
+
+
+class Engine:
+    """Executes analyses from a sample catalog.
+
+    Args:
+        path (Path, optional): Catalog file. Defaults to `data/catalog.json`.
+        data_path (Path, optional): Directory of the spectra. Defaults to the
+            catalog's directory.
+        fitter (str, optional): "curve_fit" to fit each peak with
+            `fitting.fit_gaussian`, as the scripts always have, "batch" to fit all
+            peaks at once with `batch.fit_peaks`, or "poisson" to fit them all at
+            once by Poisson maximum likelihood with `poisson.fit_peaks`, for
+            low-count windows. Peaks those do not fit (see `fit_usable`) are fitted
+            again with `fitting.fit_gaussian`, or `fitting.fit_multiplet`, with a
+            warning. Defaults to "curve_fit".
+        propagation (str, optional): How peak energy uncertainties are computed:
+            "formula" with `peak_energies`, as the scripts always have, which
+            ignores the slope-intercept covariance of the calibration; or with the
+            full covariances of the calibration and the centres (see `centre_cov`)
+            by `propagate.analytic`, "analytic", or by `propagate.monte_carlo`,
+            "monte_carlo", which also give the energies' covariance. These use
+            each line's own covariance (`propagate.calibration_cov`), never an
+            analysis' "uncertainty" calibration. Samples calibrated with their
+            own peaks ("calibration": "self") always use "formula": those centres
+            fitted the line, so they are not independent of it, as
+            `xrf.propagate` takes them to be. Defaults to "formula".
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        data_path: Optional[Path] = None,
+        fitter: str = "curve_fit",
+        propagation: str = "formula",
+    ):
+        self.path = Path(path) if path is not None else catalog_path
+        with open(self.path, "r") as file:
+            catalog = json.load(file)
+        if catalog["version"] != CATALOG_VERSION:
+            raise ValueError(f"unsupported catalog version {catalog['version']}")
+        if fitter not in ("curve_fit", "batch", "poisson"):
+            raise ValueError(f"unknown fitter {fitter!r}")
+        if propagation not in ("formula", "analytic", "monte_carlo"):
+            raise ValueError(f"unknown propagation {propagation!r}")
+        self.data_path = Path(data_path) if data_path is not None else self.path.parent
+        self.channels = np.arange(catalog["channels"])
+        self.fitter = fitter
+        self.propagation = propagation
+        self.sample_entries = catalog["samples"]
+        self.calibration_entries = catalog["calibrations"]
+        self.analyses = catalog["analyses"]
+        self._calibrations = {}  # name -> fitting.CalibFit, once loaded
+        self._found = {}  # name -> peaks found by `peaksearch`, if "auto"
+
+    def sample(self, name: str) -> Sample:
+        """Catalog entry of a sample."""
+        entry = self.sample_entries[name]
+        file = self.data_path / entry["file"]
+        if entry["peaks"] == "auto":
+            if name not in self._found:
+                self._found[name] = [
+                    Peak(c.first_channel, c.last_channel, c.guess)
+                    for c in peaksearch.search(calib.read_data(file))
+                ]
+            peaks = self._found[name]
+        else:
+            peaks = [
+                Peak(
+                    peak["window"][0],
+                    peak["window"][1],
+                    peak["guess"],
+                    peak.get("energy"),
+                    peak.get("multiplet"),
+                )
+                for peak in entry["peaks"]
+            ]
+        return Sample(
+            name,
+            file,
+            entry["mode"],
+            entry["label"],
+            entry.get("description", ""),
+            peaks,
+            entry.get("background"),
+        )
+
+    def fit_samples(
+        self, names: Sequence[str], workers: Optional[int] = 1
+    ) -> Dict[str, Tuple[np.ndarray, List[fitting.PeakFit]]]:
+        """Reads and fits every peak of the given samples.
+
+        Args:
+            names (Sequence[str]): Samples to fit.
+            workers (int, optional): Processes fitting the samples with "curve_fit",
+                one sample per task; None for one per CPU. Defaults to 1, which
+                fits them in this process. The other fitters always run here.
+
+        Returns:
+            Dict[str, Tuple[np.ndarray, List[fitting.PeakFit]]]: Counts and peak
+                fits of each sample.
+        """
+        samples = [self.sample(name) for name in names]
+        if self.fitter == "curve_fit":
+            if workers is None:
+                workers = os.cpu_count() or 1
+            workers = min(workers, len(samples))
+            if workers <= 1:
+                fitted = [fit_sample(s, self.channels) for s in samples]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    fitted = profiling.pool_map(
+                        pool, fit_sample, samples, [self.channels] * len(samples)
+                    )
+            return {s.name: result for s, result in zip(samples, fitted)}
+        with profiling.stage("fit"):
+            return self._fit_together(samples)
+
+    def _fit_together(
+        self, samples: Sequence[Sample]
+    ) -> Dict[str, Tuple[np.ndarray, List[fitting.PeakFit]]]:
+        """`fit_samples` with the "batch" or "poisson" fitter: the single peaks of
+        every sample in one vectorized solve, then those that failed refitted as
+        "curve_fit" would.
+        """
+        counts = {s.name: calib.read_data(s.file) for s in samples}
+        continua = {
+            s.name: None
+            if s.background is None
+            else background.estimate(counts[s.name], **s.background)
+            for s in samples
+        }
+        if self.fitter == "poisson":
+            fit_multiplet = poisson.fit_multiplet
+        else:
+            fit_multiplet = fitting.fit_multiplet
+        fits = {
+            s.name: fit_multiplets(
+                s, self.channels, counts[s.name], continua[s.name], fit_multiplet
+            )
+            for s in samples
+        }
+
+        # every peak not in a multiplet in one batched solve
+        singles = [
+            (s, i, p)
+            for s in samples
+            for i, p in enumerate(s.peaks)
+            if i not in fits[s.name]
+        ]
+        if singles and self.fitter == "poisson":
+            # the background is part of the expected counts, not subtracted
+            windows = [
+                (counts[s.name], p.first_channel, p.last_channel, p.guess)
+                for s, _, p in singles
+            ]
+            results = poisson.fit_peaks(
+                windows, self.channels, [continua[s.name] for s, _, _ in singles]
+            )
+            records = poisson.peak_fits(windows, results, self.channels)
+            for (s, i, _), record in zip(singles, records):
+                fits[s.name][i] = record
+        elif singles:
+            net = {
+                s.name: counts[s.name]
+                if continua[s.name] is None
+                else counts[s.name] - continua[s.name]
+                for s in samples
+            }
+            params, errs, covs, _ = batch.fit_peaks(
+                [
+                    (net[s.name], p.first_channel, p.last_channel, p.guess)
+                    for s, _, p in singles
+                ],
+                self.channels,
+                full_output=True,
+            )
+            for row, (s, i, p) in enumerate(singles):
+                fits[s.name][i] = fitting.PeakFit(
+                    self.channels[p.first_channel : p.last_channel],
+                    net[s.name][p.first_channel : p.last_channel],
+                    p.first_channel,
+                    p.last_channel,
+                    params[row],
+                    errs[row],
+                    covs[row],
+                    0,  # not counted by the batched solver
+                )
+        for s in samples:
+            self._refit_failed(s, counts[s.name], continua[s.name], fits[s.name])
+        return {
+            s.name: (counts[s.name], [fits[s.name][i] for i in range(len(s.peaks))])
+            for s in samples
+        }
+
+    def _refit_failed(
+        self,
+        sample: Sample,
+        counts: np.ndarray,
+        continuum: Optional[np.ndarray],
+        fits: Dict[int, fitting.PeakFit],
+    ):
+        """Replaces the fits of a sample that are not `fit_usable` (and the rest of
+        their multiplets) by those of the "curve_fit" fitter.
+        """
+        failed = [i for i, fit in fits.items() if not fit_usable(fit)]
+        if not failed:
+            return
+        windows = ", ".join(
+            f"{sample.peaks[i].first_channel}-{sample.peaks[i].last_channel}"
+            for i in failed
+        )
+        warnings.warn(
+            f"{self.fitter} fits of {sample.name} peaks {windows} did not converge; "
+            "refitted with curve_fit",
+            RuntimeWarning,
+        )
+        multiplets = {sample.peaks[i].multiplet for i in failed} - {None}
+        if multiplets:
+            refitted = fit_multiplets(sample, self.channels, counts, continuum)
+            for i, fit in refitted.items():
+                if sample.peaks[i].multiplet in multiplets:
+                    fits[i] = fit
+        for i in failed:
+            peak = sample.peaks[i]
+            if peak.multiplet is None:
+                fits[i] = fitting.fit_gaussian(
+                    self.channels,
+                    counts,
+                    peak.first_channel,
+                    peak.last_channel,
+                    peak.guess,
+                    background=continuum,
+                )
+
+    def self_calibration(
+        self, sample: Sample, fits: List[fitting.PeakFit]
+    ) -> fitting.CalibFit:
+        """Calibration line through the peaks of a sample with reference energies."""
+        return self.self_calibrations([(sample, fits)])[0]
+
+    def self_calibrations(
+        self, samples: Sequence[Tuple[Sample, List[fitting.PeakFit]]]
+    ) -> List[fitting.CalibFit]:
+        """`self_calibration` of several fitted samples, in one vectorized fit."""
+        points = []
+        for sample, fits in samples:
+            lines = [
+                i for i, peak in enumerate(sample.peaks) if peak.energy is not None
+            ]
+            if len(lines) < 2:
+                raise ValueError(f"{sample.name} has fewer than two reference energies")
+            points.append(
+                (
+                    np.array([fits[i].params[1] for i in lines]),
+                    np.array([fits[i].errs[1] for i in lines]),
+                    np.array([sample.peaks[i].energy for i in lines]),
+                )
+            )
+        return fitting.fit_calibrations(*zip(*points)) if points else []
+
+    def calibration(self, name: str) -> fitting.CalibFit:
+        """A named calibration, from its artifact, recomputed first if stale."""
+        if name not in self._calibrations:
+            stale = self._stale([name], set())
+            fitted = self.fit_samples(self._samples_of(stale))
+            self._compute(stale, fitted)
+        return self._calibrations[name]
+
+    def run(
+        self,
+        requests: Dict[str, Optional[Sequence[str]]],
+        calibrations: Sequence[str] = (),
+        save_figures: Optional[bool] = None,
+        workers: Optional[int] = None,
+    ) -> Dict[str, Dict[str, SampleResult]]:
+        """Runs analyses from the catalog.
+
+        Args:
+            requests (Dict[str, Optional[Sequence[str]]]): Samples to run in each
+                analysis, e.g. {"metals": ["au", "cu"]}; None for all of them.
+            calibrations (Sequence[str], optional): Named calibrations to resolve
+                as well, e.g. "metals_avg". A calibration whose samples are all
+                run here is recomputed and saved regardless of its artifact.
+            save_figures (bool, optional): Whether to save figures. Defaults to
+                each analysis' "save_figures" (itself defaulting to true).
+            workers (int, optional): Processes fitting the samples and rendering
+                the figures. Defaults to one per CPU; 1 runs everything in this
+                process, with identical results.
+
+        Returns:
+            Dict[str, Dict[str, SampleResult]]: Results by analysis and sample.
+        """
+        jobs = []
+        for analysis, names in requests.items():
+            listed = self.analyses[analysis]["samples"]
+            for name in listed if names is None else names:
+                if name not in listed:
+                    raise KeyError(f"{name} is not a sample of {analysis}")
+                jobs.append((analysis, name))
+        requested = {name for _, name in jobs}
+
+        needed = list(calibrations)
+        for analysis, name in jobs:
+            needed += self._calibration_names(analysis, self.sample(name).mode)
+        stale = self._stale(needed, requested)
+
+        # one pass over every peak: requested samples and those of stale calibrations
+        names = list(
+            dict.fromkeys([name for _, name in jobs] + self._samples_of(stale))
+        )
+        fitted = self.fit_samples(names, workers)
+        self._compute(stale, fitted)
+
+        results, figures = {}, []
+        for analysis, name in jobs:
+            result = self._result(analysis, self.sample(name), *fitted[name])
+            results.setdefault(analysis, {})[name] = result
+            settings = self._settings(analysis, name)
+            if (
+                settings.get("save_figures", True)
+                if save_figures is None
+                else save_figures
+            ):
+                figures += self._figures(settings, result)
+        render.render(figures, workers=workers)
+        return results
+
+    def _calibration_names(self, analysis: str, mode: str) -> List[str]:
+        """Named calibrations a sample needs: the one it is calibrated with, then,
+        for the "formula" propagation, the one whose uncertainties are used, if
+        different.
+        """
+        spec = self.analyses[analysis]["calibration"]
+        if spec == "self":
+            return []
+        names = [spec[mode] if isinstance(spec, dict) else spec]
+        uncertainty = self.analyses[analysis].get("uncertainty", {}).get(mode)
+        if self.propagation != "formula":
+            uncertainty = None
+        if uncertainty is not None and uncertainty != names[0]:
+            names.append(uncertainty)
+        return names
+
+    def _members(self, name: str) -> Tuple[List[str], List[str]]:
+        entry = self.calibration_entries[name]
+        if "sample" in entry:
+            return [entry["sample"]], []
+        average = entry["average"]
+        return average.get("samples", []), average.get("calibrations", [])
+
+    def _provenance(self, name: str) -> Tuple[List[Path], List[artifacts.Definition]]:
+        samples, calibrations = self._members(name)
+        inputs = [self.sample(s).file for s in samples]
+        definitions = [("calibration/" + name, self.calibration_entries[name])]
+        definitions += [("sample/" + s, self.sample_entries[s]) for s in samples]
+        if samples:
+            # peaks fitted by another fitter, or by changed code, give another
+            # calibration, and so does another line fit
+            definitions.append(("fitter", self.fitter))
+            # the functions behind each fit, as in its `fitcache` key
+            definitions += [
+                fitting.fit_gaussian,
+                fitting.gaussian,
+                fitting.gaussian_jac,
+            ]
+            definitions += [
+                fitting.fit_multiplet,
+                fitting.multiplet_start,
+                fitting.multiplet,
+                fitting.multiplet_jac,
+            ]
+            if self.fitter == "batch":
+                definitions.append(batch.solve_stack)
+            elif self.fitter == "poisson":
+                definitions.append(poisson.solve)
+            definitions.append(fitting.weighted_lines)
+        if "average" in self.calibration_entries[name]:
+            definitions += [average_calibration, Engine.slope_scales]
+        for member in calibrations:
+            member_inputs, member_definitions = self._provenance(member)
+            inputs += member_inputs
+            definitions += member_definitions
+        return inputs, definitions
+
+    def _stale(self, names: Sequence[str], requested: Set[str]) -> List[str]:
+        """Calibrations among `names` (and their members) that must be computed,
+        members first. The others are loaded from their artifacts.
+        """
+        stale = []
+
+        def visit(name: str) -> bool:
+            if name in stale:
+                return True
+            if name in self._calibrations:
+                return False
+            samples, calibrations = self._members(name)
+            members_stale = [visit(member) for member in calibrations]
+            refit = any(members_stale) or (samples and requested.issuperset(samples))
+            if not refit:
+                artifact = artifacts.read(name)
+                refit = artifact is None or not artifacts.is_current(
+                    artifact, *self._provenance(name)
+                )
+            if refit:
+                stale.append(name)
+            else:
+                self._calibrations[name] = artifacts.to_fit(artifact)
+            return refit
+
+        for name in dict.fromkeys(names):
+            visit(name)
+        return stale
+
+    def _samples_of(self, calibrations: Sequence[str]) -> List[str]:
+        return list(
+            dict.fromkeys(s for name in calibrations for s in self._members(name)[0])
+        )
+
+    def _compute(
+        self,
+        stale: Sequence[str],
+        fitted: Dict[str, Tuple[np.ndarray, List[fitting.PeakFit]]],
+    ):
+        """Computes and saves stale calibrations, in order, from fitted samples."""
+        for name in stale:
+            with profiling.stage("calibration", name):
+                samples, calibrations = self._members(name)
+                entry = self.calibration_entries[name]
+                if "sample" in entry:
+                    fit = self.self_calibration(
+                        self.sample(samples[0]), fitted[samples[0]][1]
+                    )
+                else:
+                    fits = self.self_calibrations(
+                        [(self.sample(s), fitted[s][1]) for s in samples]
+                    )
+                    members = [
+                        (fit, self.sample(s).mode) for fit, s in zip(fits, samples)
+                    ] + [
+                        (self._calibrations[c], self.calibration_mode(c))
+                        for c in calibrations
+                    ]
+                    scales = self.slope_scales(name)
+                    fit = average_calibration(
+                        [m[0] for m in members], [scales.get(m[1], 1) for m in members]
+                    )
+                artifacts.save(name, fit, *self._provenance(name))
+                self._calibrations[name] = fit
+
+    def slope_scales(self, name: str) -> Dict[str, float]:
+        """Factor on the slope of each detector mode's lines averaged into a
+        calibration, putting them all on one gain (modes left out count as 1).
+
+        An average with "gain": mode scales each line by the gain of its spectrum
+        over that mode's, as read from the PMCA headers. Otherwise the factors are
+        the entry's "slope_scale".
+        """
+        average = self.calibration_entries[name]["average"]
+        if "gain" not in average:
+            return dict(average.get("slope_scale", {}))
+        samples, calibrations = self._members(name)
+        spectra = [self.sample(s) for s in samples] + [
+            self.sample(self.calibration_entries[c]["sample"])
+            for c in calibrations
+            if "sample" in self.calibration_entries[c]
+        ]
+        gains = {}
+        for sample in spectra:
+            gain = calib.read_spectrum(sample.file).gain
+            if not np.isclose(gains.setdefault(sample.mode, gain), gain):
+                raise ValueError(f"{name} averages {sample.mode} lines of two gains")
+        if average["gain"] not in gains:
+            raise ValueError(f"{name} has no {average['gain']} line to take gain from")
+        reference = gains[average["gain"]]
+        return {mode: gain / reference for mode, gain in gains.items()}
+
+    def calibration_mode(self, calibration: str) -> str:
+        """Detector mode of a calibration fitted to one sample."""
+        entry = self.calibration_entries[calibration]
+        return self.sample(entry["sample"]).mode if "sample" in entry else "default"
+
+    def _result(
+        self,
+        analysis: str,
+        sample: Sample,
+        counts: np.ndarray,
+        fits: List[fitting.PeakFit],
+    ) -> SampleResult:
+        names = self._calibration_names(analysis, sample.mode)
+        if names:
+            calibration = self._calibrations[names[0]]
+        else:
+            calibration = self.self_calibration(sample, fits)
+        centres = np.array([fit.params[1] for fit in fits])
+        centre_errs = np.array([fit.errs[1] for fit in fits])
+        energy_cov = None
+        with profiling.stage("propagate", sample.name):
+            # self-calibrated centres are correlated with their line; see `Engine`
+            if self.propagation == "formula" or not names:
+                uncertainty = self._calibrations[names[-1]] if names else None
+                energies, energy_errs = peak_energies(
+                    calibration, centres, centre_errs, uncertainty
+                )
+            else:
+                method = getattr(propagate, self.propagation)
+                propagated = method(
+                    centres,
+                    centre_errs,
+                    calibration.params,
+                    propagate.calibration_cov(calibration),
+                    centre_cov=centre_cov(sample, fits),
+                )
+                energies, energy_errs = propagated.energies, propagated.errs
+                energy_cov = propagated.cov
+        channel_energies = calib.line(self.channels, *calibration.params)
+        return SampleResult(
+            sample,
+            counts,
+            fits,
+            calibration,
+            channel_energies,
+            energies,
+            energy_errs,
+            energy_cov,
+        )
+
+    def _settings(self, analysis: str, name: str) -> Dict[str, Any]:
+        settings = dict(self.analyses[analysis])
+        settings.update(settings.pop("overrides", {}).get(name, {}))
+        return settings
+
+    def _figures(
+        self, settings: Dict[str, Any], result: SampleResult
+    ) -> List[render.Figure]:
+        sample = result.sample
+        fields = {
+            "name": sample.name,
+            "label": sample.label,
+            "description": sample.description,
+            "mode": sample.mode,
+            "setting": SETTING_NAMES.get(sample.mode, sample.mode),
+            "date": sample.file.name.partition("_")[0],
+        }
+        fig_path = Path.cwd() / settings["figures"]
+        fig_path.mkdir(parents=True, exist_ok=True)
+        figures = []
+        if settings.get("peak_figure"):
+            for i, fit in enumerate(result.fits):
+                path_save = fig_path / settings["peak_figure"].format(
+                    peak=i + 1, **fields
+                )
+                figures.append(
+                    render.Figure("plot_peak_fit", path_save, (fit, sample.label))
+                )
+        if settings.get("calib_figure") and settings["calibration"] == "self":
+            path_save = fig_path / settings["calib_figure"].format(**fields)
+            figures.append(
+                render.Figure(
+                    "plot_calib_curve", path_save, (result.calibration, sample.label)
+                )
+            )
+        if settings.get("spectrum_figure"):
+            mark_peaks = settings.get("mark_peaks", True)
+            figures.append(
+                render.Figure(
+                    "plot_spectrum",
+                    fig_path / settings["spectrum_figure"].format(**fields),
+                    (
+                        result.energies,
+                        result.counts,
+                        result.peak_energies if mark_peaks else [],
+                        result.peak_energy_errs if mark_peaks else [],
+                        settings["title"].format(**fields),
+                    ),
+                    {"color": settings.get("color", "gold")},
+                )
+            )
+        return figures
+
+
+def shared(path: Optional[Path] = None, propagation: str = "formula") -> Engine:
+    """One engine per catalog (and propagation) per process, so calibrations are
+    loaded only once.
+    """
+    return _shared(None if path is None else Path(path), propagation)
+
+
+@lru_cache(maxsize=None)
+def _shared(path: Optional[Path], propagation: str) -> Engine:
+    return Engine(path, propagation=propagation)
+
+
+def argument_parser(
+    description: str, jobs: Optional[int] = None
+) -> argparse.ArgumentParser:
+    """Command line parser shared by the analysis scripts, with `--jobs N`,
+    `--propagation METHOD` (see `Engine`), `--cache` (see `cache`) and
+    `--profile [TRACE]` (see `profiling`).
+
+    Args:
+        description (str): Description of the script.
+        jobs (int, optional): Default number of processes. Defaults to one per CPU.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=jobs,
+        metavar="N",
+        help="processes fitting samples and rendering figures; 1 runs serially "
+        "(default: one per CPU)",
+    )
+    parser.add_argument(
+        "--propagation",
+        choices=["formula", "analytic", "monte_carlo"],
+        default="formula",
+        help="how peak energy uncertainties are computed: the original formula, or "
+        "with the full covariances to first order or by Monte Carlo "
+        "(default: formula)",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="read spectra through the on-disk cache in .xrf_cache/, which pays "
+        "off only for large spectra or slow file systems",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path.cwd() / "outputs" / "profile" / "trace.json",
+        metavar="TRACE",
+        help="time each stage and sample, print a summary and save a Chrome trace "
+        "(default: outputs/profile/trace.json)",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="with --profile, also record peak memory of each stage (slower)",
+    )
+    return parser
@@ -0,0 +1,225 @@
+"""
+fitcache.py
+
+Persistent cache of peak fits, so that rerunning an analysis on unchanged spectra
+(e.g. to adjust its plots) returns the fitted parameters and covariances without
+calling `curve_fit` again.
+
+An entry is keyed on a SHA-1 of everything the fit depends on: the counts and
+channels of the window, its bounds, the initial guess and other options, the
+source of the model and fitting functions, and the NumPy and SciPy versions.
+Changing any of them simply misses. Entries are rows of a SQLite database, which
+serializes concurrent readers and writers, so worker processes fitting samples in
+parallel share it safely; the least recently used are evicted beyond a size cap.
+A cache that cannot be read or written is skipped, never failing the fit.
+
+Author: Shiqi Xu
+"""
+
+import hashlib
+import inspect
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+enabled = True
+cache_path = Path.cwd() / ".xrf_cache" / "fits.sqlite3"
+max_bytes = 64 * 2**20
+max_entries = 100000
+timeout = 30.0  # seconds to wait for another process's write
+
+_connection = None  # (pid, sqlite3.Connection) of this process
+_inherited = []  # connections of a parent process, never closed in a fork of it
+_usage = None  # [n_entries, n_bytes] of the cache, counted on first write
+_sources: Dict[Callable, str] = {}  # SHA-1 of the source of each function
+
+
+def configure(
+    path: Optional[Path] = None,
+    size_limit: Optional[int] = None,
+    entry_limit: Optional[int] = None,
+    enable: Optional[bool] = None,
+):
+    """Changes cache settings. Arguments left as None are unchanged.
+
+    Args:
+        path (Path, optional): SQLite database holding the fits.
+        size_limit (int, optional): Maximum total size of the fits stored, in bytes.
+        entry_limit (int, optional): Maximum number of fits stored.
+        enable (bool, optional): Whether fits are looked up and stored at all.
+    """
+    global enabled, cache_path, max_bytes, max_entries, _connection, _usage
+    if path is not None:
+        cache_path = Path(path)
+        _connection = _usage = None
+    if size_limit is not None:
+        max_bytes = size_limit
+    if entry_limit is not None:
+        max_entries = entry_limit
+    if enable is not None:
+        enabled = enable
+
+
+def _connect() -> sqlite3.Connection:
+    """This process's connection; a forked worker opens its own."""
+    global _connection
+    if _connection is None or _connection[0] != os.getpid():
+        if _connection is not None:
+            _inherited.append(_connection[1])
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(cache_path), timeout=timeout)
+        connection.execute("PRAGMA journal_mode=WAL")  # readers never block
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS fits (key TEXT PRIMARY KEY, params BLOB, "
+            "cov BLOB, nfev INTEGER, size INTEGER, used REAL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS fits_used ON fits (used)")
+        connection.commit()
+        _connection = (os.getpid(), connection)
+    return _connection[1]
+
+
+def _source(function: Callable) -> str:
+    if function not in _sources:
+        source = inspect.getsource(function)
+        _sources[function] = hashlib.sha1(source.encode()).hexdigest()
+    return _sources[function]
+
+
+def key(
+    functions: Sequence[Callable],
+    x: np.ndarray,
+    y: np.ndarray,
+    first_channel: int,
+    last_channel: int,
+    guess: Optional[Sequence] = None,
+    **options,
+) -> Optional[str]:
+    """Cache key of a fit, or None if the cache is disabled.
+
+    Args:
+        functions (Sequence[Callable]): The fitting function and the model (and
+            Jacobian) it fits; a change to the source of any of them is a miss.
+        x (np.ndarray[float]): Channels in the window.
+        y (np.ndarray[float]): Counts in the window, as fitted.
+        first_channel (int): Lower bound of the window.
+        last_channel (int): Upper bound of the window.
+        guess (Sequence, optional): Initial guess, or None if it is estimated from
+            the window. Defaults to None.
+        **options: Other arguments of the fit, e.g. `analytic_jac=True`.
+
+    Returns:
+        Optional[str]: Hex SHA-1 of the fit's inputs.
+    """
+    if not enabled:
+        return None
+    import scipy
+
+    digest = hashlib.sha1()
+    for function in functions:
+        digest.update(f"{function.__qualname__}={_source(function)}\0".encode())
+    digest.update(f"numpy {np.__version__} scipy {scipy.__version__}\0".encode())
+    for values in (x, y):
+        values = np.ascontiguousarray(values)
+        digest.update(f"{values.dtype.str}{values.shape}\0".encode())
+        digest.update(values.tobytes())
+    digest.update(f"{first_channel}:{last_channel}\0".encode())
+    if guess is not None:
+        digest.update(np.asarray(guess, dtype=float).tobytes())
+    digest.update(f"\0{sorted(options.items())}".encode())
+    return digest.hexdigest()
+
+
+def get(key: Optional[str]) -> Optional[Tuple[np.ndarray, np.ndarray, int]]:
+    """Looks up a fit, marking it recently used.
+
+    Returns:
+        Optional[Tuple[np.ndarray, np.ndarray, int]]: Fitted parameters, their
+            covariance and the evaluations the fit took, or None on a miss.
+    """
+    if key is None or not enabled:
+        return None
+    try:
+        connection = _connect()
+        row = connection.execute(
+            "SELECT params, cov, nfev FROM fits WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with connection:
+            connection.execute(
+                "UPDATE fits SET used = ? WHERE key = ?", (time.time(), key)
+            )
+    except sqlite3.Error:
+        return None
+    params = np.frombuffer(row[0], dtype=float).copy()
+    cov = np.frombuffer(row[1], dtype=float).reshape(len(params), len(params)).copy()
+    return params, cov, row[2]
+
+
+def put(key: Optional[str], params: np.ndarray, cov: np.ndarray, nfev: int):
+    """Stores a fit, then evicts old entries if over a limit."""
+    global _usage
+    if key is None or not enabled:
+        return
+    params = np.ascontiguousarray(params, dtype=float).tobytes()
+    cov = np.ascontiguousarray(cov, dtype=float).tobytes()
+    size = len(key) + len(params) + len(cov)
+    try:
+        connection = _connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?, ?)",
+                (key, params, cov, int(nfev), size, time.time()),
+            )
+        if _usage is None:
+            _usage = list(
+                connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM fits"
+                ).fetchone()
+            )
+        else:
+            _usage[0] += 1
+            _usage[1] += size
+        if _usage[0] > max_entries or _usage[1] > max_bytes:
+            evict()
+    except sqlite3.Error:
+        pass
+
+
+def evict():
+    """Removes least recently used entries until the cache is within its limits."""
+    global _usage
+    connection = _connect()
+    with connection:
+        n_entries, n_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM fits"
+        ).fetchone()
+        oldest = []
+        for entry, size in connection.execute(
+            "SELECT key, size FROM fits ORDER BY used"
+        ):
+            if n_entries <= max_entries and n_bytes <= max_bytes:
+                break
+            oldest.append((entry,))
+            n_entries -= 1
+            n_bytes -= size
+        connection.executemany("DELETE FROM fits WHERE key = ?", oldest)
+    _usage = [n_entries, n_bytes]
+
+
+def clear():
+    """Deletes every cached fit."""
+    global _usage
+    if cache_path.exists():
+        connection = _connect()
+        with connection:
+            connection.execute("DELETE FROM fits")
+        connection.execute("VACUUM")
+    _usage = [0, 0]
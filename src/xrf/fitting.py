@@ -0,0 +1,542 @@
+"""
+fitting.py
+
+Peak and calibration-line fits as plain functions returning result records.
+Nothing here imports matplotlib; see `plotting.py` for rendering the records.
+SciPy is imported on the first fit, so that importing the package stays cheap.
+Peak fits go through `fitcache` (unless `use_cache` is False), so unchanged fits
+are not repeated.
+
+Author: Shiqi Xu
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from xrf import fitcache, profiling
+
+
+def gaussian(x: np.ndarray, height: float, centre: float, std: float):
+    return height * np.exp(-((x - centre) ** 2) / (2 * std**2))
+
+
+def gaussian_jac(x: np.ndarray, height: float, centre: float, std: float):
+    """Derivatives of `gaussian` w.r.t. [height, centre, std], as a (len(x), 3)
+    array (the `jac` argument of `curve_fit`).
+    """
+    offset = x - centre
+    exp = np.exp(-(offset**2) / (2 * std**2))
+    d_centre = height * exp * offset / std**2
+    return np.stack([exp, d_centre, d_centre * offset / std], axis=-1)
+
+
+def estimate_gaussian(
+    x: np.ndarray, y: np.ndarray, method: str = "caruana"
+) -> List[float]:
+    """Estimates Gaussian parameters of a peak directly from the data in its window.
+
+    "caruana" fits a parabola to log(y) (Caruana's algorithm, weighted by y**2 as
+    proposed by Guo to damp the noise of low-count bins). "moments" uses the
+    count-weighted mean and standard deviation of the window. The parabola is
+    also replaced by moments when it does not open downwards.
+
+    Args:
+        x (np.ndarray[float]): Channels (or energies) in the window.
+        y (np.ndarray[int]): Counts in the window.
+        method (str, optional): "caruana" or "moments". Defaults to "caruana".
+
+    Returns:
+        List[float]: Estimated [height, centre, std].
+
+    Raises:
+        ValueError: The window has no positive counts, so no peak to estimate (e.g.
+            early in a live acquisition).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if not np.any(y > 0):
+        window = f"[{x[0]:g}, {x[-1]:g}]" if len(x) else "[]"
+        raise ValueError(f"no positive counts in the window {window} to estimate")
+    if method == "caruana":
+        positive = y > 0
+        if np.count_nonzero(positive) >= 3:
+            # weighted least squares of log(y) on [1, t, t**2], with t centred on the
+            # window for conditioning
+            x_mean = x[positive].mean()
+            powers = (x[positive] - x_mean)[:, None] ** np.arange(5)
+            weights = y[positive] ** 2
+            moments = weights @ powers
+            rhs = (weights * np.log(y[positive])) @ powers[:, :3]
+            c0, c1, c2 = np.linalg.lstsq(
+                moments[np.add.outer(np.arange(3), np.arange(3))], rhs, rcond=None
+            )[0]
+            if c2 < 0:
+                return [
+                    float(np.exp(c0 - c1**2 / (4 * c2))),
+                    float(x_mean - c1 / (2 * c2)),
+                    float(np.sqrt(-1 / (2 * c2))),
+                ]
+    elif method != "moments":
+        raise ValueError(f"unknown method {method!r}")
+
+    weights = np.clip(y, 0, None)
+    centre = np.sum(x * weights) / np.sum(weights)
+    std = np.sqrt(np.sum((x - centre) ** 2 * weights) / np.sum(weights))
+    if std == 0 and len(x) > 1:  # counts in one bin; a zero width cannot be fitted
+        std = np.median(np.abs(np.diff(x)))
+    return [float(np.max(y)), float(centre), float(std)]
+
+
+def multiplet(x: np.ndarray, params: np.ndarray, n_peaks: int, origin: float = 0):
+    """Sum of `n_peaks` Gaussians on a polynomial background.
+
+    Args:
+        x (np.ndarray[float]): Channels (or energies).
+        params (np.ndarray[float]): [height, centre, std] of each Gaussian, then the
+            background coefficients of (x - origin)**0, (x - origin)**1, ...
+        n_peaks (int): Number of Gaussians.
+        origin (float, optional): Where the background polynomial is expanded
+            about; the middle of the window keeps the fit well conditioned.
+            Defaults to 0.
+    """
+    peaks = np.reshape(params[: 3 * n_peaks], (n_peaks, 3))
+    y = np.polynomial.polynomial.polyval(x - origin, params[3 * n_peaks :])
+    for height, centre, std in peaks:
+        y = y + gaussian(x, height, centre, std)
+    return y
+
+
+def multiplet_jac(
+    x: np.ndarray, params: np.ndarray, n_peaks: int, origin: float = 0
+) -> np.ndarray:
+    """Derivatives of `multiplet` w.r.t. its parameters, as a (len(x), len(params))
+    array.
+    """
+    peaks = np.reshape(params[: 3 * n_peaks], (n_peaks, 3))
+    n_background = len(params) - 3 * n_peaks
+    columns = [gaussian_jac(x, *peak) for peak in peaks]
+    columns.append((x - origin)[:, None] ** np.arange(n_background))
+    return np.hstack(columns)
+
+
+def line(x: np.ndarray, slope: float, intercept: float):
+    return slope * x + intercept
+
+
+class PeakFit(NamedTuple):
+    """Result of fitting a Gaussian to one peak.
+
+    Attributes:
+        channels (np.ndarray[float]): Channels (or energies) in the fit window.
+        counts (np.ndarray[int]): Counts in the fit window.
+        first_channel (int): Lower bound of the window, as passed to the fit.
+        last_channel (int): Upper bound of the window, as passed to the fit.
+        params (np.ndarray[float]): Fitted [height, centre, std].
+        errs (np.ndarray[float]): Uncertainties of `params`.
+        cov (np.ndarray[float]): Full 3x3 covariance of `params`.
+        nfev (int): Model evaluations (plus Jacobian evaluations) used.
+        centre_covs (np.ndarray[float], optional): For a Gaussian of a multiplet,
+            the covariance of its centre with the centre of each Gaussian of the
+            multiplet, in fit order; None for a peak fitted on its own.
+    """
+
+    channels: np.ndarray
+    counts: np.ndarray
+    first_channel: int
+    last_channel: int
+    params: np.ndarray
+    errs: np.ndarray
+    cov: np.ndarray
+    nfev: int
+    centre_covs: Optional[np.ndarray] = None
+
+
+class MultipletFit(NamedTuple):
+    """Result of fitting overlapping Gaussians and a background in one window.
+
+    Attributes:
+        channels (np.ndarray[float]): Channels (or energies) in the fit window.
+        counts (np.ndarray[int]): Counts in the fit window.
+        first_channel (int): Lower bound of the window, as passed to the fit.
+        last_channel (int): Upper bound of the window, as passed to the fit.
+        params (np.ndarray[float]): Fitted parameters, as taken by `multiplet`.
+        errs (np.ndarray[float]): Uncertainties of `params`.
+        cov (np.ndarray[float]): Full covariance of `params`.
+        nfev (int): Model evaluations (plus Jacobian evaluations) used.
+        n_peaks (int): Number of Gaussians.
+        origin (float): Origin of the background polynomial.
+    """
+
+    channels: np.ndarray
+    counts: np.ndarray
+    first_channel: int
+    last_channel: int
+    params: np.ndarray
+    errs: np.ndarray
+    cov: np.ndarray
+    nfev: int
+    n_peaks: int
+    origin: float
+
+    def peak_fits(self) -> List[PeakFit]:
+        """Each Gaussian as a PeakFit over the whole window, with its block of the
+        covariance; of the correlations with the other peaks, only those of the
+        centres are kept (`PeakFit.centre_covs`).
+        """
+        centres = slice(1, 3 * self.n_peaks, 3)
+        fits = []
+        for i in range(self.n_peaks):
+            block = slice(3 * i, 3 * i + 3)
+            fits.append(
+                PeakFit(
+                    self.channels,
+                    self.counts,
+                    self.first_channel,
+                    self.last_channel,
+                    self.params[block],
+                    self.errs[block],
+                    self.cov[block, block],
+                    self.nfev,
+                    self.cov[3 * i + 1, centres],
+                )
+            )
+        return fits
+
+    def background(self, x: np.ndarray) -> np.ndarray:
+        """The fitted background at `x`."""
+        return np.polynomial.polynomial.polyval(
+            x - self.origin, self.params[3 * self.n_peaks :]
+        )
+
+
+class CalibFit(NamedTuple):
+    """Result of fitting a calibration line through peak centres.
+
+    Attributes:
+        peak_centres (np.ndarray[float]): Centre channel of each peak.
+        peak_centre_errs (np.ndarray[float]): Uncertainties of `peak_centres`.
+        energies (np.ndarray[float]): Literature energy of each peak (keV).
+        params (np.ndarray[float]): Fitted [slope, intercept].
+        errs (np.ndarray[float]): Diagonal of the covariance, scaled by
+            max(1, sqrt(chi-squared)); what `calib.calib_curve` has always returned.
+        cov (np.ndarray[float]): Full 2x2 covariance of `params`.
+        chisq (float): Chi-squared statistic of `energies` against the line.
+    """
+
+    peak_centres: np.ndarray
+    peak_centre_errs: np.ndarray
+    energies: np.ndarray
+    params: np.ndarray
+    errs: np.ndarray
+    cov: np.ndarray
+    chisq: float
+
+
+def fit_gaussian(
+    channels: np.ndarray,
+    counts: np.ndarray,
+    first_channel: int,
+    last_channel: int,
+    guess: Optional[List[float]] = None,
+    analytic_jac: bool = False,
+    background: Optional[np.ndarray] = None,
+    use_cache: bool = True,
+) -> PeakFit:
+    """Fits a Gaussian to the counts between two channels.
+
+    Args:
+        channels (np.ndarray[float]): Detector channel corresponding to an energy bin.
+            Alternately, energy levels.
+        counts (np.ndarray[int]): Counts seen in each channel.
+        first_channel (int): Lower bound on channels (energy levels) included in fit.
+        last_channel (int): Upper bound on channels (energy levels) included in fit.
+        guess (List[float], optional): Guesses for [height, centre, std]. Estimated
+            from the window with `estimate_gaussian` if None. Defaults to None.
+        analytic_jac (bool, optional): Whether to give `curve_fit` the analytic
+            Jacobian of `gaussian` instead of letting it take finite differences.
+            Defaults to False.
+        background (np.ndarray[float], optional): Background counts of each
+            channel (e.g. from `background.snip`), subtracted before fitting so the
+            Gaussian takes only the peak. Defaults to None.
+        use_cache (bool, optional): Whether to look the fit up in, and store it to,
+            `fitcache`; fits that are never repeated, such as those of a growing
+            spectrum, only fill it. Defaults to True.
+
+    Returns:
+        PeakFit: Fit parameters, uncertainties and the data they were fitted to
+            (net of the background, if any).
+    """
+    x = channels[first_channel:last_channel]
+    y = counts[first_channel:last_channel]
+    if background is not None:
+        y = y - background[first_channel:last_channel]
+    if guess is None:
+        guess = estimate_gaussian(x, y)
+    from scipy.optimize import curve_fit
+
+    key = (
+        fitcache.key(
+            (fit_gaussian, gaussian, gaussian_jac),
+            x,
+            y,
+            first_channel,
+            last_channel,
+            guess,
+            analytic_jac=analytic_jac,
+        )
+        if use_cache
+        else None  # live fits are never repeated; they would only churn the cache
+    )
+    cached = fitcache.get(key)
+    if cached is not None:
+        params, cov, nfev = cached
+    else:
+        with profiling.stage("curve_fit"):
+            params, cov, info, _, _ = curve_fit(
+                gaussian,
+                x,
+                y,
+                p0=guess,
+                jac=gaussian_jac if analytic_jac else None,
+                full_output=True,
+            )
+            nfev = info["nfev"] + info.get("njev", 0)
+            profiling.count(nfev)
+        fitcache.put(key, params, cov, nfev)
+    return PeakFit(
+        x, y, first_channel, last_channel, params, np.sqrt(np.diag(cov)), cov, nfev
+    )
+
+
+def multiplet_start(
+    x: np.ndarray,
+    y: np.ndarray,
+    guesses: Sequence[List[float]],
+    background_order: int,
+    floor: float = 0,
+) -> Tuple[np.ndarray, float]:
+    """Initial parameters of `multiplet` for a window, and the origin of its
+    background polynomial (the middle of the window).
+
+    Each guessed std is capped at a quarter of the gap to the nearest other peak,
+    so that the starting peaks stand apart: at half the gap, where they would
+    just be resolved, they merge into one bump, from which the Poisson fit of
+    e.g. CA_old's 690 and 712 peaks collapses onto a single peak. The background
+    starts flat at the lower of the two ends of the window, and at least at
+    `floor`.
+    """
+    guesses = np.array(guesses, dtype=float).reshape(-1, 3)
+    if len(guesses) > 1:
+        gaps = np.abs(guesses[:, 1, None] - guesses[None, :, 1])
+        np.fill_diagonal(gaps, np.inf)
+        guesses[:, 2] = np.minimum(np.abs(guesses[:, 2]), 0.25 * gaps.min(axis=1))
+    start = np.zeros(background_order + 1)
+    if background_order >= 0:
+        start[0] = max(min(np.mean(y[:3]), np.mean(y[-3:])), floor)
+    return np.concatenate([guesses.ravel(), start]), float(np.mean(x))
+
+
+def fit_multiplet(
+    channels: np.ndarray,
+    counts: np.ndarray,
+    first_channel: int,
+    last_channel: int,
+    guesses: Sequence[List[float]],
+    background_order: int = 1,
+    analytic_jac: bool = True,
+    background: Optional[np.ndarray] = None,
+    use_cache: bool = True,
+) -> MultipletFit:
+    """Fits overlapping Gaussians plus a polynomial background to the counts
+    between two channels, in one solve.
+
+    Args:
+        channels (np.ndarray[float]): Detector channel corresponding to an energy bin.
+            Alternately, energy levels.
+        counts (np.ndarray[int]): Counts seen in each channel.
+        first_channel (int): Lower bound on channels (energy levels) included in fit.
+        last_channel (int): Upper bound on channels (energy levels) included in fit.
+        guesses (Sequence[List[float]]): Guesses for [height, centre, std] of each
+            peak. Each std is capped at a quarter of the distance to the nearest
+            other centre (see `multiplet_start`).
+        background_order (int, optional): Degree of the background polynomial; -1
+            for none. Defaults to 1 (linear).
+        analytic_jac (bool, optional): Whether to give `curve_fit` the analytic
+            Jacobian of `multiplet`. Defaults to True.
+        background (np.ndarray[float], optional): Background counts of each
+            channel, subtracted before fitting. Defaults to None.
+        use_cache (bool, optional): Whether to go through `fitcache`, as for
+            `fit_gaussian`. Defaults to True.
+
+    Returns:
+        MultipletFit: Fit parameters, uncertainties and the data they were fitted to.
+    """
+    x = channels[first_channel:last_channel]
+    y = counts[first_channel:last_channel]
+    if background is not None:
+        y = y - background[first_channel:last_channel]
+    p0, origin = multiplet_start(x, y, guesses, background_order)
+    n_peaks = (len(p0) - background_order - 1) // 3
+    from scipy.optimize import curve_fit
+
+    key = (
+        fitcache.key(
+            (fit_multiplet, multiplet_start, multiplet, multiplet_jac),
+            x,
+            y,
+            first_channel,
+            last_channel,
+            guesses,
+            background_order=background_order,
+            analytic_jac=analytic_jac,
+        )
+        if use_cache
+        else None
+    )
+    cached = fitcache.get(key)
+    if cached is not None:
+        params, cov, nfev = cached
+    else:
+        with profiling.stage("curve_fit"):
+            params, cov, info, _, _ = curve_fit(
+                lambda x, *p: multiplet(x, np.array(p), n_peaks, origin),
+                x,
+                y,
+                p0=p0,
+                jac=(lambda x, *p: multiplet_jac(x, np.array(p), n_peaks, origin))
+                if analytic_jac
+                else None,
+                full_output=True,
+            )
+            nfev = info["nfev"] + info.get("njev", 0)
+            profiling.count(nfev)
+        fitcache.put(key, params, cov, nfev)
+    return MultipletFit(
+        x,
+        y,
+        first_channel,
+        last_channel,
+        params,
+        np.sqrt(np.diag(cov)),
+        cov,
+        nfev,
+        n_peaks,
+        origin,
+    )
+
+
+def weighted_lines(
+    x: np.ndarray,
+    y: np.ndarray,
+    sigma: np.ndarray,
+    mask: Optional[np.ndarray] = None,
+    absolute_sigma: bool = False,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Closed-form weighted least-squares lines, y = slope * x + intercept, for a
+    stack of point sets at once.
+
+    The same fit as `curve_fit(line, x, y, sigma=sigma)`: `sigma` are relative
+    uncertainties, so the covariance is scaled by the reduced chi-squared, and it
+    is infinite for sets of two points or fewer. With `absolute_sigma`, as for
+    `curve_fit`, it is not scaled, so two points determine it too. The sums are
+    taken about the weighted mean channel, which keeps them well-conditioned.
+
+    Args:
+        x (np.ndarray[float]): (N, K) channels, or (K,) for one line.
+        y (np.ndarray[float]): Energies, as `x`.
+        sigma (np.ndarray[float]): Uncertainties of `y` (weights 1 / sigma**2).
+        mask (np.ndarray[bool], optional): Which points of each set to fit, for
+            sets of different sizes padded to K. Defaults to all of them.
+        absolute_sigma (bool, optional): Whether `sigma` are absolute
+            uncertainties. Defaults to False.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N, 2) [slope, intercept] and their
+            (N, 2, 2) covariances, or (2,) and (2, 2) for one line.
+    """
+    single = np.ndim(x) == 1
+    x, y, sigma = (np.atleast_2d(np.asarray(a, dtype=float)) for a in (x, y, sigma))
+    mask = np.ones(x.shape, dtype=bool) if mask is None else np.atleast_2d(mask)
+    weights = np.where(mask, 1 / np.where(mask, sigma, 1) ** 2, 0)
+    x, y = np.where(mask, x, 0), np.where(mask, y, 0)
+
+    total = weights.sum(axis=1)
+    x_mean = (weights * x).sum(axis=1) / total
+    y_mean = (weights * y).sum(axis=1) / total
+    dx = np.where(mask, x - x_mean[:, None], 0)
+    sxx = (weights * dx**2).sum(axis=1)
+    slope = (weights * dx * (y - y_mean[:, None])).sum(axis=1) / sxx
+    intercept = y_mean - slope * x_mean
+
+    cov = np.empty((len(x), 2, 2))
+    cov[:, 0, 0] = 1 / sxx
+    cov[:, 0, 1] = cov[:, 1, 0] = -x_mean / sxx
+    cov[:, 1, 1] = 1 / total + x_mean**2 / sxx
+    if not absolute_sigma:
+        dof = mask.sum(axis=1) - 2
+        residuals = np.where(mask, y - slope[:, None] * x - intercept[:, None], 0)
+        chisq = (weights * residuals**2).sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov *= np.where(dof > 0, chisq / dof, np.inf)[:, None, None]
+    params = np.stack([slope, intercept], axis=1)
+    return (params[0], cov[0]) if single else (params, cov)
+
+
+def fit_calibration(
+    peak_centres: np.ndarray,
+    peak_centre_errs: np.ndarray,
+    energies: np.ndarray,
+    guess: Optional[List[float]] = None,
+) -> CalibFit:
+    """Fits a calibration line, energy against channel, through peak centres.
+
+    Args:
+        peak_centres (np.ndarray[float]): Locations of peaks (centre channel).
+        peak_centre_errs (np.ndarray[float]): Uncertainties of `peak_centres`, used
+            as weights.
+        energies (np.ndarray[float]): Energies of each peak, from literature.
+        guess (List[float], optional): Deprecated and ignored: the fit is in closed
+            form (see `weighted_lines`). Defaults to None.
+
+    Returns:
+        CalibFit: Line parameters, uncertainties and the points they were fitted to.
+    """
+    return fit_calibrations([peak_centres], [peak_centre_errs], [energies])[0]
+
+
+def fit_calibrations(
+    peak_centres: Sequence[np.ndarray],
+    peak_centre_errs: Sequence[np.ndarray],
+    energies: Sequence[np.ndarray],
+) -> List[CalibFit]:
+    """`fit_calibration` of many point sets, of any sizes, in one vectorized solve.
+
+    Args:
+        peak_centres (Sequence[np.ndarray]): Centre channels of each set's peaks.
+        peak_centre_errs (Sequence[np.ndarray]): Their uncertainties.
+        energies (Sequence[np.ndarray]): Literature energies of each set's peaks.
+
+    Returns:
+        List[CalibFit]: One calibration per set.
+    """
+    sets = [
+        tuple(np.asarray(a, dtype=float) for a in points)
+        for points in zip(peak_centres, peak_centre_errs, energies)
+    ]
+    size = max((len(x) for x, _, _ in sets), default=0)
+    stacked = np.zeros((3, len(sets), size))
+    mask = np.zeros((len(sets), size), dtype=bool)
+    for i, points in enumerate(sets):
+        stacked[:, i, : len(points[0])] = points
+        mask[i, : len(points[0])] = True
+    with profiling.stage("line_fit"):
+        params, covs = weighted_lines(stacked[0], stacked[2], stacked[1], mask)
+
+    fits = []
+    for (x, sigma, y), p, cov in zip(sets, params, covs):
+        expected = line(x, p[0], p[1])
+        chisq = float(np.sum((y - expected) ** 2 / expected))
+        errs = np.diag(cov) * max(1, np.sqrt(chisq))
+        fits.append(CalibFit(x, sigma, y, p, errs, cov, chisq))
+    return fits
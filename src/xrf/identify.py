@@ -0,0 +1,257 @@
+"""
+identify.py
+
+Identification of the elements behind the peaks of a spectrum, e.g. the metals of
+a coin, by matching each element's pattern of emission lines (`xrf.lines`) against
+all of the fitted peaks at once.
+
+Lines closer together than the detector resolves (e.g. Ka1 and Ka2) are first
+merged into one, at their intensity-weighted energy. Each series of an element
+(its K, L or M lines) is then scored against the peaks of a spectrum, over its
+lines inside the energy range searched:
+
+- each line matches its closest peak with exp(-z**2 / 2), for z their distance in
+  units of the peak energy's uncertainty;
+- coverage is the intensity-weighted mean match of the lines, so a series whose
+  strong lines have no peak scores low;
+- agreement is exp(-chi**2 / 2n) over its n lines, comparing the area of the
+  peak each line matches (none if unmatched) with its intensity scaled to fit
+  them, allowing Poisson noise and a relative error of `ratio_scale` in the
+  intensities; so a weak line cannot explain a strong peak, and a strong peak
+  implies its companion lines. A series with a single line in range has no
+  ratios to check, so its agreement is capped (`single_line`), and a lone peak
+  ranks below a series whose line ratios agree.
+
+Elements that are gases at room temperature (`lines.GASES`, e.g. Kr) are left out
+of the table by default, as a solid sample does not hold them.
+
+An element's confidence is the best coverage * agreement of its series, in [0, 1].
+Matches are found by binary search in the energy-sorted line table, and spectra
+are scored together as arrays over (spectrum, line) and (spectrum, series).
+
+Author: Shiqi Xu
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from xrf import fitting, lines
+
+
+class Candidate(NamedTuple):
+    """An element identified in a spectrum.
+
+    Attributes:
+        element (str): Element symbol.
+        z (int): Atomic number.
+        family (str): Line series that matched best, "K", "L" or "M".
+        confidence (float): coverage * agreement, in [0, 1].
+        coverage (float): Intensity-weighted match of the series' lines to peaks.
+        agreement (float): Agreement of the matched peak areas with the expected
+            line intensities.
+        peaks (Tuple[int, ...]): Peaks matched by its lines within 2 sigma.
+        lines (Tuple[str, ...]): Those lines, e.g. ("Ka1+Ka2", "Kb1").
+    """
+
+    element: str
+    z: int
+    family: str
+    confidence: float
+    coverage: float
+    agreement: float
+    peaks: Tuple[int, ...]
+    lines: Tuple[str, ...]
+
+
+def peak_areas(fits: Sequence[fitting.PeakFit]) -> np.ndarray:
+    """Area (counts) under each fitted Gaussian, height * std * sqrt(2 pi)."""
+    return np.array(
+        [fit.params[0] * abs(fit.params[2]) * np.sqrt(2 * np.pi) for fit in fits]
+    )
+
+
+def merge_unresolved(table: lines.LineTable, resolution: float) -> lines.LineTable:
+    """Table with each element's lines of a family closer than `resolution` (keV)
+    merged into one, at their intensity-weighted energy and summed intensity, and
+    named e.g. "Ka1+Ka2".
+    """
+    order = np.lexsort((table.energy, table.family, table.element))
+    element, family = table.element[order], table.family[order]
+    energy, intensity = table.energy[order], table.intensity[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (
+        (element[1:] != element[:-1])
+        | (family[1:] != family[:-1])
+        | (np.diff(energy) > resolution)
+    )
+    group = np.cumsum(starts) - 1
+    total = np.bincount(group, weights=intensity)
+    centre = np.bincount(group, weights=intensity * energy) / total
+    names = [[] for _ in range(len(total))]
+    for g, i in zip(group, order):
+        names[g].append(table.line[i])
+    first = order[starts]
+    return lines.LineTable(
+        [
+            lines.Line(
+                table.element[i],
+                int(table.z[i]),
+                "+".join(names[g]),
+                table.family[i],
+                float(centre[g]),
+                float(total[g]),
+            )
+            for g, i in enumerate(first)
+        ]
+    )
+
+
+def elements(
+    energies: Sequence[np.ndarray],
+    energy_errs: Sequence[np.ndarray],
+    areas: Sequence[np.ndarray],
+    n_sigma: float = 3.0,
+    resolution: float = 0.15,
+    ratio_scale: float = 0.5,
+    min_confidence: float = 0.1,
+    ranges: Optional[Sequence[Tuple[float, float]]] = None,
+    table: Optional[lines.LineTable] = None,
+    single_line: float = 0.5,
+    exclude: Sequence[str] = lines.GASES,
+) -> List[List[Candidate]]:
+    """Ranks the elements whose lines explain the peaks of each spectrum.
+
+    Args:
+        energies (Sequence[np.ndarray]): Peak energies (keV) of each spectrum, e.g.
+            `SampleResult.peak_energies`.
+        energy_errs (Sequence[np.ndarray]): Their uncertainties (keV). Peaks whose
+            uncertainty is not finite and positive, e.g. of fits that failed, are
+            left out.
+        areas (Sequence[np.ndarray]): Their areas (counts), e.g. from `peak_areas`.
+        n_sigma (float, optional): Lines further than this many uncertainties from
+            every peak are unmatched; peaks this far beyond the outermost lines
+            still set the energy range. Defaults to 3.
+        resolution (float, optional): Lines of an element closer than this (keV)
+            are taken as one peak. Defaults to 0.15.
+        ratio_scale (float, optional): Relative uncertainty of the expected line
+            intensities, which vary with the detector and sample (absorption,
+            efficiency). Defaults to 0.5.
+        min_confidence (float, optional): Candidates below it are left out.
+            Defaults to 0.1.
+        ranges (Sequence[Tuple[float, float]], optional): Energy range (keV) in
+            which the peaks of each spectrum were sought, e.g. that of its
+            channels; lines in it are expected to show. Defaults to the span of
+            its peaks, widened by n_sigma uncertainties.
+        table (lines.LineTable, optional): Lines to match. Defaults to the bundled
+            table.
+        single_line (float, optional): Highest agreement of a series with a
+            single line in range, whose one peak says nothing of its line ratios.
+            Defaults to 0.5.
+        exclude (Sequence[str], optional): Elements left out of the table.
+            Defaults to the gases, `lines.GASES`.
+
+    Returns:
+        List[List[Candidate]]: Candidates of each spectrum, most confident first.
+    """
+    table = lines.table() if table is None else table
+    if len(exclude):
+        table = table.select(exclude=exclude)
+    table = merge_unresolved(table, resolution)
+    n_spectra, n_lines = len(energies), len(table)
+    n_peaks = np.array([len(e) for e in energies])
+    spectrum = np.repeat(np.arange(n_spectra), n_peaks)
+    first_peak = np.cumsum(n_peaks) - n_peaks
+    energy = np.concatenate([np.asarray(e, dtype=float) for e in energies])
+    sigma = np.abs(np.concatenate([np.asarray(e, dtype=float) for e in energy_errs]))
+    area = np.concatenate([np.asarray(a, dtype=float) for a in areas])
+
+    # a failed fit's infinite (or zero) uncertainty would match every line (or none)
+    usable = np.flatnonzero(np.isfinite(energy) & np.isfinite(sigma) & (sigma > 0))
+
+    # best match of each (spectrum, line) among the peaks within n_sigma of it
+    found = table.within(energy[usable], n_sigma * sigma[usable])
+    query = usable[found.query]
+    score = np.exp(-0.5 * (found.delta / sigma[query]) ** 2)
+    key = spectrum[query] * n_lines + found.line
+    best = np.lexsort((-score, key))
+    best = best[np.unique(key[best], return_index=True)[1]]
+    match = np.zeros((n_spectra, n_lines))
+    best_peak = np.full((n_spectra, n_lines), -1)  # index within its spectrum
+    rows, columns = np.divmod(key[best], n_lines)
+    seen = np.zeros((n_spectra, n_lines))
+    match[rows, columns] = score[best]
+    best_peak[rows, columns] = query[best] - first_peak[rows]
+    seen[rows, columns] = area[query[best]]
+
+    # lines of each series inside each spectrum's energy range count as expected
+    if ranges is None:
+        low = np.full(n_spectra, np.inf)
+        high = np.full(n_spectra, -np.inf)
+        spread = n_sigma * sigma[usable]
+        np.minimum.at(low, spectrum[usable], energy[usable] - spread)
+        np.maximum.at(high, spectrum[usable], energy[usable] + spread)
+    else:
+        low, high = np.asarray(ranges, dtype=float).reshape(n_spectra, 2).T
+    expected = (table.energy >= low[:, None]) & (table.energy <= high[:, None])
+    weight = np.where(expected, table.intensity, 0)
+
+    series_keys, series = np.unique(
+        np.char.add(np.char.add(table.element, " "), table.family), return_inverse=True
+    )
+    series = series.ravel()
+    members = np.zeros((n_lines, len(series_keys)))
+    members[np.arange(n_lines), series] = 1
+    total = weight @ members
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coverage = np.where(total > 0, (weight * match) @ members / total, 0)
+        # area of the peak at each expected line ~ scale * intensity
+        seen = np.where(expected, seen, 0)
+        scale = (seen * weight) @ members / (weight**2 @ members)
+        scale[~np.isfinite(scale)] = 0  # no lines in range; 0 * nan would spread
+        predicted = np.where(expected, scale[:, series] * table.intensity, 0)
+        variance = predicted + (ratio_scale * predicted) ** 2
+        chisq = np.where(variance > 0, (seen - predicted) ** 2 / variance, 0)
+    n_expected = expected @ members
+    agreement = np.exp(-0.5 * (chisq @ members) / np.maximum(n_expected, 1))
+    agreement = np.where(n_expected == 1, np.minimum(agreement, single_line), agreement)
+    confidence = coverage * agreement
+
+    ranked = []
+    for s in range(n_spectra):
+        best_series = {}
+        for g in np.flatnonzero(confidence[s] >= min_confidence):
+            element = series_keys[g].split(" ")[0]
+            if (
+                element not in best_series
+                or confidence[s, g] > confidence[s, best_series[element]]
+            ):
+                best_series[element] = g
+        candidates = []
+        for element, g in best_series.items():
+            in_series = np.flatnonzero((series == g) & (match[s] >= np.exp(-2)))
+            first = np.flatnonzero(series == g)[0]
+            candidates.append(
+                Candidate(
+                    element,
+                    int(table.z[first]),
+                    str(table.family[first]),
+                    float(confidence[s, g]),
+                    float(coverage[s, g]),
+                    float(agreement[s, g]),
+                    tuple(sorted({int(best_peak[s, j]) for j in in_series})),
+                    tuple(str(table.line[j]) for j in in_series),
+                )
+            )
+        ranked.append(sorted(candidates, key=lambda c: -c.confidence))
+    return ranked
+
+
+def format_candidates(candidates: Sequence[Candidate], top: int = 5) -> str:
+    """The `top` candidates of a spectrum as lines of text."""
+    return "\n".join(
+        f"  {c.element:2s} {c.family}  confidence {c.confidence:.2f} "
+        f"(coverage {c.coverage:.2f}, ratios {c.agreement:.2f})  "
+        f"peaks {', '.join(str(p) for p in c.peaks)}: {', '.join(c.lines)}"
+        for c in candidates[:top]
+    )
@@ -0,0 +1,236 @@
+"""
+lines.py
+
+Database of X-ray emission lines (element, line, family, energy and relative
+intensity), bundled as `xray_lines.csv` next to this module, with reference
+energies looked up by name instead of typed in as literals, e.g.
+`lines.energy("Au", "La1")`, and measured peaks matched to the lines near them.
+
+The table is held as NumPy columns sorted by energy, so the lines within a window
+of each of N peak energies are found with two binary searches per peak
+(`np.searchsorted`), all peaks at once.
+
+Author: Shiqi Xu
+"""
+
+import csv
+from functools import lru_cache
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+
+lines_path = Path(__file__).resolve().parent / "xray_lines.csv"
+
+# elements that are gases at room temperature, absent from solid samples
+GASES = ("H", "He", "N", "O", "F", "Ne", "Cl", "Ar", "Kr", "Xe", "Rn")
+
+
+class Line(NamedTuple):
+    """One emission line.
+
+    Attributes:
+        element (str): Element symbol, e.g. "Au".
+        z (int): Atomic number.
+        line (str): Siegbahn name, e.g. "La1".
+        family (str): "K", "L" or "M".
+        energy (float): Energy (keV).
+        intensity (float): Intensity relative to the strongest line of its family
+            (100).
+    """
+
+    element: str
+    z: int
+    line: str
+    family: str
+    energy: float
+    intensity: float
+
+
+class Matches(NamedTuple):
+    """Lines found near each of a set of energies, as flat pairs sorted by query
+    and then by line energy.
+
+    Attributes:
+        query (np.ndarray[int]): Index of the queried energy.
+        line (np.ndarray[int]): Index of the line in the table.
+        delta (np.ndarray[float]): Line energy minus queried energy (keV).
+    """
+
+    query: np.ndarray
+    line: np.ndarray
+    delta: np.ndarray
+
+
+class LineTable:
+    """Emission lines as columns sorted by energy.
+
+    Args:
+        rows (Sequence[Line]): The lines, in any order.
+    """
+
+    def __init__(self, rows: Sequence[Line]):
+        rows = sorted(rows, key=lambda row: (row.energy, row.z, row.line))
+        self.element = np.array([row.element for row in rows], dtype=str)
+        self.z = np.array([row.z for row in rows], dtype=int)
+        self.line = np.array([row.line for row in rows], dtype=str)
+        self.family = np.array([row.family for row in rows], dtype=str)
+        self.energy = np.array([row.energy for row in rows], dtype=float)
+        self.intensity = np.array([row.intensity for row in rows], dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.energy)
+
+    def __getitem__(self, index: int) -> Line:
+        return Line(
+            str(self.element[index]),
+            int(self.z[index]),
+            str(self.line[index]),
+            str(self.family[index]),
+            float(self.energy[index]),
+            float(self.intensity[index]),
+        )
+
+    def select(
+        self,
+        elements: Optional[Sequence[str]] = None,
+        families: Optional[Sequence[str]] = None,
+        min_intensity: float = 0,
+        exclude: Sequence[str] = (),
+    ) -> "LineTable":
+        """Table of the lines of some elements or families, e.g.
+        `select(["Cu", "Ni", "Zn"], families=["K"])`.
+
+        Args:
+            elements (Sequence[str], optional): Element symbols. Defaults to all.
+            families (Sequence[str], optional): Line families. Defaults to all.
+            min_intensity (float, optional): Lowest relative intensity kept.
+                Defaults to 0.
+            exclude (Sequence[str], optional): Element symbols left out, e.g.
+                `GASES`. Defaults to none.
+        """
+        keep = self.intensity >= min_intensity
+        keep &= ~np.isin(self.element, list(exclude))
+        if elements is not None:
+            keep &= np.isin(self.element, list(elements))
+        if families is not None:
+            keep &= np.isin(self.family, list(families))
+        return LineTable([self[i] for i in np.flatnonzero(keep)])
+
+    def lines(self, element: str) -> List[Line]:
+        """Every line of an element, by increasing energy."""
+        return [self[i] for i in np.flatnonzero(self.element == element)]
+
+    def energy_of(self, element: str, line: str) -> float:
+        """Energy (keV) of a line, e.g. `energy_of("Cu", "Ka1")`."""
+        found = np.flatnonzero((self.element == element) & (self.line == line))
+        if len(found) == 0:
+            raise KeyError(f"{element} {line}")
+        return float(self.energy[found[0]])
+
+    def blend(self, element: str, lines: Sequence[str]) -> float:
+        """Intensity-weighted mean energy (keV) of lines too close to resolve, e.g.
+        `blend("Au", ["La1", "La2"])` for the Au L-alpha peak.
+        """
+        found = np.flatnonzero((self.element == element) & np.isin(self.line, lines))
+        if len(found) != len(set(lines)):
+            raise KeyError(f"{element} {', '.join(lines)}")
+        return float(np.average(self.energy[found], weights=self.intensity[found]))
+
+    def within(
+        self, energies: np.ndarray, tolerance: Union[float, np.ndarray]
+    ) -> Matches:
+        """Every line within +/- `tolerance` of each energy.
+
+        Args:
+            energies (np.ndarray[float]): Energies to look up (keV), e.g. fitted
+                peak energies.
+            tolerance (float or np.ndarray[float]): Half-width of the window (keV),
+                the same for all energies or one each (e.g. their uncertainties).
+
+        Returns:
+            Matches: (query, line) pairs with the lines' offsets from the energies.
+        """
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        tolerance = np.broadcast_to(np.abs(tolerance), energies.shape)
+        first = np.searchsorted(self.energy, energies - tolerance, side="left")
+        last = np.searchsorted(self.energy, energies + tolerance, side="right")
+        n_found = last - first
+        query = np.repeat(np.arange(len(energies)), n_found)
+        # position of each pair within its query's run of lines
+        starts = np.cumsum(n_found) - n_found
+        line = first[query] + np.arange(len(query)) - starts[query]
+        return Matches(query, line, self.energy[line] - energies[query])
+
+    def nearest(self, energies: np.ndarray) -> Matches:
+        """The closest line to each energy.
+
+        Returns:
+            Matches: One pair per energy, in order.
+        """
+        energies = np.atleast_1d(np.asarray(energies, dtype=float))
+        above = np.clip(np.searchsorted(self.energy, energies), 1, len(self) - 1)
+        below = above - 1
+        closer_below = energies - self.energy[below] <= self.energy[above] - energies
+        line = np.where(closer_below, below, above)
+        return Matches(np.arange(len(energies)), line, self.energy[line] - energies)
+
+
+def read_lines(path: Path) -> LineTable:
+    """Reads a line table from CSV (element, z, line, family, energy, intensity),
+    skipping comment lines starting with "#".
+    """
+    with open(path, "r", newline="") as file:
+        rows = csv.DictReader(row for row in file if not row.startswith("#"))
+        return LineTable(
+            [
+                Line(
+                    row["element"],
+                    int(row["z"]),
+                    row["line"],
+                    row["family"],
+                    float(row["energy"]),
+                    float(row["intensity"]),
+                )
+                for row in rows
+            ]
+        )
+
+
+@lru_cache(maxsize=None)
+def table() -> LineTable:
+    """The bundled line table, read once."""
+    return read_lines(lines_path)
+
+
+def energy(element: str, line: str) -> float:
+    """Energy (keV) of a line of the bundled table, e.g. `energy("Au", "La1")`."""
+    return table().energy_of(element, line)
+
+
+def identify(
+    energies: np.ndarray,
+    tolerance: Union[float, np.ndarray],
+    min_intensity: float = 0,
+) -> List[List[Line]]:
+    """Candidate lines of the bundled table for each measured peak energy.
+
+    Args:
+        energies (np.ndarray[float]): Peak energies (keV).
+        tolerance (float or np.ndarray[float]): Half-width of the match window
+            (keV), e.g. the energies' uncertainties.
+        min_intensity (float, optional): Weakest relative intensity considered.
+            Defaults to 0.
+
+    Returns:
+        List[List[Line]]: Lines within the window of each energy, closest first.
+    """
+    lines = (
+        table() if min_intensity <= 0 else table().select(min_intensity=min_intensity)
+    )
+    matches = lines.within(energies, tolerance)
+    candidates = [[] for _ in range(len(np.atleast_1d(energies)))]
+    for i in np.lexsort((np.abs(matches.delta), matches.query)):
+        candidates[matches.query[i]].append(lines[matches.line[i]])
+    return candidates
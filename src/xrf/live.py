@@ -0,0 +1,241 @@
+"""
+live.py
+
+Live view of an acquisition: follows a PMCA spectrum file (or the newest spectrum
+of a directory) while PMCA keeps saving it, and refits its peaks as counts arrive,
+so that their centres can be watched converging during a run.
+
+The file is polled at a fixed cadence and parsed again only when its size or
+modification time changed. Only peaks whose window gained counts are refitted,
+each starting from its previous parameters, which then converges in a few
+evaluations. These fits bypass `fitcache`, since a growing spectrum never repeats
+one. The time spent reading and fitting is capped at a fraction `duty` of the wall
+time, by stretching the interval between polls when the fits are slow.
+
+Run `src/live.py` to follow the peaks of a catalog sample.
+
+Author: Shiqi Xu
+"""
+
+import time
+import warnings
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from xrf import fitting, pmca
+
+
+# fit window and Gaussian guess [height, centre, std] (None to estimate) of a peak
+Window = Tuple[int, int, Optional[List[float]]]
+
+
+class Update(NamedTuple):
+    """Peak fits of one new version of the spectrum.
+
+    Attributes:
+        spectrum (pmca.Spectrum): Spectrum as last saved.
+        fits (List[Optional[fitting.PeakFit]]): Latest fit of each peak, or None
+            until its first fit succeeds.
+        refitted (List[bool]): Which peaks were fitted again for this update.
+        busy_time (float): Seconds spent reading and fitting the spectrum.
+    """
+
+    spectrum: pmca.Spectrum
+    fits: List[Optional[fitting.PeakFit]]
+    refitted: List[bool]
+    busy_time: float
+
+
+class Follower:
+    """Polls a spectrum file, or the newest matching file of a directory, and
+    parses it again only when it changed.
+
+    Args:
+        path (Path): Spectrum file, or directory the spectra are saved to.
+        pattern (str, optional): Glob of the spectra in a directory.
+            Defaults to "*.csv".
+    """
+
+    def __init__(self, path: Path, pattern: str = "*.csv"):
+        self.path = Path(path)
+        self.pattern = pattern
+        self._signature = None  # (file, mtime, size) last parsed
+
+    def current(self) -> Optional[Path]:
+        """File followed now: `path`, or the newest spectrum in it."""
+        if not self.path.is_dir():
+            return self.path
+        newest = None
+        for file in self.path.glob(self.pattern):
+            try:
+                modified = file.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if newest is None or modified > newest[0]:
+                newest = (modified, file)
+        return None if newest is None else newest[1]
+
+    def poll(self) -> Optional[pmca.Spectrum]:
+        """The spectrum, if its file changed since the last poll, else None.
+
+        A file caught while being written (no `<<END>>` after its counts yet) is
+        left for the next poll.
+        """
+        file = self.current()
+        try:
+            stat = file.stat()
+        except (AttributeError, FileNotFoundError):
+            return None
+        signature = (file, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return None
+        try:
+            with open(file, "rb") as handle:
+                raw = handle.read()
+            if raw.find(b"<<END>>", raw.find(b"<<DATA>>")) == -1:
+                return None
+            spectrum = pmca.parse_spectrum(raw, file)
+        except (OSError, ValueError):
+            return None
+        self._signature = signature
+        return spectrum
+
+
+class LiveFit:
+    """Gaussian fits of fixed peak windows of a growing spectrum, each refitted
+    only when its counts changed, starting from its previous fit.
+
+    Args:
+        peaks (Sequence[Window]): Fit window (first and last channel) and initial
+            guess of each peak.
+    """
+
+    def __init__(self, peaks: Sequence[Window]):
+        self.peaks = list(peaks)
+        self.fits: List[Optional[fitting.PeakFit]] = [None] * len(self.peaks)
+        self._fitted = [None] * len(self.peaks)  # window counts of each fit
+
+    def update(self, counts: np.ndarray) -> List[bool]:
+        """Refits the peaks whose window counts changed.
+
+        A failed fit (no convergence, or a centre outside its window) keeps the
+        previous one and is tried again on the next update.
+
+        Args:
+            counts (np.ndarray[int]): Counts in each channel.
+
+        Returns:
+            List[bool]: Which peaks have a new fit.
+        """
+        channels = np.arange(len(counts))
+        refitted = []
+        for i, (first, last, guess) in enumerate(self.peaks):
+            window = counts[first:last]
+            previous = self.fits[i]
+            if self._fitted[i] is not None and np.array_equal(window, self._fitted[i]):
+                refitted.append(False)
+                continue
+            start = guess if previous is None else list(previous.params)
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    fit = fitting.fit_gaussian(
+                        channels,
+                        counts,
+                        first,
+                        last,
+                        start,
+                        analytic_jac=True,
+                        use_cache=False,
+                    )
+            except (RuntimeError, ValueError):
+                fit = None
+            accepted = (
+                fit is not None
+                and np.all(np.isfinite(fit.errs))
+                and first <= fit.params[1] < last
+            )
+            if accepted:
+                self.fits[i] = fit
+                self._fitted[i] = window.copy()
+            refitted.append(bool(accepted))
+        return refitted
+
+
+def print_update(update: Update):
+    """Prints the centre and uncertainty of each peak, one line per peak."""
+    spectrum = update.spectrum
+    print(
+        f"{spectrum.filename.name}: live time {spectrum.live_time:.1f} s, "
+        f"{int(np.sum(spectrum.counts))} counts ({1e3 * update.busy_time:.0f} ms)"
+    )
+    for i, (fit, refitted) in enumerate(zip(update.fits, update.refitted)):
+        if fit is None:
+            print(f"  peak {i + 1}: no fit yet")
+            continue
+        height, centre, std = fit.params
+        print(
+            f"  peak {i + 1}: centre {centre:8.2f} +- {fit.errs[1]:5.2f}, "
+            f"std {abs(std):5.2f}, height {height:7.1f}"
+            + ("" if refitted else " (unchanged)")
+        )
+
+
+def follow(
+    path: Path,
+    peaks: Sequence[Window],
+    interval: float = 2.0,
+    duty: float = 0.25,
+    emit: Callable[[Update], None] = print_update,
+    max_updates: Optional[int] = None,
+    timeout: Optional[float] = None,
+    pattern: str = "*.csv",
+) -> Optional[Update]:
+    """Follows an acquisition, fitting its peaks each time the spectrum is saved.
+
+    Args:
+        path (Path): Spectrum file, or directory of spectra (the newest is followed).
+        peaks (Sequence[Window]): Fit window and initial guess of each peak.
+        interval (float, optional): Seconds between polls. Defaults to 2.
+        duty (float, optional): Largest fraction of the time spent reading and
+            fitting; polls are spaced further apart when they take longer.
+            Defaults to 0.25.
+        emit (Callable[[Update], None], optional): Called with every update.
+            Defaults to `print_update`.
+        max_updates (int, optional): Stop after this many updates.
+            Defaults to None, never.
+        timeout (float, optional): Stop once the spectrum has not changed for this
+            many seconds, e.g. at the end of the run. Defaults to None, never.
+        pattern (str, optional): Glob of the spectra in a directory.
+            Defaults to "*.csv".
+
+    Returns:
+        Optional[Update]: The last update, or None if the spectrum never appeared.
+
+    Raises:
+        ValueError: `duty` is not in (0, 1].
+    """
+    if not 0 < duty <= 1:
+        raise ValueError(f"duty {duty} must be in (0, 1]")
+    follower = Follower(path, pattern)
+    live = LiveFit(peaks)
+    last, n_updates = None, 0
+    changed = time.monotonic()
+    while True:
+        start = time.monotonic()
+        spectrum = follower.poll()
+        if spectrum is not None:
+            refitted = live.update(spectrum.counts)
+            last = Update(spectrum, list(live.fits), refitted, time.monotonic() - start)
+            emit(last)
+            n_updates += 1
+            changed = time.monotonic()
+            if max_updates is not None and n_updates >= max_updates:
+                break
+        elif timeout is not None and time.monotonic() - changed > timeout:
+            break
+        busy = time.monotonic() - start
+        time.sleep(max(interval - busy, busy * (1 / duty - 1)))
+    return last
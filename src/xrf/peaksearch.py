@@ -0,0 +1,259 @@
+"""
+peaksearch.py
+
+Automatic peak search: proposes fit windows and Gaussian guesses for every
+significant peak of a spectrum (or of a stack of spectra), in place of hand-picked
+channel bounds.
+
+The spectrum is filtered with a smoothed, zero-area second-derivative kernel (a
+Gaussian's negated second derivative, after Mariscotti). A flat or linear
+background filters to zero, while a Gaussian of standard deviation `std` filters
+to a positive lobe of half-width sqrt(std**2 + width**2) about its centre. Each
+channel's filtered value is divided by its Poisson standard deviation, and local
+maxima above `threshold` standard deviations are reported as peaks. A few
+smoothing widths are searched, since each is most sensitive to peaks of about its
+own width. Filtering is by FFT, and the maxima are found, for all spectra and
+widths at once; a 2048-channel spectrum takes about half a millisecond, most of
+it in the FFTs.
+
+Set a sample's "peaks" to "auto" in `data/catalog.json` to fit the peaks found.
+
+Author: Shiqi Xu
+"""
+
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence, Tuple, Union
+
+import numpy as np
+
+from xrf.batch import Window
+
+
+class Candidate(NamedTuple):
+    """A peak found by `search`.
+
+    Attributes:
+        first_channel (int): Lower bound of the proposed fit window.
+        last_channel (int): Upper bound of the proposed fit window (exclusive, as
+            for `fitting.fit_gaussian`).
+        guess (List[float]): Initial [height, centre, std].
+        significance (float): Filtered value over its standard deviation.
+    """
+
+    first_channel: int
+    last_channel: int
+    guess: List[float]
+    significance: float
+
+
+def kernel(width: float) -> np.ndarray:
+    """Negated second derivative of a Gaussian of standard deviation `width`,
+    truncated at 4 widths and shifted to zero area.
+    """
+    half = int(np.ceil(4 * width))
+    x = np.arange(-half, half + 1) / width
+    weights = (1 - x**2) * np.exp(-(x**2) / 2)
+    return weights - weights.mean()
+
+
+@lru_cache(maxsize=None)
+def fft_length(n: int) -> int:
+    """Smallest length of at least `n` with no prime factor above 5 (fast FFTs)."""
+    best = 1 << int(np.ceil(np.log2(n)))
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35 << max(int(np.ceil(np.log2(n / power35))), 0)
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+@lru_cache(maxsize=None)
+def kernel_transforms(widths: Tuple[float, ...], n_fft: int) -> np.ndarray:
+    """Real FFTs of each width's kernel and of its square, centred on channel 0
+    (wrapping around), so that filtering leaves a spectrum in place.
+
+    Returns:
+        np.ndarray[complex]: Shape (len(widths), 2, 1, n_fft // 2 + 1).
+    """
+    filters = np.zeros((len(widths), 2, 1, n_fft))
+    for i, weights in enumerate(kernel(width) for width in widths):
+        half = len(weights) // 2
+        for j, power in enumerate((1, 2)):
+            filters[i, j, 0, : half + 1] = weights[half:] ** power
+            filters[i, j, 0, n_fft - half :] = weights[:half] ** power
+    return np.fft.rfft(filters)
+
+
+def filter_spectra(
+    counts: np.ndarray, widths: Sequence[float] = (3.0,)
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Second-derivative filter of spectra, at each smoothing width, and the
+    significance of each channel.
+
+    The spectra are reflected at their ends and filtered by FFT, so the cost does
+    not grow with the width.
+
+    Args:
+        counts (np.ndarray[int]): One spectrum, or spectra stacked on the first axis.
+        widths (Sequence[float], optional): Smoothing standard deviations, in
+            channels. Defaults to (3,).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Filtered spectra, of shape
+            (len(widths),) + counts.shape, and the same over their Poisson
+            standard deviations.
+    """
+    counts = np.asarray(counts, dtype=float)
+    spectra = counts.reshape(-1, counts.shape[-1])
+    n_channels = spectra.shape[-1]
+    half = int(np.ceil(4 * max(widths)))
+    if half >= n_channels:
+        raise ValueError(f"widths {widths} too wide for {n_channels} channels")
+    # var(counts) = counts; one count is the floor for empty channels, and the
+    # reflected ends keep the circular convolution from wrapping into the spectrum
+    padded = np.empty((2, len(spectra), n_channels + 2 * half))
+    padded[0, :, half : half + n_channels] = spectra
+    np.maximum(spectra, 1, out=padded[1, :, half : half + n_channels])
+    padded[..., :half] = padded[..., 2 * half : half : -1]
+    padded[..., half + n_channels :] = padded[
+        ..., half + n_channels - 2 : n_channels - 2 : -1
+    ]
+    n_fft = fft_length(padded.shape[-1])
+    transforms = np.fft.rfft(padded, n_fft) * kernel_transforms(tuple(widths), n_fft)
+    filtered = np.fft.irfft(transforms, n_fft)[..., half : half + n_channels]
+    response, variance = filtered[:, 0], filtered[:, 1]
+    shape = (len(widths),) + counts.shape
+    return response.reshape(shape), (response / np.sqrt(variance)).reshape(shape)
+
+
+def search(
+    counts: np.ndarray,
+    widths: Sequence[float] = (3.0, 6.0, 12.0),
+    threshold: float = 4.0,
+    window: float = 3.0,
+) -> List:
+    """Finds the significant peaks of one spectrum or of a stack of spectra.
+
+    Each smoothing width is most sensitive to peaks of about its own standard
+    deviation. Peaks found at several widths are reported once, from the width at
+    which they are most significant.
+
+    Args:
+        counts (np.ndarray[int]): One spectrum, or spectra stacked on the first axis.
+        widths (Sequence[float], optional): Smoothing standard deviations, in
+            channels. Defaults to (3, 6, 12).
+        threshold (float, optional): Significance a peak must exceed, in standard
+            deviations of the filtered spectrum. Defaults to 4.
+        window (float, optional): Half-width of the proposed fit windows, in
+            estimated peak standard deviations. Defaults to 3.
+
+    Returns:
+        List: The Candidates of the spectrum, by channel, or a list of them per
+            spectrum if `counts` is 2-dimensional.
+    """
+    counts = np.asarray(counts)
+    spectra = np.atleast_2d(counts).astype(float)
+    n_spectra, n_channels = spectra.shape
+    responses, significances = filter_spectra(spectra, widths)
+
+    # (spectrum, centre, std, significance) of the maxima at every width at once
+    rows, centres, stds, sigs = maxima(
+        responses, significances, np.asarray(widths, dtype=float)[:, None], threshold
+    )
+    rows %= n_spectra
+
+    # strongest first; drop those within a stronger peak's std
+    kept = [[] for _ in range(n_spectra)]
+    for i in np.argsort(-sigs, kind="stable"):
+        if all(
+            abs(centres[i] - centres[j]) >= max(stds[i], stds[j]) for j in kept[rows[i]]
+        ):
+            kept[rows[i]].append(i)
+
+    candidates = []
+    for row, indices in enumerate(kept):
+        indices = sorted(indices, key=lambda i: centres[i])
+        firsts = np.floor(centres[indices] - window * stds[indices])
+        lasts = np.ceil(centres[indices] + window * stds[indices]) + 1
+        heights = spectra[row, np.round(centres[indices]).astype(int)]
+        candidates.append(
+            [
+                Candidate(
+                    int(max(first, 0)),
+                    int(min(last, n_channels)),
+                    [float(height), float(centres[i]), float(stds[i])],
+                    float(sigs[i]),
+                )
+                for i, first, last, height in zip(indices, firsts, lasts, heights)
+            ]
+        )
+    return candidates[0] if counts.ndim == 1 else candidates
+
+
+def maxima(
+    response: np.ndarray,
+    significance: np.ndarray,
+    width: Union[float, np.ndarray],
+    threshold: float,
+) -> Tuple[np.ndarray, ...]:
+    """Peaks of filtered spectra, e.g. those of `filter_spectra` at every width.
+
+    Args:
+        response (np.ndarray[float]): (..., channels) filtered spectra.
+        significance (np.ndarray[float]): Their significance, of the same shape.
+        width (float or np.ndarray[float]): Smoothing width each was filtered at,
+            broadcast to `response.shape[:-1]`, e.g. (len(widths), 1).
+        threshold (float): Significance a peak must exceed.
+
+    Returns:
+        Tuple[np.ndarray, ...]: Spectrum index (flat over the leading axes), centre,
+            estimated std and significance of each local maximum of the
+            significance above threshold.
+    """
+    n_channels = response.shape[-1]
+    width = np.broadcast_to(width, response.shape[:-1]).ravel()
+    response = response.reshape(-1, n_channels)
+    significance = significance.reshape(-1, n_channels)
+    inner = significance[:, 1:-1]
+    rows, peaks = np.nonzero(
+        (inner > threshold)
+        & (inner >= significance[:, :-2])
+        & (inner > significance[:, 2:])
+    )
+    peaks += 1
+
+    # centre: vertex of the parabola through the response about each maximum
+    left, mid, right = (response[rows, peaks + k] for k in (-1, 0, 1))
+    curvature = left - 2 * mid + right
+    offsets = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+    centres = peaks + np.clip(offsets, -0.5, 0.5)
+
+    # std: from the half-width of the positive lobe, found as the nearest
+    # non-positive channels on either side (linearly interpolated)
+    positive = response > 0
+    positive[:, [0, -1]] = False
+    edges = np.flatnonzero(~positive.ravel())
+    flat_peaks = rows * n_channels + peaks
+    index = np.searchsorted(edges, flat_peaks)
+    upper, lower = edges[index], edges[index - 1]
+    flat_response = response.ravel()
+
+    def crossing(inside: np.ndarray, outside: np.ndarray) -> np.ndarray:
+        """Position of the zero crossing, relative to the peak channel."""
+        r_in, r_out = flat_response[inside], flat_response[outside]
+        # the ends of a spectrum count as edges even where still positive
+        fraction = np.where(r_out <= 0, r_in / (r_in - np.minimum(r_out, 0)), 1)
+        return (inside - flat_peaks) + (outside - inside) * fraction
+
+    half_widths = 0.5 * (crossing(upper - 1, upper) - crossing(lower + 1, lower))
+    stds = np.sqrt(np.maximum(half_widths**2 - width[rows] ** 2, 1.0))
+    return rows, centres, stds, significance[rows, peaks]
+
+
+def windows(counts: np.ndarray, candidates: Sequence[Candidate]) -> List[Window]:
+    """Fit windows of a spectrum's candidates, as taken by `batch.fit_peaks`."""
+    return [(counts, c.first_channel, c.last_channel, c.guess) for c in candidates]
@@ -0,0 +1,214 @@
+"""
+plotting.py
+
+Renders the result records of `fitting.py` as figures.
+
+Author: Shiqi Xu
+"""
+
+from pathlib import Path
+from typing import Dict, Sequence
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.ticker import MaxNLocator
+
+from xrf.fitting import CalibFit, PeakFit, gaussian, line
+
+
+def finish(path_save: Path = None, show_fig: bool = False):
+    """Saves and/or shows the current figure, then closes it."""
+    if path_save is not None:
+        plt.savefig(path_save)
+    if show_fig:
+        plt.show()
+    plt.close()
+
+
+def plot_peak_fit(
+    fit: PeakFit, sample: str, path_save: Path = None, show_fig: bool = False
+):
+    """Plots the data in a peak's fit window against the fitted Gaussian.
+
+    Args:
+        fit (PeakFit): Result of `fitting.fit_gaussian`.
+        sample (str): Name of sample. Used in plot title.
+        path_save (Path, optional): Path to save output plot. Not saved if None.
+        show_fig (bool, optional): Whether to show output plot. Defaults to False.
+    """
+    first_channel, last_channel = fit.first_channel, fit.last_channel
+    peak_fit, fit_err = fit.params, fit.errs
+    scale = last_channel - first_channel
+    peak_fit_x = np.arange(first_channel - scale / 10, last_channel - scale / 10)
+    peak_fit_y = gaussian(peak_fit_x, peak_fit[0], peak_fit[1], peak_fit[2])
+
+    peak_centre = round(peak_fit[1], 2)
+    peak_centre_err = round(fit_err[1], 2)
+
+    plt.figure()
+    plt.plot(fit.channels, fit.counts, "x", label="data")
+    plt.plot(peak_fit_x, peak_fit_y, label="fit")
+    plt.gca().yaxis.set_major_locator(MaxNLocator(integer=True))
+    plt.title(sample + " peak centred around channel " + str(peak_centre))
+    plt.xlabel("Channel")
+    plt.ylabel("Count")
+    plt.text(
+        110,
+        395,
+        "centre:   $" + str(peak_centre) + " \pm " + str(peak_centre_err) + "$",
+        ha="left",
+        va="top",
+        transform=None,
+    )
+    plt.legend()
+    finish(path_save, show_fig)
+
+
+def plot_calib_curve(
+    fit: CalibFit, sample: str, path_save: Path = None, show_fig: bool = False
+):
+    """Plots a calibration line through the peak centres it was fitted to.
+
+    Args:
+        fit (CalibFit): Result of `fitting.fit_calibration`.
+        sample (str): Name of sample used for calibration. Used in plot title.
+        path_save (Path, optional): Path to save output plot. Not saved if None.
+        show_fig (bool, optional): Whether to show output plot. Defaults to False.
+    """
+    peak_centres, peak_centre_errs, energies = (
+        fit.peak_centres,
+        fit.peak_centre_errs,
+        fit.energies,
+    )
+    calib_fit, calib_err = fit.params, fit.errs
+    channel_range = int(max(peak_centres) - min(peak_centres))
+    fit_x = np.arange(
+        int(min(peak_centres) - channel_range / 2),
+        int(max(peak_centres) + channel_range / 2),
+    )
+    fit_y = line(fit_x, calib_fit[0], calib_fit[1])
+
+    plt.figure()
+    plt.plot(fit_x, fit_y)
+    plt.errorbar(
+        peak_centres, energies, peak_centre_errs, fmt="none", ecolor="firebrick"
+    )
+    plt.plot(peak_centres, energies, ".")
+    plt.title(sample + " Calibration Curve")
+    plt.xlabel("Channel $N$")
+    plt.ylabel("Energy $E$ (keV)")
+    plt.text(
+        105,
+        400,
+        "$E = ("
+        + str(round(calib_fit[0], 8))
+        + " \pm "
+        + str(round(calib_err[0], 8))
+        + ") N + ("
+        + str(round(calib_fit[1], 4))
+        + " \pm "
+        + str(round(calib_err[1], 4))
+        + ")$",
+        ha="left",
+        va="top",
+        transform=None,
+    )
+    finish(path_save, show_fig)
+
+
+def plot_spectrum(
+    energies: np.ndarray,
+    counts: np.ndarray,
+    peak_energies: Sequence[float],
+    peak_energy_errs: Sequence[float],
+    title: str,
+    color: str = "gold",
+    path_save: Path = None,
+    show_fig: bool = False,
+):
+    """Plots a calibrated spectrum, with a labelled vertical line at each peak.
+
+    Args:
+        energies (np.ndarray[float]): Energy of each channel (keV).
+        counts (np.ndarray[int]): Counts seen in each channel.
+        peak_energies (Sequence[float]): Fitted peak energies (keV). May be empty.
+        peak_energy_errs (Sequence[float]): Uncertainties of `peak_energies`.
+        title (str): Plot title.
+        color (str, optional): Colour of the peak lines. Defaults to "gold".
+        path_save (Path, optional): Path to save output plot. Not saved if None.
+        show_fig (bool, optional): Whether to show output plot. Defaults to False.
+    """
+    plt.figure()
+    for i in range(len(peak_energies)):
+        plt.axvline(
+            x=peak_energies[i],
+            label="$E = "
+            + str(round(peak_energies[i], 2))
+            + " \pm "
+            + str(round(peak_energy_errs[i], 2))
+            + "$ keV",
+            color=color,
+        )
+    plt.plot(energies, counts, ".", markersize=4)
+    plt.title(title)
+    plt.xlabel("Energy (keV)")
+    plt.ylabel("Count")
+    if len(peak_energies):
+        plt.legend()
+    finish(path_save, show_fig)
+
+
+def plot_calib_curves(
+    channels: np.ndarray,
+    curves: Dict[str, np.ndarray],
+    references: Dict[str, np.ndarray],
+    average: CalibFit,
+    path_save: Path = None,
+    show_fig: bool = False,
+):
+    """Overlays calibration curves and their average.
+
+    Args:
+        channels (np.ndarray[int]): Channels the curves are evaluated at.
+        curves (Dict[str, np.ndarray]): Energy of each channel (keV) by sample,
+            drawn solid.
+        references (Dict[str, np.ndarray]): Same, for the radioactive sources,
+            drawn dashed.
+        average (CalibFit): Average calibration line, drawn dotted and written out.
+        path_save (Path, optional): Path to save output plot. Not saved if None.
+        show_fig (bool, optional): Whether to show output plot. Defaults to False.
+    """
+    with plt.style.context("seaborn"):
+        plt.figure()
+        for label, energies in curves.items():
+            plt.plot(channels, energies, linewidth=0.8, label=label)
+        for label, energies in references.items():
+            plt.plot(channels, energies, "--", linewidth=0.8, label=label)
+        plt.plot(
+            channels,
+            line(channels, average.params[0], average.params[1]),
+            ":",
+            linewidth=1.5,
+            label="AVG",
+        )
+        plt.text(
+            550,
+            73,
+            "$E = ("
+            + str(round(average.params[0], 8))
+            + " \pm "
+            + str(round(average.errs[0], 8))
+            + ") N + ("
+            + str(round(average.params[1], 4))
+            + " \pm "
+            + str(round(average.errs[1], 4))
+            + ")$",
+            ha="right",
+            va="bottom",
+            transform=None,
+        )
+        plt.title("Metal Calibration Curves, by Element/Isotope")
+        plt.xlabel("Channel $N$")
+        plt.ylabel("Energy $E$ (keV)")
+        plt.legend()
+        finish(path_save, show_fig)
@@ -0,0 +1,266 @@
+"""
+pmca.py
+
+Single-pass reader for spectra saved by Amptek's PMCA software
+(the `<<PMCA SPECTRUM>>` text layout used for every file in `data/`).
+
+Author: Shiqi Xu
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+ENCODING = "latin-1"  # DPP STATUS contains a raw degree sign
+
+DETECTOR_MODES = {"1.000": "default", "0.400": "high_rate"}  # by peaking time (us)
+SETTING_CODES = ("TPEA", "GAIN", "MCAC", "THFA", "THSL")
+
+
+def split_sections(raw: bytes) -> Dict[str, Tuple[int, int]]:
+    """Locates every `<<SECTION>>` block of a PMCA file by byte offset.
+
+    Args:
+        raw (bytes): Full contents of a PMCA file.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Section name mapped to the (start, stop) byte
+            offsets of its body, i.e. everything between its marker line and the
+            next marker line. Closing markers (`<<END>>`, `<<... END>>`) are skipped.
+    """
+    sections = {}
+    name, body_start = None, 0
+    pos = raw.find(b"<<")
+    while pos != -1:
+        marker_end = raw.find(b">>", pos)
+        if marker_end == -1:
+            break
+        if name is not None:
+            sections[name] = (body_start, pos)
+        marker = raw[pos + 2 : marker_end].decode(ENCODING)
+        line_end = raw.find(b"\n", marker_end)
+        body_start = len(raw) if line_end == -1 else line_end + 1
+        if marker == "END" or marker.endswith(" END"):
+            name = None
+        else:
+            name = marker
+        pos = raw.find(b"<<", body_start)
+    if name is not None:
+        sections[name] = (body_start, len(raw))
+    return sections
+
+
+def parse_counts(block: bytes) -> np.ndarray:
+    """Converts the body of a `<<DATA>>` section into an integer array.
+
+    Args:
+        block (bytes): Newline-separated channel counts.
+
+    Returns:
+        np.ndarray[int]: 1D array containing counts in each channel.
+    """
+    counts = np.fromstring(block.decode("ascii"), dtype=int, sep=" ")
+    if len(counts) != block.count(b"\n"):
+        raise ValueError("malformed <<DATA>> section")
+    return counts
+
+
+def parse_header(block: bytes) -> Dict[str, str]:
+    """Parses `KEY - value` lines of the `<<PMCA SPECTRUM>>` section.
+
+    Args:
+        block (bytes): Body of the `<<PMCA SPECTRUM>>` section.
+
+    Returns:
+        Dict[str, str]: Header values keyed by field name, e.g. "LIVE_TIME".
+    """
+    header = {}
+    for line in block.decode(ENCODING).splitlines():
+        key, sep, value = line.partition(" - ")
+        if sep:
+            header[key.strip()] = value.strip()
+    return header
+
+
+def read_counts(filename: Path) -> np.ndarray:
+    """Reads the channel counts of a PMCA file with a single read of the file.
+
+    Args:
+        filename (Path): Path to data file (CSV format).
+
+    Returns:
+        np.ndarray[int]: 1D array containing counts in each channel
+            (index corresponds to channel number).
+    """
+    with open(filename, "rb") as file:
+        raw = file.read()
+    start = raw.find(b"<<DATA>>")
+    stop = raw.find(b"<<END>>", start)
+    if start == -1 or stop == -1:
+        raise ValueError(f"{filename} has no <<DATA>> ... <<END>> section")
+    return parse_counts(raw[raw.find(b"\n", start) + 1 : stop])
+
+
+def parse_dp5_config(block: bytes) -> Dict[str, str]:
+    """Parses `CODE=value;    description` lines of the `<<DP5 CONFIGURATION>>`
+    section.
+
+    Args:
+        block (bytes): Body of the `<<DP5 CONFIGURATION>>` section.
+
+    Returns:
+        Dict[str, str]: Setting values keyed by DP5 command code, e.g. "TPEA".
+    """
+    config = {}
+    for line in block.decode(ENCODING).splitlines():
+        code, sep, rest = line.partition("=")
+        if sep:
+            config[code.strip()] = rest.partition(";")[0].strip()
+    return config
+
+
+def parse_dpp_status(block: bytes) -> Dict[str, str]:
+    """Parses `Field: value` lines of the `<<DPP STATUS>>` section.
+
+    Args:
+        block (bytes): Body of the `<<DPP STATUS>>` section.
+
+    Returns:
+        Dict[str, str]: Status values keyed by field name, e.g. "Dead Time".
+    """
+    status = {}
+    for line in block.decode(ENCODING).splitlines():
+        field, sep, value = line.partition(":")
+        if sep:
+            status[field.strip()] = value.strip()
+    return status
+
+
+class Spectrum:
+    """Counts of one PMCA acquisition, with the metadata saved alongside them.
+
+    Attributes:
+        counts (np.ndarray[int]): Counts in each channel.
+        live_time (float): Live time of the acquisition (s).
+        real_time (float): Real time of the acquisition (s).
+        gain (float): Total gain (analog * fine) from the DP5 configuration.
+        start_time (datetime): Time the acquisition started, if recorded.
+        header (Dict[str, str]): Raw `<<PMCA SPECTRUM>>` fields.
+        dp5_config (Dict[str, str]): Raw `<<DP5 CONFIGURATION>>` settings.
+        dpp_status (Dict[str, str]): Raw `<<DPP STATUS>>` fields.
+        filename (Path): File the spectrum was read from, if any.
+    """
+
+    __slots__ = (
+        "counts",
+        "live_time",
+        "real_time",
+        "gain",
+        "start_time",
+        "header",
+        "dp5_config",
+        "dpp_status",
+        "filename",
+    )
+
+    def __init__(
+        self,
+        counts: np.ndarray,
+        header: Dict[str, str],
+        dp5_config: Optional[Dict[str, str]] = None,
+        dpp_status: Optional[Dict[str, str]] = None,
+        filename: Optional[Path] = None,
+    ):
+        self.counts = counts
+        self.header = header
+        self.dp5_config = dp5_config if dp5_config is not None else {}
+        self.dpp_status = dpp_status if dpp_status is not None else {}
+        self.filename = filename
+
+        self.live_time = float(header.get("LIVE_TIME", "nan"))
+        self.real_time = float(header.get("REAL_TIME", "nan"))
+        self.gain = float(self.dp5_config.get("GAIN", header.get("GAIN", "nan")))
+        try:
+            self.start_time = datetime.strptime(
+                header["START_TIME"], "%m/%d/%Y %H:%M:%S"
+            )
+        except (KeyError, ValueError):
+            self.start_time = None
+
+    def __repr__(self) -> str:
+        return (
+            f"Spectrum({self.filename!r}, channels={len(self.counts)}, "
+            f"live_time={self.live_time}, mode={self.detector_mode!r})"
+        )
+
+    @property
+    def channels(self) -> np.ndarray:
+        """Channel numbers, 0 to `len(counts) - 1`."""
+        return np.arange(len(self.counts))
+
+    @property
+    def count_rate(self) -> np.ndarray:
+        """Counts per second of live time in each channel."""
+        return self.counts / self.live_time
+
+    @property
+    def dead_time(self) -> float:
+        """Fraction of real time the detector was not live."""
+        return 1 - self.live_time / self.real_time
+
+    @property
+    def detector_mode(self) -> str:
+        """PX5 preset the run was taken with, "default" or "high_rate", identified
+        by its peaking time. Falls back to "TPEA=<value>" for other settings.
+        """
+        peaking_time = self.dp5_config.get("TPEA", "")
+        return DETECTOR_MODES.get(peaking_time, "TPEA=" + peaking_time)
+
+    @property
+    def detector_setting(self) -> Tuple[str, ...]:
+        """DP5 settings that change the channel scale, for grouping runs."""
+        return tuple(self.dp5_config.get(code, "") for code in SETTING_CODES)
+
+
+def parse_spectrum(raw: bytes, filename: Optional[Path] = None) -> Spectrum:
+    """Builds a `Spectrum` from the contents of a PMCA file, locating every section
+    in the same pass that extracts the counts.
+
+    Args:
+        raw (bytes): Full contents of a PMCA file.
+        filename (Path, optional): Source of `raw`, stored on the spectrum.
+
+    Returns:
+        Spectrum: Counts and parsed metadata.
+    """
+    sections = split_sections(raw)
+    if "DATA" not in sections:
+        raise ValueError(f"{filename} has no <<DATA>> ... <<END>> section")
+
+    def body(name: str) -> bytes:
+        return raw[slice(*sections.get(name, (0, 0)))]
+
+    return Spectrum(
+        parse_counts(body("DATA")),
+        parse_header(body("PMCA SPECTRUM")),
+        parse_dp5_config(body("DP5 CONFIGURATION")),
+        parse_dpp_status(body("DPP STATUS")),
+        filename,
+    )
+
+
+def read_spectrum(filename: Path) -> Spectrum:
+    """Reads a PMCA file, counts and metadata, with a single read of the file.
+
+    Args:
+        filename (Path): Path to data file (CSV format).
+
+    Returns:
+        Spectrum: Counts and parsed metadata.
+    """
+    with open(filename, "rb") as file:
+        raw = file.read()
+    return parse_spectrum(raw, Path(filename))
@@ -0,0 +1,311 @@
+"""
+poisson.py
+
+Poisson maximum-likelihood fits of Gaussian peaks and multiplets, for windows
+with few counts. Least squares with unit weights treats every channel as equally
+noisy. That overweights the sparse tails of a low-count window and biases the
+height and width; the Poisson likelihood weights each channel by its expected
+count instead.
+
+The negative log-likelihood sum(mu - y log(mu)) is minimized by iteratively
+reweighted least squares (Fisher scoring) with Levenberg-Marquardt damping:
+each step solves (J^T W J + lambda diag) dp = J^T (y / mu - 1), with W = 1 / mu,
+using the analytic Jacobian J of the model. J^T W J is the expected Hessian, and
+its inverse at the optimum is the covariance of the parameters. Windows of the
+same model are stacked (see `batch.stack_windows`) and solved together.
+
+As in `batch.solve_stack`, a fit that stops without meeting `tol`, or ends with
+non-finite parameters, a zero width or a centre outside its window, has not
+converged, and its uncertainties and covariance are infinite.
+
+Author: Shiqi Xu
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from xrf import profiling
+from xrf.batch import Window, stack_windows
+from xrf.fitting import MultipletFit, PeakFit, multiplet_start
+
+
+class PoissonFits(NamedTuple):
+    """Results of `solve` for a stack of windows.
+
+    Attributes:
+        params (np.ndarray[float]): (N, P) fitted parameters.
+        errs (np.ndarray[float]): (N, P) uncertainties of `params`; infinite where
+            the fit did not converge.
+        cov (np.ndarray[float]): (N, P, P) covariances, the inverse Fisher
+            information; infinite where the fit did not converge.
+        n_iter (np.ndarray[int]): Iterations (accepted steps) each fit took.
+        converged (np.ndarray[bool]): Whether each fit converged.
+        nfev (np.ndarray[int]): Evaluations of the model (with its Jacobian) each
+            fit took, one per trial step and one per scoring; these are what
+            `PeakFit.nfev` and `profiling.count` hold, as they do for `curve_fit`.
+    """
+
+    params: np.ndarray
+    errs: np.ndarray
+    cov: np.ndarray
+    n_iter: np.ndarray
+    converged: np.ndarray
+    nfev: np.ndarray
+
+
+def model(
+    x: np.ndarray, params: np.ndarray, n_peaks: int, origin: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """`fitting.multiplet` and its Jacobian, for stacked windows.
+
+    Args:
+        x (np.ndarray[float]): (N, L) channels.
+        params (np.ndarray[float]): (N, P) [height, centre, std] of each peak, then
+            the background coefficients.
+        n_peaks (int): Number of Gaussians.
+        origin (np.ndarray[float]): (N,) origin of each background polynomial.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (N, L) model and its (N, L, P) Jacobian.
+    """
+    jac = np.empty(x.shape + (params.shape[1],))
+    mu = np.zeros(x.shape)
+    for k in range(n_peaks):
+        height, centre, std = (params[:, 3 * k + j, None] for j in range(3))
+        offset = x - centre
+        exp = np.exp(-(offset**2) / (2 * std**2))
+        peak = height * exp
+        mu += peak
+        jac[..., 3 * k] = exp
+        jac[..., 3 * k + 1] = peak * offset / std**2
+        jac[..., 3 * k + 2] = jac[..., 3 * k + 1] * offset / std
+    t = x - origin[:, None]
+    for j in range(params.shape[1] - 3 * n_peaks):
+        jac[..., 3 * n_peaks + j] = t**j
+        mu += params[:, 3 * n_peaks + j, None] * t**j
+    return mu, jac
+
+
+def solve(
+    x: np.ndarray,
+    y: np.ndarray,
+    mask: np.ndarray,
+    guesses: np.ndarray,
+    n_peaks: int = 1,
+    origin: Optional[np.ndarray] = None,
+    offset: Optional[np.ndarray] = None,
+    max_iter: int = 100,
+    tol: float = 1e-9,
+) -> PoissonFits:
+    """Poisson maximum-likelihood fits of stacked windows, by damped IRLS.
+
+    Args:
+        x, y, mask (np.ndarray): (N, L) stacked windows, from `batch.stack_windows`.
+        guesses (np.ndarray[float]): (N, P) initial parameters, as for `model`.
+        n_peaks (int, optional): Number of Gaussians. Defaults to 1.
+        origin (np.ndarray[float], optional): (N,) origin of each background
+            polynomial. Defaults to 0.
+        offset (np.ndarray[float], optional): (N, L) known background counts,
+            added to the model rather than subtracted from the data, which would
+            no longer be Poisson. Defaults to None.
+        max_iter (int, optional): Maximum number of accepted steps. Defaults to 100.
+        tol (float, optional): Relative decrease of the negative log-likelihood (and
+            relative step) at which a fit has converged. Defaults to 1e-9.
+
+    Returns:
+        PoissonFits: Parameters, uncertainties, covariances, iteration counts and
+            convergence.
+    """
+    n_windows, n_params = guesses.shape
+    origin = np.zeros(n_windows) if origin is None else np.asarray(origin, float)
+    y = np.where(mask, y, 0)
+    offset = np.zeros(y.shape) if offset is None else np.where(mask, offset, 0)
+    params = np.array(guesses, dtype=float)
+    damping = np.full(n_windows, 1e-3)
+    n_iter = np.zeros(n_windows, dtype=int)
+    nfev = np.full(n_windows, 2)  # the starting likelihood and scoring
+    converged = np.zeros(n_windows, dtype=bool)
+    tiny = 1e-12  # expected counts are kept positive inside the logarithm
+
+    def nll(rows: np.ndarray, p: np.ndarray) -> np.ndarray:
+        mu = model(x[rows], p, n_peaks, origin[rows])[0] + offset[rows]
+        mu = np.maximum(mu, tiny)
+        return np.sum(mask[rows] * (mu - y[rows] * np.log(mu)), axis=1)
+
+    def scoring(rows: np.ndarray, p: np.ndarray):
+        mu, jac = model(x[rows], p, n_peaks, origin[rows])
+        mu = np.maximum(mu + offset[rows], tiny)
+        weights = mask[rows] / mu
+        fisher = np.einsum("nl,nlp,nlq->npq", weights, jac, jac)
+        score = np.einsum("nl,nlp->np", mask[rows] * (y[rows] / mu - 1), jac)
+        return fisher, score
+
+    active = np.arange(n_windows)
+    value = nll(active, params)
+    fisher, score = scoring(active, params)
+    for _ in range(20 * max_iter):
+        if len(active) == 0:
+            break
+        diagonal = np.einsum("npp->np", fisher)
+        lhs = fisher + damping[active, None, None] * (
+            diagonal[:, :, None] * np.eye(n_params)
+        )
+        # pinv, since a peak of zero height leaves its centre and std undetermined
+        step = (np.linalg.pinv(lhs) @ score[..., None])[..., 0]
+        trial = params[active] + step
+        trial_value = nll(active, trial)
+        nfev[active] += 1
+        improved = np.isfinite(trial_value) & (trial_value <= value[active])
+
+        rows = active[improved]
+        gain = value[rows] - trial_value[improved]
+        small_gain = gain <= tol * (np.abs(trial_value[improved]) + tol)
+        small_step = np.all(
+            np.abs(step[improved]) <= tol * (np.abs(trial[improved]) + tol), axis=1
+        )
+        params[rows] = trial[improved]
+        value[rows] = trial_value[improved]
+        n_iter[rows] += 1
+        damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+        if np.any(improved):
+            fisher[improved], score[improved] = scoring(rows, params[rows])
+            nfev[rows] += 1
+
+        done = np.zeros(len(active), dtype=bool)
+        done[np.flatnonzero(improved)[small_gain | small_step]] = True
+        converged[active[done]] = True
+        done |= (n_iter[active] >= max_iter) | (damping[active] > 1e16)
+        active, fisher, score = active[~done], fisher[~done], score[~done]
+
+    # a peak that ran off its window (or to infinity) was not fitted
+    low = np.where(mask, x, np.inf).min(axis=1)
+    high = np.where(mask, x, -np.inf).max(axis=1)
+    centres, stds = params[:, 1 : 3 * n_peaks : 3], params[:, 2 : 3 * n_peaks : 3]
+    with np.errstate(invalid="ignore"):
+        converged &= (
+            np.all(np.isfinite(params), axis=1)
+            & np.all(stds != 0, axis=1)
+            & np.all((centres >= low[:, None]) & (centres <= high[:, None]), axis=1)
+        )
+
+    fisher, _ = scoring(np.arange(n_windows), params)
+    nfev += 1
+    fisher[~np.all(np.isfinite(fisher), axis=(1, 2))] = 0
+    with np.errstate(invalid="ignore"):
+        cov = np.linalg.pinv(fisher)
+        errs = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+    errs[~converged] = np.inf
+    cov[~converged] = np.inf
+    return PoissonFits(params, errs, cov, n_iter, converged, nfev)
+
+
+def fit_peaks(
+    windows: Sequence[Window],
+    channels: Optional[np.ndarray] = None,
+    backgrounds: Optional[Sequence[Optional[np.ndarray]]] = None,
+    max_iter: int = 100,
+    tol: float = 1e-9,
+) -> PoissonFits:
+    """Poisson maximum-likelihood Gaussian fits of many windows at once; the
+    counterpart of `batch.fit_peaks`.
+
+    Args:
+        windows (Sequence[Window]): Spectrum counts, fit bounds and Gaussian guesses
+            [height, centre, std]; a guess of None is estimated from the window.
+        channels (np.ndarray, optional): Channel (or energy) of each bin, shared by
+            all spectra. Defaults to the bin index.
+        backgrounds (Sequence[np.ndarray], optional): Known background counts of
+            each window's spectrum (e.g. from `background.snip`), or None for none.
+            Defaults to None.
+        max_iter, tol: As for `solve`.
+
+    Returns:
+        PoissonFits: (N, 3) parameters and their uncertainties, and more.
+    """
+    x, y, mask, guesses = stack_windows(windows, channels)
+    offset = None
+    if backgrounds is not None:
+        offset = np.zeros(y.shape)
+        for i, (bg, (_, first, last, _)) in enumerate(zip(backgrounds, windows)):
+            if bg is not None:
+                offset[i, : last - first] = bg[first:last]
+    with profiling.stage("fit_poisson"):
+        fits = solve(x, y, mask, guesses, 1, None, offset, max_iter, tol)
+        profiling.count(np.sum(fits.nfev))
+    return fits
+
+
+def peak_fits(
+    windows: Sequence[Window],
+    fits: PoissonFits,
+    channels: Optional[np.ndarray] = None,
+) -> List[PeakFit]:
+    """The results of `fit_peaks` as PeakFits, one per window. Those that did not
+    converge have infinite uncertainties, so `engine.fit_usable` rejects them.
+    """
+    records = []
+    for i, (counts, first, last, _) in enumerate(windows):
+        x = np.arange(first, last) if channels is None else channels[first:last]
+        records.append(
+            PeakFit(
+                x,
+                counts[first:last],
+                first,
+                last,
+                fits.params[i],
+                fits.errs[i],
+                fits.cov[i],
+                int(fits.nfev[i]),
+            )
+        )
+    return records
+
+
+def fit_multiplet(
+    channels: np.ndarray,
+    counts: np.ndarray,
+    first_channel: int,
+    last_channel: int,
+    guesses: Sequence[List[float]],
+    background_order: int = 1,
+    background: Optional[np.ndarray] = None,
+    max_iter: int = 100,
+    tol: float = 1e-9,
+) -> MultipletFit:
+    """Poisson maximum-likelihood counterpart of `fitting.fit_multiplet`, with the
+    same guesses, background polynomial and result.
+    A known `background` is added to the model instead of subtracted.
+    """
+    x = np.asarray(channels[first_channel:last_channel], dtype=float)
+    y = counts[first_channel:last_channel]
+    # a positive floor keeps every expected count above zero from the start
+    p0, origin = multiplet_start(x, y, guesses, background_order, floor=0.5)
+    n_peaks = (len(p0) - background_order - 1) // 3
+    with profiling.stage("fit_poisson"):
+        fits = solve(
+            x[None],
+            y[None].astype(float),
+            np.ones((1, len(x)), dtype=bool),
+            p0[None],
+            n_peaks,
+            np.array([origin]),
+            None
+            if background is None
+            else background[None, first_channel:last_channel],
+            max_iter,
+            tol,
+        )
+        profiling.count(np.sum(fits.nfev))
+    return MultipletFit(
+        x,
+        y,
+        first_channel,
+        last_channel,
+        fits.params[0],
+        fits.errs[0],
+        fits.cov[0],
+        int(fits.nfev[0]),
+        n_peaks,
+        origin,
+    )
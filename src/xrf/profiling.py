@@ -0,0 +1,300 @@
+"""
+profiling.py
+
+Opt-in timing of the analysis, stage by stage and sample by sample: wall time, CPU
+time, `curve_fit` evaluations and, optionally, peak memory (tracemalloc) of each
+stage, reported as a summary table and as a Chrome trace-event file (open it in
+chrome://tracing or https://ui.perfetto.dev).
+
+The stages recorded are "read" (parsing a PMCA file), "fit" (all peaks of a
+sample), "curve_fit", "fit_batch" and "fit_poisson" (single fits, with their
+function evaluations), "line_fit" and "calibration" (calibration lines),
+"propagate" (peak energies and their uncertainties), and "plot" and "render"
+(matplotlib). Stages nest; a stage's evaluations and peak memory include those of
+the stages inside it. Stages run in worker processes through `pool_map` are
+recorded there and merged into this process.
+
+Profiling is off unless enabled, e.g. by `--profile` of the analysis scripts; a
+stage then costs one function call returning a shared no-op context.
+
+Author: Shiqi Xu
+"""
+
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+enabled = False
+trace_memory = False
+
+
+class Event(NamedTuple):
+    """One completed stage.
+
+    Attributes:
+        name (str): Stage, e.g. "fit".
+        sample (str): Sample (or file) it worked on, inherited from the enclosing
+            stage if not given.
+        start_ns (int): `time.perf_counter_ns()` at its start.
+        wall_ns (int): Wall time taken (ns).
+        cpu_ns (int): CPU time of this process taken (ns).
+        nfev (int): Function evaluations of the fits in it.
+        peak_bytes (int): Peak memory allocated above that at its start, or -1 if
+            memory was not traced.
+        pid (int): Process it ran in.
+        depth (int): Number of stages enclosing it.
+    """
+
+    name: str
+    sample: str
+    start_ns: int
+    wall_ns: int
+    cpu_ns: int
+    nfev: int
+    peak_bytes: int
+    pid: int
+    depth: int
+
+
+events: List[Event] = []
+_active: List["_Stage"] = []  # open stages, innermost last
+_started_tracing = False
+
+
+class _NullStage:
+    """Returned by `stage` while profiling is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("name", "sample", "start", "cpu", "nfev", "base", "peak")
+
+    def __init__(self, name: str, sample: str):
+        self.name = name
+        self.sample = sample
+        self.nfev = 0
+
+    def __enter__(self):
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # enclosing stages keep the peak so far, before it is reset for this one
+            for outer in _active:
+                outer.peak = max(outer.peak, peak)
+            if hasattr(tracemalloc, "reset_peak"):  # Python 3.9+
+                tracemalloc.reset_peak()
+            self.base = self.peak = current
+        _active.append(self)
+        self.cpu = time.process_time_ns()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        wall = time.perf_counter_ns() - self.start
+        cpu = time.process_time_ns() - self.cpu
+        _active.pop()
+        peak_bytes = -1
+        if trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = self.peak - self.base
+            for outer in _active:
+                outer.peak = max(outer.peak, self.peak)
+        if _active:
+            _active[-1].nfev += self.nfev
+        events.append(
+            Event(
+                self.name,
+                self.sample,
+                self.start,
+                wall,
+                cpu,
+                self.nfev,
+                peak_bytes,
+                os.getpid(),
+                len(_active),
+            )
+        )
+        return False
+
+
+def stage(name: str, sample: Optional[str] = None):
+    """Context manager timing a stage of the analysis, if profiling is enabled.
+
+    Args:
+        name (str): Stage, e.g. "read".
+        sample (str, optional): Sample or file it works on. Defaults to that of the
+            enclosing stage.
+    """
+    if not enabled:
+        return _null_stage
+    if sample is None:
+        sample = _active[-1].sample if _active else ""
+    return _Stage(name, sample)
+
+
+def count(nfev: int):
+    """Adds function evaluations of a fit to the innermost stage."""
+    if enabled and _active:
+        _active[-1].nfev += int(nfev)
+
+
+def configure(enable: bool, memory: bool = False):
+    """Turns profiling on or off.
+
+    Args:
+        enable (bool): Whether stages are recorded.
+        memory (bool, optional): Whether peak memory is recorded too, by tracing
+            allocations with tracemalloc, which slows Python code down several
+            times. Defaults to False.
+    """
+    global enabled, trace_memory, _started_tracing
+    enabled = enable
+    trace_memory = enable and memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+    elif not trace_memory and _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+
+class _Traced:
+    """Runs a function in a worker process with profiling on, returning its
+    result together with the events recorded there.
+    """
+
+    def __init__(self, func: Callable, memory: bool):
+        self.func = func
+        self.memory = memory
+
+    def __call__(self, *args):
+        configure(True, self.memory)
+        events.clear()
+        _active.clear()  # stages open in the parent when it forked this worker
+        try:
+            result = self.func(*args)
+        finally:
+            recorded = list(events)
+            events.clear()
+        return result, recorded
+
+
+def pool_map(pool, func: Callable, *iterables: Iterable) -> List:
+    """`pool.map(func, *iterables)` as a list, with the stages `func` runs in the
+    workers recorded here when profiling is enabled.
+    """
+    if not enabled:
+        return list(pool.map(func, *iterables))
+    results = []
+    for result, recorded in pool.map(_Traced(func, trace_memory), *iterables):
+        events.extend(recorded)
+        results.append(result)
+    return results
+
+
+def _totals(keys: Callable[[Event], tuple]) -> Dict[tuple, List[float]]:
+    totals = {}
+    for event in events:
+        total = totals.setdefault(keys(event), [0, 0, 0, 0, -1])
+        total[0] += 1
+        total[1] += event.wall_ns / 1e9
+        total[2] += event.cpu_ns / 1e9
+        total[3] += event.nfev
+        total[4] = max(total[4], event.peak_bytes)
+    return totals
+
+
+def summary() -> str:
+    """Table of the events recorded: calls, wall and CPU time, function
+    evaluations and peak memory per stage, then per sample and stage.
+    """
+    header = (
+        f"{'calls':>7} {'wall (s)':>10} {'cpu (s)':>10} {'nfev':>8} {'peak (MiB)':>11}"
+    )
+
+    def row(total: List[float]) -> str:
+        calls, wall, cpu, nfev, peak = total
+        memory = "-" if peak < 0 else f"{peak / 2**20:.2f}"
+        return f"{calls:7d} {wall:10.4f} {cpu:10.4f} {nfev:8d} {memory:>11}"
+
+    lines = [f"{'stage':16s} {header}"]
+    for (name,), total in _totals(lambda e: (e.name,)).items():
+        lines.append(f"{name:16s} {row(total)}")
+    by_sample = _totals(lambda e: (e.sample, e.name))
+    width = max([len(sample) for sample, _ in by_sample] + [len("sample")])
+    lines += ["", f"{'sample':{width}s} {'stage':16s} {header}"]
+    for (sample, name), total in sorted(by_sample.items(), key=lambda item: item[0]):
+        if sample:
+            lines.append(f"{sample:{width}s} {name:16s} {row(total)}")
+    return "\n".join(lines)
+
+
+def write_trace(path: Path):
+    """Writes the events recorded as Chrome trace events (complete "X" events, one
+    row per process), with the sample, CPU time, evaluations and memory as args.
+    """
+    origin = min((event.start_ns for event in events), default=0)
+    main_pid = os.getpid()
+    trace = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": "main" if pid == main_pid else f"worker {pid}"},
+        }
+        for pid in sorted({event.pid for event in events})
+    ]
+    for event in events:
+        args = {"sample": event.sample, "cpu_ms": event.cpu_ns / 1e6}
+        if event.nfev:
+            args["nfev"] = event.nfev
+        if event.peak_bytes >= 0:
+            args["peak_kib"] = event.peak_bytes / 1024
+        trace.append(
+            {
+                "name": event.name,
+                "cat": "xrf",
+                "ph": "X",
+                "ts": (event.start_ns - origin) / 1e3,
+                "dur": event.wall_ns / 1e3,
+                "pid": event.pid,
+                "tid": event.pid,
+                "args": args,
+            }
+        )
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+
+
+@contextmanager
+def session(trace: Optional[Path], memory: bool = False) -> Iterator[None]:
+    """Profiles the code inside it if `trace` is given, then prints the summary
+    and writes the trace there. Does nothing if `trace` is None.
+    """
+    if trace is None:
+        yield
+        return
+    configure(True, memory)
+    events.clear()
+    try:
+        yield
+    finally:
+        configure(False)
+        print(summary())
+        write_trace(trace)
+        print(f"trace saved to {trace}")
@@ -0,0 +1,205 @@
+"""
+propagate.py
+
+Propagation of calibration and peak-centre uncertainties to peak energies,
+E = slope * centre + intercept, with the full covariance of both: the
+slope-intercept correlation of the calibration line, and the correlation it
+induces between the energies of peaks on the same line.
+
+`analytic` is the first-order (linear) propagation, J cov J^T, which is exact up
+to the product of slope and centre errors. `monte_carlo` draws the calibration
+and centres from their multivariate normal distributions instead and takes the
+mean and covariance of the energies over the draws. Both take any number of
+calibrations and sets of peaks at once, broadcast along leading axes, e.g. the
+peaks of one sample, (P,), against C calibrations, (C, 2), give (C, P) energies
+and (C, P, P) covariances, in one batched NumPy operation.
+
+The centres are taken as independent of the calibration, which holds for peaks
+calibrated with a line fitted to other spectra. They may be correlated with each
+other, as the centres of a multiplet fitted in one solve are: give their full
+covariance as `centre_cov` (e.g. from `engine.centre_cov`) instead of just their
+uncertainties.
+
+Author: Shiqi Xu
+"""
+
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from xrf.fitting import CalibFit, weighted_lines
+
+
+class Propagated(NamedTuple):
+    """Peak energies and their covariance.
+
+    Attributes:
+        energies (np.ndarray[float]): (..., P) energies (keV).
+        cov (np.ndarray[float]): (..., P, P) covariance of `energies`; infinite
+            where the calibration's or the centres' was not finite.
+    """
+
+    energies: np.ndarray
+    cov: np.ndarray
+
+    @property
+    def errs(self) -> np.ndarray:
+        """Uncertainty of each energy."""
+        return np.sqrt(np.diagonal(self.cov, axis1=-2, axis2=-1))
+
+    @property
+    def correlation(self) -> np.ndarray:
+        """Correlation matrix of the energies."""
+        errs = self.errs
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.cov / (errs[..., :, None] * errs[..., None, :])
+
+
+def calibration_cov(calibration: CalibFit) -> np.ndarray:
+    """Covariance of a calibration line's [slope, intercept].
+
+    That of its fit if determined; otherwise, for a line through two points, that
+    of the absolute-sigma weighted fit through them, each energy uncertain by
+    |slope| times its centre's uncertainty (`fitting.weighted_lines`).
+
+    Args:
+        calibration (CalibFit): Calibration line.
+
+    Returns:
+        np.ndarray[float]: 2x2 covariance.
+    """
+    cov = np.array(calibration.cov, dtype=float)
+    if np.all(np.isfinite(cov)) or len(calibration.peak_centres) < 2:
+        return cov
+    return weighted_lines(
+        calibration.peak_centres,
+        calibration.energies,
+        abs(calibration.params[0]) * np.asarray(calibration.peak_centre_errs),
+        absolute_sigma=True,
+    )[1]
+
+
+def _inputs(
+    centres: np.ndarray,
+    centre_errs: np.ndarray,
+    params: np.ndarray,
+    cov: np.ndarray,
+    centre_cov: Optional[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Broadcasts the inputs to a common batch shape, with the centres' covariance
+    (diagonal unless given), and non-finite covariances set to 0 and flagged.
+    """
+    centres = np.asarray(centres, dtype=float)
+    if centre_cov is None:
+        centre_errs = np.asarray(centre_errs, dtype=float)
+        diagonal = np.arange(centre_errs.shape[-1])
+        centre_cov = np.zeros(centre_errs.shape + diagonal.shape)
+        centre_cov[..., diagonal, diagonal] = centre_errs**2
+    centre_cov = np.asarray(centre_cov, dtype=float)
+    params = np.asarray(params, dtype=float)
+    cov = np.asarray(cov, dtype=float)
+    batch = np.broadcast_shapes(
+        centres.shape[:-1], centre_cov.shape[:-2], params.shape[:-1], cov.shape[:-2]
+    )
+    n_peaks = centres.shape[-1]
+    centres = np.broadcast_to(centres, batch + (n_peaks,))
+    centre_cov = np.broadcast_to(centre_cov, batch + (n_peaks, n_peaks))
+    params = np.broadcast_to(params, batch + (2,))
+    cov = np.broadcast_to(cov, batch + (2, 2))
+    undetermined = ~np.all(np.isfinite(cov), axis=(-2, -1))
+    undetermined |= ~np.all(np.isfinite(centre_cov), axis=(-2, -1))
+    cov = np.where(undetermined[..., None, None], 0, cov)
+    centre_cov = np.where(undetermined[..., None, None], 0, centre_cov)
+    return centres, centre_cov, params, cov, undetermined
+
+
+def _undetermined(cov: np.ndarray, undetermined: np.ndarray) -> np.ndarray:
+    return np.where(undetermined[..., None, None], np.inf, cov)
+
+
+def analytic(
+    centres: np.ndarray,
+    centre_errs: np.ndarray,
+    params: np.ndarray,
+    cov: np.ndarray,
+    centre_cov: Optional[np.ndarray] = None,
+) -> Propagated:
+    """First-order propagation: cov(E) = J cov J^T + slope^2 cov(centres), for
+    J = [centre, 1] the derivatives of each energy w.r.t. the line.
+
+    Args:
+        centres (np.ndarray[float]): (..., P) peak centres (channels).
+        centre_errs (np.ndarray[float]): (..., P) uncertainties of the centres,
+            taken as uncorrelated unless `centre_cov` is given.
+        params (np.ndarray[float]): (..., 2) calibration [slope, intercept].
+        cov (np.ndarray[float]): (..., 2, 2) covariance of `params`, e.g. from
+            `calibration_cov`.
+        centre_cov (np.ndarray[float], optional): (..., P, P) covariance of the
+            centres, used instead of `centre_errs`. Defaults to None.
+
+    Returns:
+        Propagated: Energies and their covariance.
+    """
+    centres, centre_cov, params, cov, undetermined = _inputs(
+        centres, centre_errs, params, cov, centre_cov
+    )
+    slope, intercept = params[..., 0], params[..., 1]
+    energies = slope[..., None] * centres + intercept[..., None]
+    jac = np.stack([centres, np.ones_like(centres)], axis=-1)
+    energy_cov = np.einsum("...ik,...kl,...jl->...ij", jac, cov, jac)
+    energy_cov += slope[..., None, None] ** 2 * centre_cov
+    return Propagated(energies, _undetermined(energy_cov, undetermined))
+
+
+def _factor(cov: np.ndarray) -> np.ndarray:
+    """Batched square roots L of covariances, L L^T = cov, which unlike Cholesky
+    factors exist for singular ones (e.g. of a line with an exact intercept).
+    """
+    values, vectors = np.linalg.eigh(cov)
+    return vectors * np.sqrt(np.clip(values, 0, None))[..., None, :]
+
+
+def monte_carlo(
+    centres: np.ndarray,
+    centre_errs: np.ndarray,
+    params: np.ndarray,
+    cov: np.ndarray,
+    n_draws: int = 10000,
+    seed: Optional[int] = 0,
+    centre_cov: Optional[np.ndarray] = None,
+) -> Propagated:
+    """Monte Carlo propagation: the calibration and centres are drawn from their
+    normal distributions, all batches and peaks in one array, and
+    the energies' mean and covariance taken over the draws.
+
+    Args:
+        centres (np.ndarray[float]): (..., P) peak centres (channels).
+        centre_errs (np.ndarray[float]): (..., P) uncertainties of the centres,
+            taken as uncorrelated unless `centre_cov` is given.
+        params (np.ndarray[float]): (..., 2) calibration [slope, intercept].
+        cov (np.ndarray[float]): (..., 2, 2) covariance of `params`.
+        n_draws (int, optional): Draws per batch; the uncertainties are then
+            accurate to about 1 / sqrt(2 n_draws) relative. Defaults to 10000.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+        centre_cov (np.ndarray[float], optional): (..., P, P) covariance of the
+            centres, used instead of `centre_errs`. Defaults to None.
+
+    Returns:
+        Propagated: Mean energies and their covariance.
+    """
+    centres, centre_cov, params, cov, undetermined = _inputs(
+        centres, centre_errs, params, cov, centre_cov
+    )
+    rng = np.random.default_rng(seed)
+    # draws along the second-to-last axis, so the products below are batched matmuls
+    line_draws = params[..., None, :] + rng.standard_normal(
+        params.shape[:-1] + (n_draws, 2)
+    ) @ np.swapaxes(_factor(cov), -1, -2)
+    centre_draws = centres[..., None, :] + rng.standard_normal(
+        centres.shape[:-1] + (n_draws, centres.shape[-1])
+    ) @ np.swapaxes(_factor(centre_cov), -1, -2)
+    energies = line_draws[..., 0:1] * centre_draws + line_draws[..., 1:2]
+    mean = energies.mean(axis=-2)
+    deviations = energies - mean[..., None, :]
+    energy_cov = np.swapaxes(deviations, -1, -2) @ deviations / (n_draws - 1)
+    return Propagated(mean, _undetermined(energy_cov, undetermined))
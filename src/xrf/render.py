@@ -0,0 +1,85 @@
+"""
+render.py
+
+Renders queued figures headless (Agg backend) in a pool of worker processes, so
+saving the PNGs of a whole batch no longer runs one figure at a time through the
+pyplot state of the main process.
+
+Author: Shiqi Xu
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from xrf import profiling
+
+
+class Figure(NamedTuple):
+    """A figure to render: a `plotting` function and its arguments.
+
+    Attributes:
+        plot (str): Name of the function in `xrf.plotting`, e.g. "plot_peak_fit".
+        path_save (Path): Where to save the figure.
+        args (tuple): Positional arguments, e.g. (PeakFit, sample).
+        kwargs (Dict[str, Any], optional): Keyword arguments. Defaults to None.
+    """
+
+    plot: str
+    path_save: Path
+    args: tuple
+    kwargs: Optional[Dict[str, Any]] = None
+
+
+def _use_agg():
+    import matplotlib
+
+    matplotlib.use("Agg", force=True)
+
+
+def render_figure(figure: Figure) -> Path:
+    """Renders one figure, writing it atomically: the image is saved to a
+    temporary file beside `figure.path_save`, then renamed over it.
+
+    Args:
+        figure (Figure): Figure to render.
+
+    Returns:
+        Path: Where the figure was saved.
+    """
+    from xrf import plotting
+
+    path_save = Path(figure.path_save)
+    tmp_path = path_save.with_name(f".{path_save.stem}.{os.getpid()}{path_save.suffix}")
+    try:
+        with profiling.stage("render", path_save.name):
+            getattr(plotting, figure.plot)(
+                *figure.args, path_save=tmp_path, **(figure.kwargs or {})
+            )
+        os.replace(tmp_path, path_save)
+    finally:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+    return path_save
+
+
+def render(figures: Sequence[Figure], workers: Optional[int] = None) -> List[Path]:
+    """Renders figures in a pool of worker processes using the Agg backend.
+
+    Args:
+        figures (Sequence[Figure]): Figures to render.
+        workers (int, optional): Number of worker processes. Defaults to one per
+            CPU; 1 renders in this process (still with Agg).
+
+    Returns:
+        List[Path]: Where each figure was saved, in the order given.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(figures))
+    if workers <= 1:
+        _use_agg()
+        return [render_figure(figure) for figure in figures]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+        return profiling.pool_map(pool, render_figure, figures)
@@ -0,0 +1,199 @@
+"""
+resample.py
+
+Moves spectra between channel scales, conserving counts, so that spectra of
+different detector settings (e.g. Default and High Rate, with different gains) can
+be compared or added channel by channel:
+
+- `rebin_factor` sums groups of adjacent channels;
+- `rebin` redistributes counts onto arbitrary bins, the same for every spectrum;
+- `to_energy` puts each spectrum of a stack, with its own calibration line, onto
+  common energy bins;
+- `to_gain` resamples spectra taken at one gain onto the channels of another, as
+  read from the PMCA headers (e.g. High Rate, 5.997, onto Default, 12.000).
+
+Each bin's counts are taken as spread uniformly over its width, i.e. the cumulative
+counts are interpolated linearly between bin edges. Every function takes one
+spectrum or a stack of them, with channels along the last axis, in one pass.
+
+Author: Shiqi Xu
+"""
+
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from xrf import calib
+
+
+def channel_edges(n_channels: int, slope: float, intercept: float) -> np.ndarray:
+    """Energy edges of every channel's bin, channel i spanning i - 1/2 to i + 1/2.
+
+    Args:
+        n_channels (int): Number of channels.
+        slope (float): Calibration slope (keV per channel).
+        intercept (float): Calibration intercept (keV).
+
+    Returns:
+        np.ndarray[float]: The n_channels + 1 bin edges (keV).
+    """
+    return calib.line(np.arange(n_channels + 1) - 0.5, slope, intercept)
+
+
+def energy_grid(start: float, stop: float, width: float) -> np.ndarray:
+    """Edges of bins of equal `width` from `start` to (at least) `stop`, in keV."""
+    n_bins = int(np.ceil((stop - start) / width))
+    return start + width * np.arange(n_bins + 1)
+
+
+def bin_centres(edges: np.ndarray) -> np.ndarray:
+    """Midpoint of each bin."""
+    return 0.5 * (edges[1:] + edges[:-1])
+
+
+def weights(
+    source_edges: np.ndarray, target_edges: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Interpolation of cumulative counts at the target edges, shared by all spectra.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Index of the source bin holding each target
+            edge, and the fraction of that bin below the edge.
+    """
+    source_edges = np.asarray(source_edges, dtype=float)
+    if np.any(np.diff(source_edges) <= 0):
+        raise ValueError("source bin edges must be increasing")
+    target_edges = np.asarray(target_edges, dtype=float)
+    if np.any(np.diff(target_edges) <= 0):
+        raise ValueError("target bin edges must be increasing")
+    n_bins = len(source_edges) - 1
+    # edges outside the source range clamp to its ends: those counts are dropped
+    position = np.interp(target_edges, source_edges, np.arange(n_bins + 1))
+    index = np.minimum(position.astype(int), n_bins - 1)
+    return index, position - index
+
+
+def rebin(
+    counts: np.ndarray, source_edges: np.ndarray, target_edges: np.ndarray
+) -> np.ndarray:
+    """Redistributes histogram counts onto other bins, conserving their total over
+    the range both sets of bins cover.
+
+    Args:
+        counts (np.ndarray): Counts in each source bin; a stack of spectra may be
+            given, with bins along the last axis.
+        source_edges (np.ndarray[float]): The len(counts) + 1 increasing edges of
+            the source bins, e.g. from `channel_edges`.
+        target_edges (np.ndarray[float]): Increasing edges of the new bins.
+
+    Returns:
+        np.ndarray[float]: Counts in each new bin, len(target_edges) - 1 along the
+            last axis. Bins outside the source range get none.
+    """
+    counts = np.asarray(counts, dtype=float)
+    if counts.shape[-1] != len(source_edges) - 1:
+        raise ValueError(
+            f"{counts.shape[-1]} bins of counts for {len(source_edges)} source edges"
+        )
+    index, fraction = weights(source_edges, target_edges)
+    cumulative = np.zeros(counts.shape[:-1] + (counts.shape[-1] + 1,))
+    np.cumsum(counts, axis=-1, out=cumulative[..., 1:])
+    below = cumulative[..., index]
+    at_edges = below + fraction * (cumulative[..., index + 1] - below)
+    return np.diff(at_edges, axis=-1)
+
+
+def rebin_factor(counts: np.ndarray, factor: int) -> np.ndarray:
+    """Sums each `factor` adjacent channels into one, e.g. 2048 channels into 1024
+    for factor 2. Channels left over at the end are dropped.
+
+    Args:
+        counts (np.ndarray): Spectrum, or stack of spectra with channels along the
+            last axis.
+        factor (int): Channels per new channel.
+
+    Returns:
+        np.ndarray: The coarser spectra, of the dtype of `counts`.
+    """
+    counts = np.asarray(counts)
+    if factor < 1:
+        raise ValueError(f"rebinning factor {factor} is not a positive integer")
+    n_bins = counts.shape[-1] // factor
+    grouped = counts[..., : n_bins * factor].reshape(
+        counts.shape[:-1] + (n_bins, factor)
+    )
+    return grouped.sum(axis=-1)
+
+
+def to_energy(
+    counts: np.ndarray,
+    slopes: Union[float, np.ndarray],
+    intercepts: Union[float, np.ndarray],
+    edges: np.ndarray,
+) -> np.ndarray:
+    """Puts spectra with different linear calibrations onto common energy bins.
+
+    The channel edge below each target edge is found by inverting each spectrum's
+    calibration, so the whole stack is resampled in one vectorized pass.
+
+    Args:
+        counts (np.ndarray): (channels,) spectrum or (N, channels) stack.
+        slopes (np.ndarray[float]): Calibration slope of each spectrum (keV per
+            channel), or one for all of them. Must be positive.
+        intercepts (np.ndarray[float]): Calibration intercept of each spectrum (keV),
+            or one for all of them.
+        edges (np.ndarray[float]): Increasing target bin edges (keV).
+
+    Returns:
+        np.ndarray[float]: Counts in each target bin, (len(edges) - 1,) or
+            (N, len(edges) - 1).
+    """
+    counts = np.asarray(counts, dtype=float)
+    stack = np.atleast_2d(counts)
+    n_spectra, n_channels = stack.shape
+    slopes = np.broadcast_to(np.asarray(slopes, dtype=float), (n_spectra,))
+    intercepts = np.broadcast_to(np.asarray(intercepts, dtype=float), (n_spectra,))
+    if np.any(slopes <= 0):
+        raise ValueError("calibration slopes must be positive")
+    edges = np.asarray(edges, dtype=float)
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError("target bin edges must be increasing")
+    # fractional index of the channel edge at each target edge, per spectrum;
+    # edges outside the channel range clamp to its ends: those counts are dropped
+    offsets = edges - intercepts[:, None]
+    position = np.clip(offsets / slopes[:, None] + 0.5, 0, n_channels)
+    index = np.minimum(position.astype(int), n_channels - 1)
+    cumulative = np.zeros((n_spectra, n_channels + 1))
+    np.cumsum(stack, axis=-1, out=cumulative[:, 1:])
+    below = np.take_along_axis(cumulative, index, axis=1)
+    above = np.take_along_axis(cumulative, index + 1, axis=1)
+    rebinned = np.diff(below + (position - index) * (above - below), axis=1)
+    return rebinned[0] if counts.ndim == 1 else rebinned
+
+
+def to_gain(
+    counts: np.ndarray,
+    gains: Union[float, np.ndarray],
+    target_gain: float,
+    n_channels: Optional[int] = None,
+) -> np.ndarray:
+    """Resamples spectra taken at some gains onto the channels of another gain.
+
+    Energy per channel goes as 1 / gain, so channel c at gain g lands on channel
+    c * target_gain / g. The offset of the energy scale is neglected, as it is by
+    comparing calibration slopes scaled by the gain ratio.
+
+    Args:
+        counts (np.ndarray): (channels,) spectrum or (N, channels) stack.
+        gains (np.ndarray[float]): Total gain of each spectrum (`pmca.Spectrum.gain`),
+            or one for all of them.
+        target_gain (float): Gain whose channels to resample onto.
+        n_channels (int, optional): Number of target channels. Defaults to the
+            number of channels of `counts`.
+
+    Returns:
+        np.ndarray[float]: Counts in each target channel.
+    """
+    n_channels = np.shape(counts)[-1] if n_channels is None else n_channels
+    slopes = target_gain / np.asarray(gains, dtype=float)
+    return to_energy(counts, slopes, 0.0, np.arange(n_channels + 1) - 0.5)
@@ -0,0 +1,210 @@
+"""
+synthetic.py
+
+Seeded synthetic spectra, for benchmarks and for checking the analysis on known
+peaks: Gaussian peaks on a continuum with Poisson noise, written in the
+`<<PMCA SPECTRUM>>` layout of the files in `data/` (header, counts, DP5
+configuration and DPP status of either detector mode), so that they go through
+`pmca` and `calib.read_data` exactly as real runs do.
+
+Author: Shiqi Xu
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+
+from xrf import pmca
+from xrf.fitting import gaussian
+
+
+# DP5 settings of each detector mode, as saved by PMCA: code -> (value, description)
+DP5_SETTINGS = {
+    "default": {
+        "RESC": ("?", "Reset Configuration"),
+        "CLCK": ("80", "20MHz/80MHz"),
+        "TPEA": ("1.000", "Peaking Time"),
+        "GAIF": ("1.0295", "Fine Gain"),
+        "GAIN": ("12.000", "Total Gain (Analog * Fine)"),
+        "RESL": ("102", "Detector Reset Lockout"),
+        "TFLA": ("0.200", "Flat Top"),
+        "PURE": ("ON", "PUR Interval On/Off"),
+        "MCAC": ("{channels}", "MCA/MCS Channels"),
+        "GAIA": ("12", "Analog Gain Index"),
+        "THSL": ("1.953", "Slow Threshold"),
+        "THFA": ("10.00", "Fast Threshold"),
+        "HVSE": ("-130", "HV Set"),
+        "TECS": ("230", "TEC Set"),
+    },
+    "high_rate": {
+        "RESC": ("?", "Reset Configuration"),
+        "CLCK": ("80", "20MHz/80MHz"),
+        "TPEA": ("0.400", "Peaking Time"),
+        "GAIF": ("1.0036", "Fine Gain"),
+        "GAIN": ("5.997", "Total Gain (Analog * Fine)"),
+        "RESL": ("60", "Detector Reset Lockout"),
+        "TFLA": ("0.100", "Flat Top"),
+        "PURE": ("ON", "PUR Interval On/Off"),
+        "MCAC": ("{channels}", "MCA/MCS Channels"),
+        "GAIA": ("9", "Analog Gain Index"),
+        "THSL": ("1.464", "Slow Threshold"),
+        "THFA": ("15.00", "Fast Threshold"),
+        "HVSE": ("-130", "HV Set"),
+        "TECS": ("230", "TEC Set"),
+    },
+}
+
+
+def expected(
+    peaks: Sequence[Sequence[float]],
+    n_channels: int = 2048,
+    continuum: Union[float, np.ndarray] = 0.0,
+) -> np.ndarray:
+    """Noise-free counts of Gaussian peaks on a continuum.
+
+    Args:
+        peaks (Sequence[Sequence[float]]): [height, centre, std] of each peak.
+        n_channels (int, optional): Number of channels. Defaults to 2048.
+        continuum (float or np.ndarray, optional): Expected continuum counts, the
+            same in every channel or per channel. Defaults to 0.
+
+    Returns:
+        np.ndarray[float]: Expected counts in each channel.
+    """
+    channels = np.arange(n_channels)
+    mean = np.broadcast_to(np.asarray(continuum, dtype=float), (n_channels,)).copy()
+    for height, centre, std in peaks:
+        mean += gaussian(channels, height, centre, std)
+    return mean
+
+
+def exponential_continuum(
+    n_channels: int = 2048, level: float = 2.0, scale: float = 400.0
+) -> np.ndarray:
+    """A continuum falling off as level * exp(-channel / scale)."""
+    return level * np.exp(-np.arange(n_channels) / scale)
+
+
+def spectra(
+    n_spectra: int,
+    peaks: Sequence[Sequence[float]],
+    n_channels: int = 2048,
+    continuum: Union[float, np.ndarray] = 0.0,
+    seed: Optional[int] = 0,
+) -> np.ndarray:
+    """Independent Poisson draws of the same expected spectrum.
+
+    Args:
+        n_spectra (int): Number of spectra.
+        peaks, n_channels, continuum: As for `expected`.
+        seed (int, optional): Seed of the random generator; the same seed gives
+            the same spectra. Defaults to 0.
+
+    Returns:
+        np.ndarray[int]: (n_spectra, n_channels) counts.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.poisson(expected(peaks, n_channels, continuum), (n_spectra, n_channels))
+
+
+def pmca_text(
+    counts: np.ndarray,
+    live_time: float = 100.0,
+    real_time: Optional[float] = None,
+    mode: str = "default",
+    start_time: Optional[datetime] = None,
+    description: str = "",
+) -> bytes:
+    """Contents of a PMCA file of a spectrum.
+
+    Args:
+        counts (np.ndarray[int]): Counts in each channel.
+        live_time (float, optional): LIVE_TIME (s). Defaults to 100.
+        real_time (float, optional): REAL_TIME (s). Defaults to `live_time`.
+        mode (str, optional): Detector mode whose DP5 settings are saved, "default"
+            or "high_rate". Defaults to "default".
+        start_time (datetime, optional): START_TIME. Defaults to 2022-03-30 12:00.
+        description (str, optional): DESCRIPTION. Defaults to "".
+
+    Returns:
+        bytes: The file, encoded as PMCA writes it.
+    """
+    real_time = live_time if real_time is None else real_time
+    start_time = datetime(2022, 3, 30, 12) if start_time is None else start_time
+    slow_count = int(np.sum(counts))
+    settings = DP5_SETTINGS[mode]
+    lines = [
+        "<<PMCA SPECTRUM>>",
+        "TAG - live_data",
+        f"DESCRIPTION - {description}",
+        "GAIN - 3",
+        "THRESHOLD - 0",
+        "LIVE_MODE - 0",
+        "PRESET_TIME - 0",
+        f"LIVE_TIME - {live_time:.6f}",
+        f"REAL_TIME - {real_time:.6f}",
+        f"START_TIME - {start_time:%m/%d/%Y %H:%M:%S}",
+        "SERIAL_NUMBER - 0",
+        "<<DATA>>",
+        *(str(int(count)) for count in counts),
+        "<<END>>",
+        "<<DP5 CONFIGURATION>>",
+        *(
+            f"{code}={value.format(channels=len(counts))};    {label}"
+            for code, (value, label) in settings.items()
+        ),
+        "<<DP5 CONFIGURATION END>>",
+        "<<DPP STATUS>>",
+        "Device Type: PX5",
+        "Serial Number: 2892",
+        "Firmware: 6.08  Build:  6",
+        "FPGA: 6.11",
+        f"Fast Count: {slow_count}",
+        f"Slow Count: {slow_count}",
+        "GP Count: 0",
+        f"Accumulation Time: {real_time:.6f}",
+        f"Real Time: {real_time:.6f}",
+        f"Dead Time: {100 * (1 - live_time / real_time):.2f}%",
+        "HV Volt: -130V",
+        "TEC Temp: 230K",
+        "Board Temp: 37\N{DEGREE SIGN}C",
+        "<<DPP STATUS END>>",
+    ]
+    return ("\n".join(lines) + "\n").encode(pmca.ENCODING)
+
+
+def write_spectra(
+    directory: Path,
+    counts: np.ndarray,
+    live_time: float = 100.0,
+    mode: str = "default",
+    prefix: str = "synthetic",
+) -> List[Path]:
+    """Writes each spectrum of a stack to its own PMCA file, started a run apart.
+
+    Args:
+        directory (Path): Directory to write to. Created if it does not exist.
+        counts (np.ndarray[int]): (N, channels) counts.
+        live_time (float, optional): LIVE_TIME of every spectrum (s).
+            Defaults to 100.
+        mode (str, optional): Detector mode, as for `pmca_text`.
+            Defaults to "default".
+        prefix (str, optional): File names are `<prefix>_<index>.csv`.
+            Defaults to "synthetic".
+
+    Returns:
+        List[Path]: The files written, in order.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    start = datetime(2022, 3, 30, 12)
+    width = len(str(len(counts) - 1))
+    files = []
+    for i, spectrum in enumerate(counts):
+        file = directory / f"{prefix}_{i:0{width}d}.csv"
+        started = start + i * timedelta(seconds=live_time)
+        file.write_bytes(pmca_text(spectrum, live_time, mode=mode, start_time=started))
+        files.append(file)
+    return files
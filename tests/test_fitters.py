@@ -0,0 +1,121 @@
+"""
+test_fitters.py
+
+Regression tests of the vectorized peak fitters on the coin windows, some of which
+they do not converge on: those fits must be flagged, and the engine must refit
+them rather than report them. The multiplets of the catalog must converge under
+every fitter.
+
+Author: Shiqi Xu
+"""
+
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from xrf import artifacts, batch, cache, calib, engine, fitcache, poisson
+
+catalog_path = Path(__file__).resolve().parents[1] / "data" / "catalog.json"
+
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """Caches and calibration artifacts in a temporary directory."""
+    monkeypatch.setattr(artifacts, "artifact_dir", tmp_path / "calibrations")
+    cache.configure(directory=tmp_path / "cache")
+    fitcache.configure(enable=False)
+
+
+def coin_windows():
+    """(sample, window) of every coin peak in the catalog."""
+    catalog = engine.Engine(catalog_path)
+    windows = []
+    for name in catalog.analyses["coins"]["samples"]:
+        sample = catalog.sample(name)
+        counts = calib.read_data(sample.file)
+        windows += [
+            (name, (counts, p.first_channel, p.last_channel, p.guess))
+            for p in sample.peaks
+        ]
+    return windows
+
+
+def check_flagged(windows, params, errs, converged):
+    """Fits of centres outside their windows are flagged, with infinite errors."""
+    for (_, first, last, _), p, e, ok in zip(windows, params, errs, converged):
+        if ok:
+            assert first <= p[1] <= last - 1
+            assert np.all(np.isfinite(e))
+        else:
+            assert np.all(np.isinf(e))
+
+
+def test_batch_flags_diverged_coin_fits():
+    windows = [window for _, window in coin_windows()]
+    params, errs, _, converged = batch.fit_peaks(windows, full_output=True)
+    check_flagged(windows, params, errs, converged)
+    diverged = [w[1:3] for w, ok in zip(windows, converged) if not ok]
+    assert (664, 703) in diverged
+
+
+def test_poisson_flags_diverged_coin_fits():
+    windows = [window for _, window in coin_windows()]
+    fits = poisson.fit_peaks(windows)
+    check_flagged(windows, fits.params, fits.errs, fits.converged)
+    records = poisson.peak_fits(windows, fits)
+    usable = [engine.fit_usable(record) for record in records]
+    assert usable == list(fits.converged)
+    assert not usable[[w[1:3] for w in windows].index((664, 703))]
+
+
+@pytest.mark.parametrize("fitter", ["batch", "poisson"])
+def test_engine_refits_failed_coin_fits(fitter):
+    reference = engine.Engine(catalog_path).run(
+        {"coins": None}, save_figures=False, workers=1
+    )["coins"]
+    with pytest.warns(RuntimeWarning, match="refitted with curve_fit"):
+        results = engine.Engine(catalog_path, fitter=fitter).run(
+            {"coins": None}, save_figures=False, workers=1
+        )["coins"]
+    for name, result in results.items():
+        low, high = result.energies[0], result.energies[-1]
+        assert np.all((result.peak_energies >= low) & (result.peak_energies <= high))
+        assert np.all(np.isfinite(result.peak_energy_errs))
+        for fit in result.fits:
+            assert engine.fit_usable(fit)
+    # CN_new 448-495 is refitted as curve_fit fits it (the energies differ a little,
+    # since the calibration is fitted with `fitter` too)
+    peak = [
+        (p.first_channel, p.last_channel) for p in results["CN_new"].sample.peaks
+    ].index((448, 495))
+    assert results["CN_new"].fits[peak].params[1] == pytest.approx(
+        reference["CN_new"].fits[peak].params[1], abs=1e-9
+    )
+    assert results["CN_new"].peak_energies[peak] == pytest.approx(
+        reference["CN_new"].peak_energies[peak], abs=0.1
+    )
+
+
+@pytest.mark.parametrize("fitter", ["curve_fit", "batch", "poisson"])
+def test_engine_fits_catalog_multiplets(fitter):
+    """The Pb-210 and CA_old multiplets converge under every fitter, to centres
+    within their uncertainties of the least-squares ones.
+    """
+    requests = {"radioactive": ["pb210"], "coins": ["CA_old"]}
+    reference = engine.Engine(catalog_path).run(requests, save_figures=False, workers=1)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error", ".*refitted with curve_fit", RuntimeWarning)
+        results = engine.Engine(catalog_path, fitter=fitter).run(
+            requests, save_figures=False, workers=1
+        )
+    for analysis, name in (("radioactive", "pb210"), ("coins", "CA_old")):
+        result, expected = results[analysis][name], reference[analysis][name]
+        grouped = [i for i, p in enumerate(result.sample.peaks) if p.multiplet]
+        assert len(grouped) == 2
+        for i in grouped:
+            fit = result.fits[i]
+            assert engine.fit_usable(fit)
+            assert fit.centre_covs is not None and len(fit.centre_covs) == 2
+            assert abs(fit.params[1] - expected.fits[i].params[1]) < 3 * fit.errs[1]